@@ -12,6 +12,7 @@ export default function Home() {
   const [currentStep, setCurrentStep] = useState<"upload" | "processing" | "complete" | "failed">("upload")
   const [taskId, setTaskId] = useState<string | null>(null)
   const [resultUrl, setResultUrl] = useState<string | null>(null)
+  const [posterUrl, setPosterUrl] = useState<string | null>(null)
   const [errorMessage, setErrorMessage] = useState<string | null>(null)
   const [processingStage, setProcessingStage] = useState<string>("Uploading...")
 
@@ -62,6 +63,7 @@ export default function Home() {
         case "COMPLETE":
           setCurrentStep("complete")
           setResultUrl(data.result_url)
+          setPosterUrl(data.poster_url || null)
           return // Stop polling
         case "FAILED":
           setCurrentStep("failed")
@@ -110,7 +112,7 @@ export default function Home() {
 
           {currentStep === "processing" && <ProcessingStatus stage={processingStage} />}
 
-          {currentStep === "complete" && resultUrl && <ResultDisplay resultUrl={resultUrl} />}
+          {currentStep === "complete" && resultUrl && <ResultDisplay resultUrl={resultUrl} posterUrl={posterUrl} />}
 
           {currentStep === "failed" && (
             <div className="text-center p-6">
@@ -0,0 +1,287 @@
+"""
+Soundtrack preparation.
+
+Soundtracks are looped or trimmed to the target duration and encoded to AAC
+once, then cached by (content hash, duration, codec, bitrate, sample rate).
+Composition only has to stream-copy the prepared track into the final MP4.
+
+Custom uploads are ingested at request time: ffmpeg decodes only the seconds
+that can be used, and only that compact AAC is stored.
+"""
+
+import os
+import subprocess
+
+from .cache import DiskLRUCache, DEFAULT_CACHE_ROOT, content_hash
+from .cpu_budget import thread_args
+from .slate import SEGMENT_AUDIO_CODEC, SEGMENT_AUDIO_BITRATE, SEGMENT_AUDIO_RATE
+
+# Prepared tracks use the segment audio parameters so they can also be
+# concat-copied next to a slate's silent track.
+PREPARED_AUDIO_CODEC = SEGMENT_AUDIO_CODEC
+PREPARED_AUDIO_BITRATE = SEGMENT_AUDIO_BITRATE
+PREPARED_AUDIO_RATE = SEGMENT_AUDIO_RATE
+PREPARED_AUDIO_SUFFIX = ".m4a"
+
+# Largest custom soundtrack upload accepted (CHIBICLIP_MAX_AUDIO_UPLOAD_MB)
+MAX_AUDIO_UPLOAD_BYTES = int(os.getenv("CHIBICLIP_MAX_AUDIO_UPLOAD_MB", "50")) * 1024 * 1024
+INGEST_CHUNK_SIZE = 64 * 1024
+
+_default_audio_cache = None
+
+
+class AudioUploadTooLarge(ValueError):
+    """Raised when an uploaded soundtrack exceeds MAX_AUDIO_UPLOAD_BYTES."""
+
+
+def build_prepare_cmd(audio_path, dest_path, duration, codec=PREPARED_AUDIO_CODEC,
+                      bitrate=PREPARED_AUDIO_BITRATE, sample_rate=PREPARED_AUDIO_RATE):
+    """
+    Build the ffmpeg command that loops/trims a soundtrack to duration seconds.
+
+    Returns:
+        Argument list for subprocess
+    """
+    return [
+        "ffmpeg", "-y",
+        "-stream_loop", "-1",   # Loop the input as often as needed ...
+        "-i", audio_path,
+        "-t", str(duration),    # ... and cut it at the target duration
+        "-vn",
+        "-c:a", codec,
+        "-b:a", bitrate,
+        "-ar", str(sample_rate),
+        *thread_args(),
+        dest_path
+    ]
+
+
+def build_ingest_cmd(dest_path, max_seconds):
+    """
+    Build the ffmpeg command that decodes an upload from stdin into compact AAC.
+
+    Returns:
+        Argument list for subprocess
+    """
+    return [
+        "ffmpeg", "-y", "-loglevel", "error",
+        "-i", "pipe:0",
+        "-t", str(max_seconds),
+        "-vn",
+        "-c:a", PREPARED_AUDIO_CODEC,
+        "-b:a", PREPARED_AUDIO_BITRATE,
+        "-ar", str(PREPARED_AUDIO_RATE),
+        *thread_args(),
+        dest_path
+    ]
+
+
+class AudioIngest:
+    """
+    ffmpeg process that turns soundtrack bytes, fed as they arrive, into compact AAC.
+
+    ffmpeg stops reading once it has max_seconds of audio; bytes written
+    after that are counted (for the max_bytes limit) and dropped.
+    """
+
+    def __init__(self, dest_path, max_seconds, max_bytes=MAX_AUDIO_UPLOAD_BYTES, verbose=False):
+        """
+        Start ffmpeg.
+
+        Args:
+            dest_path: Output path (.m4a)
+            max_seconds: Seconds of audio to keep
+            max_bytes: Largest upload accepted, counted over every byte written
+            verbose: Print progress information
+
+        Raises:
+            RuntimeError: If ffmpeg is not installed
+        """
+        self.dest_path = dest_path
+        self.max_bytes = max_bytes
+        self.verbose = verbose
+        self.received = 0
+        self.too_large = False
+        self.decoded = False  # ffmpeg has stopped reading input
+        cmd = build_ingest_cmd(dest_path, max_seconds)
+        if verbose:
+            print(f"Ingesting uploaded audio with FFmpeg: {' '.join(cmd)}")
+        try:
+            self._proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        except FileNotFoundError:
+            raise RuntimeError("ffmpeg not found. Ensure ffmpeg is installed and in PATH.")
+
+    @property
+    def wants_input(self):
+        """False once ffmpeg has all the audio it needs or the upload is too large."""
+        return not (self.decoded or self.too_large)
+
+    def write(self, chunk):
+        """Feed upload bytes to ffmpeg (never raises, see finish())."""
+        self.received += len(chunk)
+        if self.max_bytes and self.received > self.max_bytes and not self.too_large:
+            self.too_large = True
+            self._kill()
+        if not self.wants_input:
+            return
+        try:
+            self._proc.stdin.write(chunk)
+        except (BrokenPipeError, OSError):
+            self.decoded = True  # ffmpeg has decoded max_seconds and stopped reading
+
+    def _kill(self):
+        self._proc.kill()
+        self._proc.wait()
+
+    def finish(self):
+        """
+        Wait for ffmpeg once the whole upload has been written.
+
+        Returns:
+            dest_path
+
+        Raises:
+            AudioUploadTooLarge: If more than max_bytes were written
+            ValueError: If ffmpeg cannot decode the upload
+        """
+        try:
+            self._proc.stdin.close()
+        except (BrokenPipeError, OSError):
+            pass
+        stderr = self._proc.stderr.read()
+        returncode = self._proc.wait()
+        if self.too_large:
+            self._remove_output()
+            raise AudioUploadTooLarge(f"Audio upload exceeds the {self.max_bytes // (1024 * 1024)} MB limit")
+        if returncode != 0 or not os.path.exists(self.dest_path) or os.path.getsize(self.dest_path) == 0:
+            self._remove_output()
+            raise ValueError(f"Could not decode uploaded audio: {stderr.decode(errors='replace').strip()[-500:]}")
+        if self.verbose:
+            print(f"Ingested {self.received} uploaded bytes into {os.path.getsize(self.dest_path)} bytes of AAC at {self.dest_path}")
+        return self.dest_path
+
+    def abort(self):
+        """Stop ffmpeg and remove its output."""
+        if self._proc.poll() is None:
+            self._kill()
+        for pipe in (self._proc.stdin, self._proc.stderr):
+            try:
+                pipe.close()
+            except OSError:
+                pass
+        self._remove_output()
+
+    def _remove_output(self):
+        if os.path.exists(self.dest_path):
+            os.remove(self.dest_path)
+
+
+def ingest_audio_upload(stream, dest_path, max_seconds, max_bytes=MAX_AUDIO_UPLOAD_BYTES, verbose=False):
+    """
+    Decode the start of a soundtrack stream and store it as compact AAC.
+
+    The stream is read in chunks and piped into ffmpeg. Reading stops as
+    soon as ffmpeg has max_seconds of audio, so the rest of a lazily read
+    stream (such as an S3 object body) is never fetched.
+
+    Args:
+        stream: Binary file-like object with the soundtrack
+        dest_path: Output path (.m4a)
+        max_seconds: Seconds of audio to keep
+        max_bytes: Raise if more than this is read before ffmpeg has its audio
+        verbose: Print progress information
+
+    Returns:
+        dest_path
+
+    Raises:
+        AudioUploadTooLarge: If more than max_bytes are read
+        ValueError: If ffmpeg cannot decode the stream
+        RuntimeError: If ffmpeg is not installed
+    """
+    ingest = AudioIngest(dest_path, max_seconds, max_bytes=max_bytes, verbose=verbose)
+    try:
+        while ingest.wants_input:
+            chunk = stream.read(INGEST_CHUNK_SIZE)
+            if not chunk:
+                break
+            ingest.write(chunk)
+    except BaseException:
+        ingest.abort()
+        raise
+    return ingest.finish()
+
+
+class PreparedAudioCache:
+    """Cache of soundtracks looped/trimmed to a target duration and encoded to AAC."""
+
+    def __init__(self, cache=None, codec=PREPARED_AUDIO_CODEC, bitrate=PREPARED_AUDIO_BITRATE,
+                 sample_rate=PREPARED_AUDIO_RATE, verbose=False):
+        """
+        Initialize the prepared-audio cache.
+
+        Args:
+            cache: DiskLRUCache to store tracks in (defaults to a node-local cache)
+            codec: Output audio codec
+            bitrate: Output audio bitrate
+            sample_rate: Output sample rate
+            verbose: Print progress information
+        """
+        self.cache = cache or DiskLRUCache(os.path.join(DEFAULT_CACHE_ROOT, "audio"), verbose=verbose)
+        self.codec = codec
+        self.bitrate = bitrate
+        self.sample_rate = sample_rate
+        self.verbose = verbose
+
+    def key_for(self, audio_path, duration):
+        """Build the cache key for a prepared track."""
+        return DiskLRUCache.make_key(
+            "audio", content_hash(audio_path), float(duration),
+            self.codec, self.bitrate, self.sample_rate,
+        )
+
+    def prepare(self, audio_path, duration, work_dir):
+        """
+        Return a track of exactly duration seconds, encoding it on a miss.
+
+        Args:
+            audio_path: Source soundtrack (any format ffmpeg can decode)
+            duration: Target duration in seconds
+            work_dir: Scratch directory for the encode
+
+        Returns:
+            Path to the cached AAC track
+        """
+        key = self.key_for(audio_path, duration)
+        cached = self.cache.get(key, suffix=PREPARED_AUDIO_SUFFIX)
+        if cached:
+            return cached
+
+        dest_path = os.path.join(work_dir, f"extended_audio{PREPARED_AUDIO_SUFFIX}")
+        cmd = build_prepare_cmd(audio_path, dest_path, duration, self.codec, self.bitrate, self.sample_rate)
+        if self.verbose:
+            print(f"   Running FFmpeg for audio loop: {' '.join(cmd)}")
+        try:
+            subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except FileNotFoundError:
+            raise RuntimeError("ffmpeg not found. Ensure ffmpeg is installed and in PATH.")
+        except subprocess.CalledProcessError as e:
+            stderr = e.stderr.decode(errors="replace")[-2000:] if e.stderr else ""
+            raise RuntimeError(f"FFmpeg audio preparation failed for {audio_path}: {stderr}") from e
+        if not os.path.exists(dest_path) or os.path.getsize(dest_path) == 0:
+            raise RuntimeError(f"FFmpeg produced no audio at {dest_path}")
+        return self.cache.put(key, dest_path, suffix=PREPARED_AUDIO_SUFFIX, move=True)
+
+
+def get_prepared_audio_cache(verbose=False):
+    """
+    Return the process-wide prepared-audio cache.
+
+    Configured via CHIBICLIP_AUDIO_CACHE_MB (local size budget, default 256).
+    """
+    global _default_audio_cache
+    if _default_audio_cache is None:
+        max_bytes = int(os.getenv("CHIBICLIP_AUDIO_CACHE_MB", "256")) * 1024 * 1024
+        cache = DiskLRUCache(os.path.join(DEFAULT_CACHE_ROOT, "audio"), max_bytes=max_bytes, verbose=verbose)
+        _default_audio_cache = PreparedAudioCache(cache=cache, verbose=verbose)
+    return _default_audio_cache
@@ -0,0 +1,493 @@
+"""
+Storage backends for job inputs and outputs.
+
+The web tier and workers hand files to each other through a storage backend,
+chosen with CHIBICLIP_STORAGE_BACKEND:
+
+    s3       S3Storage (storage.py): objects in a bucket with public HTTPS URLs
+    shared   SharedVolumeStorage: a directory mounted into both web and worker
+             (docker-compose's storage-volume). Files pass by path: stores are
+             hard links where possible and workers read inputs in place, so
+             nothing is copied over the network
+    memory   MemoryStorage: objects held in the process, so the whole pipeline
+             can be run offline (e.g. with eager Celery tasks)
+
+When the variable is unset, USE_S3_STORAGE=true selects "s3" and anything
+else selects "shared".
+
+Every backend uses <prefix>/<name> keys (content-addressed by default, see
+storage.py) and the StorageBackend interface, so tasks and lifecycle cleanup
+do not depend on where objects live.
+"""
+
+import io
+import os
+import uuid
+import shutil
+import hashlib
+import threading
+from datetime import datetime, timezone
+from concurrent.futures import Future
+from urllib.parse import urlparse, quote, unquote
+
+from .cache import content_hash
+
+# Key uploads by content hash and skip existing objects (CHIBICLIP_S3_CONTENT_ADDRESSED)
+CONTENT_ADDRESSED = os.getenv('CHIBICLIP_S3_CONTENT_ADDRESSED', 'true').lower() == 'true'
+# Root of the shared volume backend (CHIBICLIP_SHARED_STORAGE_DIR) and the URL path it is served under.
+# It lies next to Output/, not in it: /images, /videos and /hls serve Output/ without /files' backend check
+SHARED_STORAGE_DIR = os.getenv(
+    'CHIBICLIP_SHARED_STORAGE_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.storage')
+)
+SHARED_STORAGE_URL = os.getenv('CHIBICLIP_SHARED_STORAGE_URL', '/files').rstrip('/')
+MEMORY_SCHEME = 'memory'
+STORAGE_BACKENDS = ('s3', 'shared', 'memory')
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+
+def default_backend_name():
+    """Backend selected by CHIBICLIP_STORAGE_BACKEND, falling back on USE_S3_STORAGE."""
+    name = os.getenv('CHIBICLIP_STORAGE_BACKEND', '').strip().lower()
+    if name:
+        return name
+    return 's3' if os.getenv('USE_S3_STORAGE', 'false').lower() == 'true' else 'shared'
+
+
+def hash_fileobj(fileobj):
+    """
+    SHA-256 of a seekable stream's remaining bytes, rewinding it afterwards.
+
+    Returns:
+        Hex digest, or None if the stream cannot be rewound
+    """
+    try:
+        if not fileobj.seekable():
+            return None
+        start = fileobj.tell()
+    except (AttributeError, OSError):
+        return None
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: fileobj.read(STREAM_CHUNK_SIZE), b''):
+        digest.update(chunk)
+    fileobj.seek(start)
+    return digest.hexdigest()
+
+
+class StorageBackend:
+    """
+    Interface shared by the storage backends.
+
+    Uploads return (url, key). URLs are what tasks and clients are given;
+    keys are what download, delete and lifecycle tracking work with.
+    """
+
+    name = None
+
+    def __init__(self, content_addressed=CONTENT_ADDRESSED):
+        self.content_addressed = content_addressed
+
+    def url_for(self, key):
+        """URL of the object stored under key."""
+        raise NotImplementedError
+
+    def key_for_url(self, url):
+        """Key of the object a URL refers to, or None if the URL is not in this storage."""
+        raise NotImplementedError
+
+    def local_path(self, url_or_key):
+        """Path of an object readable in place on this node, or None (always None for remote backends)."""
+        return None
+
+    def object_exists(self, key):
+        raise NotImplementedError
+
+    def object_size(self, key):
+        """Size in bytes of the object stored under key, or None if it does not exist."""
+        raise NotImplementedError
+
+    def open_object(self, key):
+        """Binary stream of an object's bytes, read as it is consumed (close it when done)."""
+        raise NotImplementedError
+
+    def upload_file(self, file_path, key_prefix='uploads', key=None, content_addressed=None,
+                    validate_image=None, callback=None):
+        """Store a local file; see S3Storage.upload_file. Returns (url, key)."""
+        raise NotImplementedError
+
+    def upload_data(self, file_data, filename, key_prefix='uploads', content_addressed=None):
+        """Store bytes under a key derived from filename's extension. Returns (url, key)."""
+        raise NotImplementedError
+
+    def upload_fileobj(self, fileobj, filename, key_prefix='uploads', content_addressed=None):
+        """Store a binary stream (e.g. a request body) without a local copy; see S3Storage.upload_fileobj."""
+        raise NotImplementedError
+
+    def download_file(self, key, dest_path):
+        """Copy an object to dest_path; returns False if it does not exist."""
+        raise NotImplementedError
+
+    def presign_upload(self, filename, key_prefix='inputs', max_bytes=None, method='post', expires_in=None):
+        """
+        Issue a request a client can upload to directly; see S3Storage.presign_upload.
+
+        Raises:
+            NotImplementedError: For backends clients cannot reach directly
+        """
+        raise NotImplementedError(f"{self.name} storage does not support direct client uploads")
+
+    def delete_file(self, url_or_key):
+        """Delete one object; returns True if it is gone."""
+        raise NotImplementedError
+
+    def delete_many(self, keys):
+        """Delete objects; returns the keys that were deleted (missing ones included)."""
+        return [key for key in dict.fromkeys(keys) if self.delete_file(key)]
+
+    def iter_objects(self, prefix):
+        """Yield (key, last_modified datetime) for the objects under prefix."""
+        raise NotImplementedError
+
+    def upload_many(self, uploads, progress=None):
+        """
+        Upload several files; see S3Storage.upload_many.
+
+        Local backends store files faster than a thread hand-off would pay
+        for, so the base implementation runs the uploads in turn and returns
+        already-completed futures.
+        """
+        futures = []
+        for upload in uploads:
+            kwargs = dict(upload)
+            if progress is not None:
+                file_path = kwargs['file_path']
+                kwargs['callback'] = lambda sent, path=file_path: progress(path, sent, os.path.getsize(path))
+            future = Future()
+            try:
+                future.set_result(self.upload_file(**kwargs))
+            except Exception as e:
+                future.set_exception(e)
+            futures.append(future)
+        return futures
+
+    def upload_directory(self, dir_path, key_prefix='uploads'):
+        """
+        Upload a directory tree (e.g. an HLS package) keeping relative paths.
+
+        All files share one unique key prefix, so relative references between
+        them (playlists to segments) keep working in storage.
+
+        Args:
+            dir_path: Local directory to upload
+            key_prefix: Prefix for the keys (folder)
+
+        Returns:
+            URL and key of the uploaded directory (without trailing slash)
+        """
+        base_key = f"{key_prefix}/{uuid.uuid4().hex}"
+        uploads = []
+        for root, _, files in os.walk(dir_path):
+            for name in sorted(files):
+                file_path = os.path.join(root, name)
+                rel_path = os.path.relpath(file_path, dir_path).replace(os.sep, '/')
+                uploads.append({'file_path': file_path, 'key': f"{base_key}/{rel_path}"})
+        for future in self.upload_many(uploads):
+            future.result()
+        return self.url_for(base_key), base_key
+
+    def _new_key(self, key_prefix, ext, digest=None):
+        """<prefix>/<sha256><ext> for content-addressed uploads, else a unique key."""
+        if digest:
+            return f"{key_prefix}/{digest}{ext.lower()}"
+        return f"{key_prefix}/{uuid.uuid4().hex}{ext}"
+
+
+class SharedVolumeStorage(StorageBackend):
+    """Objects as files below a directory that web and worker both mount."""
+
+    name = 'shared'
+
+    def __init__(self, root=SHARED_STORAGE_DIR, url_base=SHARED_STORAGE_URL, content_addressed=CONTENT_ADDRESSED):
+        """
+        Initialize the backend.
+
+        Args:
+            root: Directory holding the objects (created if missing)
+            url_base: URL path the web tier serves root under (see server.serve_stored_file)
+            content_addressed: Default key scheme for uploads without an explicit key
+        """
+        super().__init__(content_addressed)
+        self.root = os.path.abspath(root)
+        self.url_base = url_base
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, key):
+        path = os.path.abspath(os.path.join(self.root, key))
+        if not path.startswith(self.root + os.sep):
+            raise ValueError(f"Storage key escapes the storage root: {key}")
+        return path
+
+    def url_for(self, key):
+        return f"{self.url_base}/{quote(key)}"
+
+    def key_for_url(self, url):
+        parsed = urlparse(url)
+        if parsed.scheme == 'file':
+            path = os.path.abspath(unquote(parsed.path))
+            if path.startswith(self.root + os.sep):
+                return os.path.relpath(path, self.root).replace(os.sep, '/')
+            return None
+        # Relative URLs as stored, and absolute ones after the web tier resolved them for clients
+        base_path = urlparse(self.url_base).path
+        if parsed.path.startswith(base_path + '/'):
+            return unquote(parsed.path[len(base_path) + 1:])
+        return None
+
+    def local_path(self, url_or_key):
+        key = self.key_for_url(url_or_key) if '://' in url_or_key or url_or_key.startswith('/') else url_or_key
+        if not key:
+            return None
+        path = self._path(key)
+        return path if os.path.isfile(path) else None
+
+    def object_exists(self, key):
+        return os.path.isfile(self._path(key))
+
+    def object_size(self, key):
+        try:
+            return os.path.getsize(self._path(key))
+        except OSError:
+            return None
+
+    def open_object(self, key):
+        return open(self._path(key), 'rb')
+
+    def _store(self, file_path, dest_path):
+        """Hard-link file_path to dest_path (copying across filesystems), replacing atomically."""
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        tmp_path = f"{dest_path}.{uuid.uuid4().hex}.tmp"
+        try:
+            os.link(file_path, tmp_path)
+        except OSError:
+            shutil.copyfile(file_path, tmp_path)
+        os.replace(tmp_path, dest_path)
+
+    def upload_file(self, file_path, key_prefix='uploads', key=None, content_addressed=None,
+                    validate_image=None, callback=None):
+        _, ext = os.path.splitext(file_path)
+        if content_addressed is None:
+            content_addressed = self.content_addressed
+        if key is None:
+            key = self._new_key(key_prefix, ext, content_hash(file_path) if content_addressed else None)
+            if content_addressed and self.object_exists(key):
+                print(f"{file_path} already stored as {key}, skipping copy")
+                return self.url_for(key), key
+        self._store(file_path, self._path(key))
+        if callback:
+            callback(os.path.getsize(file_path))
+        return self.url_for(key), key
+
+    def upload_data(self, file_data, filename, key_prefix='uploads', content_addressed=None):
+        _, ext = os.path.splitext(filename)
+        if content_addressed is None:
+            content_addressed = self.content_addressed
+        digest = hashlib.sha256(file_data).hexdigest() if content_addressed else None
+        key = self._new_key(key_prefix, ext, digest)
+        dest_path = self._path(key)
+        if not (digest and os.path.isfile(dest_path)):
+            os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+            tmp_path = f"{dest_path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(file_data)
+            os.replace(tmp_path, dest_path)
+        return self.url_for(key), key
+
+    def upload_fileobj(self, fileobj, filename, key_prefix='uploads', content_addressed=None):
+        """
+        Write a stream into the volume, hashing it on the way for content-addressed keys.
+
+        The bytes are written once, to a temporary file next to their final
+        location, and renamed into place.
+        """
+        _, ext = os.path.splitext(filename)
+        if content_addressed is None:
+            content_addressed = self.content_addressed
+        prefix_dir = self._path(f"{key_prefix}/placeholder")
+        os.makedirs(os.path.dirname(prefix_dir), exist_ok=True)
+        tmp_path = os.path.join(os.path.dirname(prefix_dir), f"{uuid.uuid4().hex}.tmp")
+        digest = hashlib.sha256()
+        try:
+            with open(tmp_path, 'wb') as f:
+                for chunk in iter(lambda: fileobj.read(STREAM_CHUNK_SIZE), b''):
+                    digest.update(chunk)
+                    f.write(chunk)
+            key = self._new_key(key_prefix, ext, digest.hexdigest() if content_addressed else None)
+            dest_path = self._path(key)
+            if content_addressed and os.path.isfile(dest_path):
+                print(f"{filename} already stored as {key}, skipping copy")
+                os.remove(tmp_path)
+            else:
+                os.replace(tmp_path, dest_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return self.url_for(key), key
+
+    def download_file(self, key, dest_path):
+        path = self._path(key)
+        if not os.path.isfile(path):
+            return False
+        self._store(path, dest_path)
+        return True
+
+    def delete_file(self, url_or_key):
+        key = self.key_for_url(url_or_key) if '://' in url_or_key or url_or_key.startswith('/') else url_or_key
+        if not key:
+            print(f"Not deleting {url_or_key}: not in shared storage {self.root}")
+            return False
+        path = self._path(key)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Error deleting {path}: {e}")
+            return False
+        # Drop directories left empty (e.g. by a deleted HLS package), up to the root
+        parent = os.path.dirname(path)
+        while parent != self.root:
+            try:
+                os.rmdir(parent)
+            except OSError:
+                break
+            parent = os.path.dirname(parent)
+        return True
+
+    def iter_objects(self, prefix):
+        # Walk only the deepest directory the prefix names
+        top = os.path.join(self.root, os.path.dirname(prefix))
+        for dirpath, _, filenames in os.walk(top):
+            for filename in filenames:
+                if filename.endswith('.tmp'):
+                    continue
+                path = os.path.join(dirpath, filename)
+                key = os.path.relpath(path, self.root).replace(os.sep, '/')
+                if not key.startswith(prefix):
+                    continue
+                try:
+                    mtime = os.path.getmtime(path)
+                except OSError:
+                    continue
+                yield key, datetime.fromtimestamp(mtime, timezone.utc)
+
+
+class MemoryStorage(StorageBackend):
+    """Objects held in this process, addressed by memory://<key> URLs."""
+
+    name = 'memory'
+
+    def __init__(self, content_addressed=CONTENT_ADDRESSED):
+        super().__init__(content_addressed)
+        self._objects = {}  # key -> (bytes, last_modified)
+        self._lock = threading.Lock()
+
+    def url_for(self, key):
+        return f"{MEMORY_SCHEME}://{key}"
+
+    def key_for_url(self, url):
+        prefix = f"{MEMORY_SCHEME}://"
+        return url[len(prefix):] if url.startswith(prefix) else None
+
+    def object_exists(self, key):
+        with self._lock:
+            return key in self._objects
+
+    def object_size(self, key):
+        with self._lock:
+            entry = self._objects.get(key)
+        return len(entry[0]) if entry else None
+
+    def open_object(self, key):
+        with self._lock:
+            return io.BytesIO(self._objects[key][0])
+
+    def _put(self, key, data):
+        with self._lock:
+            self._objects[key] = (data, datetime.now(timezone.utc))
+
+    def upload_file(self, file_path, key_prefix='uploads', key=None, content_addressed=None,
+                    validate_image=None, callback=None):
+        with open(file_path, 'rb') as f:
+            data = f.read()
+        if key is None:
+            url, key = self.upload_data(data, file_path, key_prefix, content_addressed)
+        else:
+            self._put(key, data)
+        if callback:
+            callback(len(data))
+        return self.url_for(key), key
+
+    def upload_data(self, file_data, filename, key_prefix='uploads', content_addressed=None):
+        _, ext = os.path.splitext(filename)
+        if content_addressed is None:
+            content_addressed = self.content_addressed
+        digest = hashlib.sha256(file_data).hexdigest() if content_addressed else None
+        key = self._new_key(key_prefix, ext, digest)
+        self._put(key, bytes(file_data))
+        return self.url_for(key), key
+
+    def upload_fileobj(self, fileobj, filename, key_prefix='uploads', content_addressed=None):
+        return self.upload_data(fileobj.read(), filename, key_prefix, content_addressed)
+
+    def download_file(self, key, dest_path):
+        with self._lock:
+            entry = self._objects.get(key)
+        if entry is None:
+            return False
+        with open(dest_path, 'wb') as f:
+            f.write(entry[0])
+        return True
+
+    def delete_file(self, url_or_key):
+        key = self.key_for_url(url_or_key) or url_or_key
+        with self._lock:
+            self._objects.pop(key, None)
+        return True
+
+    def iter_objects(self, prefix):
+        with self._lock:
+            items = [(key, modified) for key, (_, modified) in self._objects.items() if key.startswith(prefix)]
+        yield from items
+
+
+_storages = {}
+_storages_lock = threading.Lock()
+
+
+def get_storage(backend=None):
+    """
+    Return the process-wide storage backend.
+
+    Args:
+        backend: "s3", "shared" or "memory" (defaults to default_backend_name())
+
+    Raises:
+        ValueError: If the backend is unknown or not configured (e.g. no S3 bucket)
+    """
+    backend = (backend or default_backend_name()).lower()
+    if backend not in STORAGE_BACKENDS:
+        raise ValueError(f"Unknown storage backend '{backend}'. Available: {', '.join(STORAGE_BACKENDS)}")
+    cache_key = (os.getpid(), backend)
+    with _storages_lock:
+        storage = _storages.get(cache_key)
+        if storage is None:
+            if backend == 's3':
+                from .storage import S3Storage
+                storage = S3Storage()
+            elif backend == 'shared':
+                storage = SharedVolumeStorage()
+            else:
+                storage = MemoryStorage()
+            _storages[cache_key] = storage
+        return storage
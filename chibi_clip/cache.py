@@ -0,0 +1,209 @@
+"""
+Local disk caches for reusable media artifacts.
+
+Entries are plain files named after a SHA-256 digest of their key. The file
+mtime doubles as the LRU clock: hits touch the file, and eviction removes the
+least recently used entries once the cache grows past its byte budget. Because
+all state lives on the filesystem, several worker processes on one node can
+share a cache directory safely.
+
+An optional S3Storage mirror lets worker nodes share entries: local misses are
+looked up under an S3 prefix before the caller has to rebuild the artifact.
+"""
+
+import os
+import json
+import uuid
+import hashlib
+import tempfile
+import shutil
+from functools import lru_cache
+
+# Default root for node-local caches (overridable via CHIBICLIP_CACHE_DIR)
+DEFAULT_CACHE_ROOT = os.getenv(
+    "CHIBICLIP_CACHE_DIR",
+    os.path.join(tempfile.gettempdir(), "chibiclip_cache")
+)
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    """
+    Compute the SHA-256 hex digest of a file's content.
+
+    Args:
+        path: Path to the file
+        chunk_size: Read size per iteration
+
+    Returns:
+        Hex digest string
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@lru_cache(maxsize=1024)
+def _hash_file_memo(path, size, mtime):
+    return hash_file(path)
+
+
+def content_hash(path):
+    """
+    Return the SHA-256 of a file, memoised per (path, size, mtime).
+
+    Bundled assets such as the birthday song and backdrops are hashed once per
+    process instead of once per job.
+    """
+    st = os.stat(path)
+    return _hash_file_memo(os.path.abspath(path), st.st_size, st.st_mtime)
+
+
+class DiskLRUCache:
+    """Size-bounded, least-recently-used cache of files on local disk."""
+
+    def __init__(self, cache_dir, max_bytes=256 * 1024 * 1024, s3_storage=None, s3_prefix=None, verbose=False):
+        """
+        Initialize the cache.
+
+        Args:
+            cache_dir: Directory holding cache entries (created if missing)
+            max_bytes: Total size budget; older entries are evicted beyond it
+            s3_storage: Optional S3Storage used as a shared second tier
+            s3_prefix: Key prefix for entries mirrored to S3
+            verbose: Print cache hits, misses and evictions
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.s3_storage = s3_storage
+        self.s3_prefix = (s3_prefix or "cache").rstrip("/")
+        self.verbose = verbose
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(*parts):
+        """
+        Build a stable cache key from arbitrary JSON-serialisable parts.
+
+        Returns:
+            SHA-256 hex digest of the canonical JSON encoding of parts
+        """
+        encoded = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+        return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+    def path_for(self, key, suffix=""):
+        """Return the local path an entry with this key is stored at."""
+        return os.path.join(self.cache_dir, f"{key}{suffix}")
+
+    def get(self, key, suffix=""):
+        """
+        Look up an entry, consulting the S3 mirror on a local miss.
+
+        Args:
+            key: Cache key (see make_key)
+            suffix: File extension the entry was stored with
+
+        Returns:
+            Local path of the cached file, or None on a miss
+        """
+        path = self.path_for(key, suffix)
+        if os.path.exists(path):
+            try:
+                os.utime(path, None)  # Touch to mark as recently used
+            except OSError:
+                pass
+            if self.verbose:
+                print(f"Cache hit: {path}")
+            return path
+
+        if self.s3_storage:
+            s3_key = f"{self.s3_prefix}/{key}{suffix}"
+            tmp_path = f"{path}.{uuid.uuid4().hex}.part"
+            try:
+                if self.s3_storage.download_file(s3_key, tmp_path):
+                    os.replace(tmp_path, path)
+                    if self.verbose:
+                        print(f"Cache hit (S3 mirror): s3://{self.s3_storage.bucket_name}/{s3_key}")
+                    self.evict()
+                    return path
+            except Exception as e:
+                if self.verbose:
+                    print(f"Warning: S3 cache lookup failed for {s3_key}: {e}")
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+        if self.verbose:
+            print(f"Cache miss: {key}{suffix}")
+        return None
+
+    def put(self, key, src_path, suffix="", move=False):
+        """
+        Store a file in the cache.
+
+        The entry is written under a temporary name and renamed into place so
+        concurrent readers never observe a partial file.
+
+        Args:
+            key: Cache key (see make_key)
+            src_path: File to store
+            suffix: File extension for the entry
+            move: Move src_path into the cache instead of copying it
+
+        Returns:
+            Local path of the cached file
+        """
+        path = self.path_for(key, suffix)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.part"
+        if move:
+            shutil.move(src_path, tmp_path)
+        else:
+            shutil.copyfile(src_path, tmp_path)
+        os.replace(tmp_path, path)
+
+        if self.s3_storage:
+            s3_key = f"{self.s3_prefix}/{key}{suffix}"
+            try:
+                self.s3_storage.upload_file(path, key=s3_key)
+            except Exception as e:
+                if self.verbose:
+                    print(f"Warning: Could not mirror cache entry to S3 ({s3_key}): {e}")
+
+        self.evict()
+        return path
+
+    def evict(self):
+        """
+        Remove least recently used entries until the cache fits its budget.
+
+        Returns:
+            Number of entries removed
+        """
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".part"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue  # Removed concurrently
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+
+        removed = 0
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                removed += 1
+                if self.verbose:
+                    print(f"Cache evicted: {path}")
+            except OSError:
+                pass
+        return removed
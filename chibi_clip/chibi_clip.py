@@ -95,6 +95,7 @@ import moviepy
 # argparse and random will be imported in their respective scopes
 import uuid
 import shutil
+from contextlib import ExitStack
 
 # Try to import magic and subprocess for file type detection
 try:
@@ -111,6 +112,37 @@ except ImportError:
     print("Warning: subprocess module not found. Fallback file type detection may be limited.")
     SUBPROCESS_AVAILABLE = False
 
+from .probe import probe_media
+from .audio import get_prepared_audio_cache
+from .renditions import render_renditions, parse_renditions, RENDITION_NAMES, LADDER_RENDITIONS
+from .hls import package_hls, HLS_SEGMENT_SECONDS
+from .encoding import get_encoding_policy, enforce_max_size, parse_bitrate
+from .cpu_budget import cpu_lease, thread_args, current_threads
+from .scratch import get_scratch_manager
+from .outputs import get_output_manager
+from .compose import (
+    plan_composition,
+    compose_video,
+    CompositionPrep,
+    thumbnail_paths,
+    extract_thumbnails,
+    mp4_output_args,
+    sprite_info,
+    get_runway_result_cache,
+    runway_cache_key,
+    is_url,
+)
+from .slate import (
+    get_slate_cache,
+    SLATE_DURATION,
+    SEGMENT_FPS,
+    SEGMENT_VIDEO_CODEC,
+    SEGMENT_PIX_FMT,
+    SEGMENT_AUDIO_CODEC,
+    SEGMENT_AUDIO_BITRATE,
+    SEGMENT_AUDIO_RATE,
+)
+
 # Step 6: Runway helpers (constants)
 RATIO_MAP = {
     "9:16": "720:1280",
@@ -153,6 +185,8 @@ class ChibiClipGenerator:
             if self.verbose:
                 print(f"Creating output directory: {self.output_dir}")
             os.makedirs(self.output_dir, exist_ok=True)
+        # Each job's artifacts go to its own namespace below the output directory
+        self.outputs = get_output_manager(self.output_dir, verbose=self.verbose)
 
         missing = [k for k,v in {"OpenAI":openai_api_key,
                                  "Runway":runway_api_key}.items() if not v]
@@ -169,11 +203,12 @@ class ChibiClipGenerator:
             print("ChibiClipGenerator initialized.")
             
     # New helper method to convert images to PNG using ffmpeg
-    def _to_png(self, src_path: str) -> str:
+    def _to_png(self, src_path: str, scratch) -> str:
         """
         Converts an image file to PNG format using ffmpeg.
-        Overwrites the original file with the PNG version.
-        Returns the path to the (potentially) converted file.
+        The PNG is written to scratch (the job's workspace) and its path returned;
+        src_path is left untouched, since inputs may be shared read-only files
+        (bundled assets, input-cache entries, shared-volume objects).
         """
         if self.verbose:
             print(f"Attempting to convert {src_path} to PNG using ffmpeg...")
@@ -195,14 +230,10 @@ class ChibiClipGenerator:
         if self.verbose:
             print(f"chibi_clip._to_png: imghdr identified source as '{image_type_for_conversion}' before ffmpeg conversion.")
 
-        # Create a temporary name for the output PNG
-        temp_png_path = tempfile.mktemp(suffix=".png", prefix="converted_", dir=self.output_dir or "/tmp")
+        stem = os.path.splitext(os.path.basename(src_path))[0]
+        png_path = scratch.file(f"{stem}_converted_{uuid.uuid4().hex}.png")
         
         try:
-            # Ensure output directory exists if self.output_dir is used
-            if self.output_dir and not os.path.exists(self.output_dir):
-                os.makedirs(self.output_dir, exist_ok=True)
-
             # Command to convert to PNG using ffmpeg
             # -y: overwrite output files without asking
             # -i: input file
@@ -212,30 +243,25 @@ class ChibiClipGenerator:
             cmd = [
                 "ffmpeg", "-y", "-i", src_path, 
                 "-vf", "format=rgba", # Try to ensure RGBA for PNG output
-                temp_png_path
+                png_path
             ]
             if self.verbose:
                 print(f"Executing ffmpeg command: {' '.join(cmd)}")
             
             # Run ffmpeg
             # Use DEVNULL for stdout/stderr to avoid excessive console output unless debugging
-            result = subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
-            
-            if self.verbose:
-                print(f"ffmpeg conversion successful. Output at {temp_png_path}")
+            subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
             
-            # Replace the original file with the converted PNG
-            shutil.move(temp_png_path, src_path)
             if self.verbose:
-                print(f"Replaced {src_path} with its PNG version.")
-            return src_path
+                print(f"ffmpeg conversion successful. Output at {png_path}")
+            return png_path
         except subprocess.CalledProcessError as e:
             if self.verbose:
                 print(f"ffmpeg conversion failed for {src_path}. Error: {e.stderr.decode() if e.stderr else e}")
-            # Clean up temp file if conversion failed
-            if os.path.exists(temp_png_path):
+            # Clean up the partial PNG
+            if os.path.exists(png_path):
                 try:
-                    os.remove(temp_png_path)
+                    os.remove(png_path)
                 except OSError:
                     pass # Ignore if removal fails
             raise RuntimeError(f"Failed to convert {src_path} to PNG with ffmpeg: {e}") from e
@@ -243,21 +269,11 @@ class ChibiClipGenerator:
              if self.verbose:
                 print("ffmpeg command not found. Cannot convert image. Ensure ffmpeg is installed and in PATH.")
              raise RuntimeError("ffmpeg not found. Conversion to PNG failed.")
-        except Exception as e_move:
-            if self.verbose:
-                print(f"Error during moving/cleanup of converted file: {e_move}")
-            # Clean up temp file if move failed
-            if os.path.exists(temp_png_path):
-                try:
-                    os.remove(temp_png_path)
-                except OSError:
-                    pass
-            raise RuntimeError(f"Error post-conversion for {src_path}: {e_move}") from e_move
 
     # New method to save images locally
-    def save_image_locally(self, image_base64: str) -> str:
+    def save_image_locally(self, image_base64: str, dest_dir: str = None) -> str:
         """
-        Saves a base64 encoded image to the local output directory.
+        Saves a base64 encoded image to dest_dir (a job's namespace), or the output directory.
         Returns the local file path and a URL that can be used by the application.
         """
         if self.verbose:
@@ -269,7 +285,7 @@ class ChibiClipGenerator:
             
             # Generate a unique filename
             filename = f"{uuid.uuid4().hex}.png"
-            file_path = os.path.join(self.output_dir, filename)
+            file_path = os.path.join(dest_dir or self.output_dir, filename)
             
             # Save the image file
             with open(file_path, "wb") as f:
@@ -494,7 +510,7 @@ class ChibiClipGenerator:
                 raise RuntimeError(error_message) from e
 
     # Step 5: ImgBB upload (modified to include local fallback)
-    def upload_to_imgbb(self, image_base64: str, use_local_fallback=True) -> str:
+    def upload_to_imgbb(self, image_base64: str, use_local_fallback=True, dest_dir: str = None) -> str:
         # If use_local_fallback is True, just return a data URI directly
         # This avoids the memory spike from multipart/form-data buffer during ImgBB upload
         if use_local_fallback:
@@ -537,7 +553,7 @@ class ChibiClipGenerator:
             if use_local_fallback:
                 if self.verbose:
                     print("Falling back to local storage...")
-                result = self.save_image_locally(image_base64)
+                result = self.save_image_locally(image_base64, dest_dir)
                 return result["url"]
             else:
                 raise RuntimeError(error_message) from e
@@ -786,18 +802,28 @@ class ChibiClipGenerator:
         raise TimeoutError(timeout_msg)
 
     # Step 7b: Music addition helper method
-    def add_music_to_video(self, video_url, audio_path, output_path=None, total_duration=45, birthday_message=None):
+    def add_music_to_video(self, video_url, audio_path, output_path=None, total_duration=45, birthday_message=None, prep=None, video_sink=None, scratch=None):
         """
         Adds music to a video, adjusting if needed to match the desired duration.
         If the video is shorter than total_duration, it's looped.
         If the audio is shorter than total_duration, it's looped.
         
+        Inputs are probed once and compose.plan_composition picks the cheapest
+        valid path (stream copy, single ffmpeg transcode, or the MoviePy
+        pipeline when the inputs cannot be probed).
+        
         Args:
             video_url (str): URL or path to the video file
             audio_path (str): Path to the audio file
             output_path (str, optional): Path where the output will be saved
             total_duration (int, optional): Target duration in seconds. Defaults to 45.
             birthday_message (str, optional): Birthday message to add to the card slate
+            prep (CompositionPrep, optional): Background preparation started for this job
+            video_sink (S3StreamSink, optional): Streams the final video to storage while
+                ffmpeg encodes it. When the stream succeeds (video_sink.url is set) no local
+                file is written and the returned path only names companion files.
+            scratch (ScratchSpace, optional): Job workspace for intermediate files. A
+                workspace is allocated (and removed afterwards) when not given.
             
         Returns:
             str: Path to the output file
@@ -808,25 +834,119 @@ class ChibiClipGenerator:
             if birthday_message:
                 print(f"Birthday message to add: {birthday_message}")
         
+        owned_scratch = None
         try:
-            # Create a temp dir for working files
-            temp_dir = tempfile.mkdtemp()
+            # Working files go to the job's scratch workspace (tmpfs when the node has room)
+            if scratch is None:
+                scratch = owned_scratch = get_scratch_manager(verbose=self.verbose).workspace()
+            temp_dir = scratch.mkdtemp(prefix="compose_")
             video_clip_obj = None
             audio_obj = None
             final_animated_video_obj = None
             final_video_to_write = None
+            card_slate = None
+            backdrop_clip = None
+            txt_clip = None
             
+            # Read the clip in place: local files are not copied, and remote URLs are
+            # handed straight to ffmpeg so that download and remux overlap
+            runway_cache = None
+            source_path = None
+            if video_url.startswith(('http://', 'https://')):
+                runway_cache = get_runway_result_cache(verbose=self.verbose)
+                if runway_cache:
+                    source_path = runway_cache.get(runway_cache_key(video_url), suffix=".mp4")
+                source_path = source_path or video_url
+            elif video_url.startswith('file://'):
+                source_path = video_url[7:]  # Remove file:// prefix
+            elif os.path.exists(video_url):
+                # Already a local file path
+                source_path = video_url
+            if source_path is None or not (is_url(source_path) or os.path.exists(source_path)):
+                raise ValueError(f"Invalid video_url: {video_url}. Not a valid URL or file path.")
             if self.verbose:
-                print(f"① Downloading video from {video_url} to {os.path.join(temp_dir, 'temp_video.mp4')}")
+                print(f"① Reading video from {source_path}")
             
-            # First, download the video file to a temp location
-            video_path = os.path.join(temp_dir, "temp_video.mp4")
-            
-            # Handle different URL types (http, file, local path)
-            if video_url.startswith(('http://', 'https://')):
-                # Remote URL - use requests for better error handling and content type checking
+            # Let background preparation (audio loop, slate) finish so the lookups below hit the caches
+            if prep is not None:
+                prep.wait()
+
+            # Loop/trim the soundtrack to the target duration once and reuse it across jobs;
+            # composition then only has to stream-copy the prepared AAC track
+            if audio_path:
+                try:
+                    audio_path = get_prepared_audio_cache(verbose=self.verbose).prepare(
+                        audio_path, total_duration, temp_dir
+                    )
+                    if self.verbose:
+                        print(f"   Using prepared audio track: {audio_path}")
+                except RuntimeError as audio_e:
+                    if self.verbose:
+                        print(f"   Warning: Could not prepare audio ({audio_e}). Using the original track.")
+
+            # Probe the inputs once; every composition decision reads from these records
+            video_info = None
+            audio_info = None
+            try:
+                video_info = probe_media(source_path)
+                if self.verbose:
+                    print(f"   Probed video: {video_info}")
+            except RuntimeError as probe_e:
+                if self.verbose:
+                    print(f"   Warning: Could not probe video ({probe_e}). Using the MoviePy pipeline.")
+            if audio_path:
+                try:
+                    audio_info = probe_media(audio_path)
+                    if self.verbose:
+                        print(f"   Probed audio: {audio_info}")
+                except RuntimeError as probe_e:
+                    if self.verbose:
+                        print(f"   Warning: Could not probe audio ({probe_e}).")
+
+            plan = plan_composition(
+                video_info,
+                audio_info,
+                total_duration,
+                with_slate=bool(birthday_message and birthday_message.strip())
+            )
+            if plan.video_mode != "encode":
+                if output_path is None:
+                    output_path = f"chibi_clip_with_music_{uuid.uuid4().hex[:12]}.mp4"
+                # Keep a copy of the remote clip for the Runway result cache while it streams through
+                tee_path = scratch.file("runway_clip.mp4", temp_dir) if runway_cache and is_url(source_path) else None
                 try:
-                    r = requests.get(video_url, timeout=60, stream=True) # Added stream=True
+                    result_path = compose_video(
+                        plan,
+                        source_path,
+                        audio_path,
+                        output_path,
+                        temp_dir,
+                        birthday_message=birthday_message,
+                        tee_path=tee_path,
+                        source_duration=video_info.duration,
+                        thumbnails=thumbnail_paths(output_path),
+                        sink=video_sink,
+                        scratch=scratch,
+                        verbose=self.verbose
+                    )
+                    if tee_path and os.path.exists(tee_path) and os.path.getsize(tee_path) > 0:
+                        try:
+                            runway_cache.put(runway_cache_key(video_url), tee_path, suffix=".mp4", move=True)
+                        except OSError as cache_e:
+                            if self.verbose:
+                                print(f"   Warning: Could not store Runway clip in cache: {cache_e}")
+                    return result_path
+                except RuntimeError as compose_e:
+                    if self.verbose:
+                        print(f"   Warning: FFmpeg composition failed ({compose_e}). Falling back to the MoviePy pipeline.")
+
+            # The MoviePy pipeline needs a local file, so remote clips are downloaded here
+            if is_url(source_path):
+                video_path = scratch.file("temp_video.mp4", temp_dir)
+                if self.verbose:
+                    print(f"   Downloading video from {source_path} to {video_path}")
+                try:
+                    r = requests.get(source_path, timeout=60, stream=True) # Added stream=True
                     r.raise_for_status() # Check for HTTP errors
                     
                     content_type = r.headers.get("Content-Type", "")
@@ -840,7 +960,7 @@ class ChibiClipGenerator:
                         except Exception:
                             pass
                         raise RuntimeError(
-                            f"Expected video, got {content_type} from {video_url}. Response preview: '{preview}...'"
+                            f"Expected video, got {content_type} from {source_path}. Response preview: '{preview}...'"
                         )
 
                     with open(video_path, 'wb') as f:
@@ -849,18 +969,11 @@ class ChibiClipGenerator:
                     if self.verbose:
                         print(f"   Video downloaded successfully to {video_path} using requests.")
                 except requests.exceptions.RequestException as req_e:
-                    raise RuntimeError(f"Error downloading video from {video_url} using requests: {req_e}") from req_e
-            elif video_url.startswith('file://'):
-                # Local file URL - copy the file
-                local_path = video_url[7:]  # Remove file:// prefix
-                shutil.copyfile(local_path, video_path)
+                    raise RuntimeError(f"Error downloading video from {source_path} using requests: {req_e}") from req_e
             else:
-                # Assume it's already a local file path
-                if os.path.exists(video_url):
-                    shutil.copyfile(video_url, video_path)
-                else:
-                    raise ValueError(f"Invalid video_url: {video_url}. Not a valid URL or file path.")
-            
+                video_path = source_path
+            encoding_policy = get_encoding_policy()
+
             # Load the video clip - MEMORY OPTIMIZATION: Using context manager and memory-saving parameters
             if self.verbose:
                 print(f"② Loading video with VideoFileClip from: {video_path}")
@@ -974,8 +1087,8 @@ class ChibiClipGenerator:
                             except: pass
                         
                         # Retry with FFmpeg shell command for looping - much more memory efficient
-                        ffmpeg_input = os.path.join(temp_dir, "temp_video.mp4")
-                        ffmpeg_output = os.path.join(temp_dir, "looped_video.mp4")
+                        ffmpeg_input = video_path
+                        ffmpeg_output = scratch.file("looped_video.mp4", temp_dir)
                         
                         # Calculate loop count needed (rounded up)
                         import math
@@ -991,6 +1104,7 @@ class ChibiClipGenerator:
                             "-i", ffmpeg_input,
                             "-c", "copy",  # Just copy, don't re-encode
                             "-t", str(total_duration),  # Limit to desired duration
+                            *thread_args(),
                             ffmpeg_output
                         ]
                         
@@ -1034,7 +1148,7 @@ class ChibiClipGenerator:
                     if audio_obj.duration < total_duration:
                         if self.verbose:
                             print(f"⑥ Audio ({audio_obj.duration:.2f}s) is shorter than target ({total_duration}s). Looping with FFmpeg.")
-                        temp_audio_path = os.path.join(temp_dir, "extended_audio.mp3")
+                        temp_audio_path = scratch.file("extended_audio.mp3", temp_dir)
                         
                         # Using -stream_loop. Number of loops for input stream. -1 means infinite. We need total_duration.
                         # FFmpeg stream_loop counts from 0. So N-1 for N loops.
@@ -1046,6 +1160,7 @@ class ChibiClipGenerator:
                             "-af", f"aloop=loop=-1:size={int(2**24)}:start=0,atrim=0:{total_duration}", # Loop and trim audio with filters
                             "-c:a", "aac", # Re-encode to AAC for compatibility
                             "-b:a", "192k",
+                            *thread_args(),
                             "-y", temp_audio_path
                         ]
                         if self.verbose:
@@ -1075,200 +1190,105 @@ class ChibiClipGenerator:
                 
                 # --- BIRTHDAY CARD SLATE LOGIC START ---
                 final_video_to_write = final_animated_video_obj # Default to the animated video
-                card_slate = None 
-                backdrop_clip = None
-                txt_clip = None
 
                 if birthday_message and birthday_message.strip():
                     if self.verbose:
                         print(f"INFO: Creating birthday card slate with message: '{birthday_message}'")
                     try:
                         # MAJOR CHANGE: Completely bypass MoviePy's TextClip/ImageClip for the birthday card
-                        # due to ImageMagick security policy issues in containerized environments
-                        assets_dir = os.path.join(os.path.dirname(__file__), "assets")
-                        
-                        # Choose the backdrop image
-                        if video_width == 720 and video_height == 1280:
-                            backdrop_path = os.path.join(assets_dir, "birthday_card_backdrop_v2.png")
-                            if not os.path.exists(backdrop_path):
-                                backdrop_path = os.path.join(assets_dir, "birthday_card_backdrop.png")
-                        else:
-                            backdrop_path = os.path.join(assets_dir, "birthday_card_backdrop.png")
-                        
-                        if not os.path.exists(backdrop_path):
-                            if self.verbose:
-                                print(f"WARNING: No backdrop images found. Skipping card slate.")
-                            # Just proceed with the animated clip only
-                        else:
-                            # Create a static image with text using PIL instead of TextClip
-                            if self.verbose: print(f"INFO: Creating card slate using PIL and FFmpeg (bypassing MoviePy)")
-                            
-                            # 1. Open and resize the backdrop
-                            backdrop_img = Image.open(backdrop_path)
-                            if backdrop_img.size != (video_width, video_height):
-                                if self.verbose: print(f"INFO: Resizing backdrop to {video_width}x{video_height}")
-                                backdrop_img = backdrop_img.resize((video_width, video_height), Image.LANCZOS)
-                            
-                            # 2. Add text to the image
-                            draw = ImageDraw.Draw(backdrop_img)
-                            text_color = (255, 255, 255)  # White
-                            
-                            # Try to find a font - use system fonts or default
-                            try:
-                                # Look in common font locations
-                                font_locations = [
-                                    "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",  # Linux
-                                    "/usr/share/fonts/TTF/Arial.ttf",                        # Some Linux
-                                    "/Library/Fonts/Arial.ttf",                              # macOS
-                                    "C:\\Windows\\Fonts\\Arial.ttf",                         # Windows
-                                    # Add fallbacks
-                                    "/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf",
-                                    "/usr/share/fonts/truetype/freefont/FreeSansBold.ttf", 
-                                ]
+                        # due to ImageMagick security policy issues in containerized environments.
+                        # The slate segment is cached and encoded with the same parameters as the
+                        # animated part below, so the two can be joined with stream copy.
+                        video_width, video_height = final_animated_video_obj.size
+                        audio_channels = audio_obj.nchannels if audio_obj is not None else None
+                        slate_video_path = get_slate_cache(verbose=self.verbose).get_segment(
+                            birthday_message,
+                            video_width,
+                            video_height,
+                            temp_dir,
+                            fps=SEGMENT_FPS,
+                            duration=SLATE_DURATION,
+                            audio_channels=audio_channels
+                        )
                                 
-                                font = None
-                                for font_path in font_locations:
-                                    if os.path.exists(font_path):
-                                        if self.verbose: print(f"INFO: Using font: {font_path}")
-                                        try:
-                                            font = ImageFont.truetype(font_path, 70)
-                                            break
-                                        except Exception as font_e:
-                                            if self.verbose: print(f"WARNING: Could not load font {font_path}: {font_e}")
+                        try:
+                            if slate_video_path:
+                                # Save the final animated video first
+                                animated_video_path = scratch.file("animated_part.mp4", temp_dir)
                                 
-                                # If no font found, use default
-                                if font is None:
-                                    if self.verbose: print("INFO: Using default font")
-                                    font = ImageFont.load_default()
-                                    # Make default font bigger if possible
-                                    if hasattr(font, 'size'):
-                                        for size in [70, 60, 50, 40, 36]:
-                                            try:
-                                                font = ImageFont.truetype(font.path, size)
-                                                break
-                                            except:
-                                                continue
-                            
-                            except Exception as font_e:
-                                if self.verbose: print(f"WARNING: Font loading error: {font_e}. Using default.")
-                                font = ImageFont.load_default()
-                            
-                            # Calculate text position - center of image
-                            text_width, text_height = draw.textsize(birthday_message, font=font) if hasattr(draw, 'textsize') else (video_width//2, video_height//5)
-                            text_position = ((video_width - text_width) // 2, (video_height - text_height) // 2)
-                            
-                            # Draw text with "stroke" by drawing the text in black with offsets
-                            stroke_width = 2
-                            shadow_color = (0, 0, 0)  # Black shadow/stroke
-                            for dx, dy in [(x, y) for x in range(-stroke_width, stroke_width + 1) for y in range(-stroke_width, stroke_width + 1)]:
-                                if dx != 0 or dy != 0:  # Skip the center position (that's for the main text)
-                                    draw.text((text_position[0] + dx, text_position[1] + dy), birthday_message, font=font, fill=shadow_color)
-                            
-                            # Now draw the main text
-                            draw.text(text_position, birthday_message, font=font, fill=text_color)
-                            
-                            # Save the composite image
-                            card_slate_path = os.path.join(temp_dir, "birthday_card_slate.png")
-                            backdrop_img.save(card_slate_path)
-                            backdrop_img.close()
-                            
-                            # How long the slate should appear (5 seconds)
-                            card_slate_duration = 5
-                            
-                            # Convert the static image to a video clip using FFmpeg
-                            # This is MUCH more memory efficient than using MoviePy's ImageClip
-                            slate_video_path = os.path.join(temp_dir, "birthday_card_slate.mp4")
-                            
-                            # Create a video from the static image
-                            ffmpeg_slate_cmd = [
-                                "ffmpeg", "-y",
-                                "-loop", "1",
-                                "-i", card_slate_path,
-                                "-c:v", "libx264",
-                                "-t", str(card_slate_duration),
-                                "-pix_fmt", "yuv420p",
-                                "-vf", f"scale={video_width}:{video_height}:force_original_aspect_ratio=decrease,pad={video_width}:{video_height}:(ow-iw)/2:(oh-ih)/2",
-                                "-r", "24",
-                                slate_video_path
-                            ]
-                            
-                            if self.verbose:
-                                print(f"INFO: Creating slate video with FFmpeg: {' '.join(ffmpeg_slate_cmd)}")
+                                if self.verbose:
+                                    print(f"INFO: Writing animated video portion to temporary file: {animated_video_path}")
                                 
-                            try:
-                                subprocess.run(ffmpeg_slate_cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                                # Write the animated portion with the shared segment codec settings
+                                final_animated_video_obj.write_videofile(
+                                    animated_video_path,
+                                    codec=SEGMENT_VIDEO_CODEC,
+                                    audio_codec=SEGMENT_AUDIO_CODEC,
+                                    audio_fps=SEGMENT_AUDIO_RATE,
+                                    audio_bitrate=SEGMENT_AUDIO_BITRATE,
+                                    fps=SEGMENT_FPS,
+                                    preset=encoding_policy.preset,
+                                    threads=current_threads(),
+                                    ffmpeg_params=encoding_policy.extra_args(
+                                        duration=total_duration + SLATE_DURATION,
+                                        audio_bitrate=parse_bitrate(SEGMENT_AUDIO_BITRATE)
+                                    ),
+                                    logger=None,
+                                    verbose=False
+                                )
                                 
-                                if os.path.exists(slate_video_path) and os.path.getsize(slate_video_path) > 0:
-                                    # Save the final animated video first
-                                    animated_video_path = os.path.join(temp_dir, "animated_part.mp4")
-                                    
-                                    if self.verbose:
-                                        print(f"INFO: Writing animated video portion to temporary file: {animated_video_path}")
-                                    
-                                    # Write the animated portion with reduced quality settings to save memory
-                                    final_animated_video_obj.write_videofile(
-                                        animated_video_path,
-                                        codec="libx264",
-                                        audio_codec="aac",
-                                        fps=24,
-                                        bitrate="5000k",
-                                        preset="ultrafast",  # Use ultrafast for temp file
-                                        threads=2,
-                                        ffmpeg_params=["-pix_fmt", "yuv420p"],
-                                        logger=None,
-                                        verbose=False
-                                    )
-                                    
-                                    # Clear any resources no longer needed
-                                    if final_animated_video_obj and hasattr(final_animated_video_obj, 'close'):
-                                        final_animated_video_obj.close()
-                                        final_animated_video_obj = None
-                                    
-                                    # Use FFmpeg to concatenate the slate and the animated video
-                                    # Create a concat file
-                                    concat_file_path = os.path.join(temp_dir, "concat.txt")
-                                    with open(concat_file_path, "w") as f:
-                                        f.write(f"file '{os.path.abspath(slate_video_path)}'\n")
-                                        f.write(f"file '{os.path.abspath(animated_video_path)}'\n")
-                                    
-                                    if output_path is None:
-                                        output_path = f"chibi_clip_with_music_{int(time.time())}.mp4"
-                                    
-                                    ffmpeg_concat_cmd = [
-                                        "ffmpeg", "-y",
-                                        "-f", "concat",
-                                        "-safe", "0",
-                                        "-i", concat_file_path,
-                                        "-c", "copy",  # Just copy, don't re-encode
-                                        output_path
-                                    ]
+                                # Clear any resources no longer needed
+                                if final_animated_video_obj and hasattr(final_animated_video_obj, 'close'):
+                                    final_animated_video_obj.close()
+                                    final_animated_video_obj = None
+                                
+                                # Use FFmpeg to concatenate the slate and the animated video
+                                # Create a concat file
+                                concat_file_path = os.path.join(temp_dir, "concat.txt")
+                                with open(concat_file_path, "w") as f:
+                                    f.write(f"file '{os.path.abspath(slate_video_path)}'\n")
+                                    f.write(f"file '{os.path.abspath(animated_video_path)}'\n")
+                                
+                                if output_path is None:
+                                    output_path = f"chibi_clip_with_music_{uuid.uuid4().hex[:12]}.mp4"
+                                
+                                ffmpeg_concat_cmd = [
+                                    "ffmpeg", "-y",
+                                    "-f", "concat",
+                                    "-safe", "0",
+                                    "-i", concat_file_path,
+                                    "-c", "copy",  # Just copy, don't re-encode
+                                    *mp4_output_args(),
+                                    *thread_args(),
+                                    output_path
+                                ]
+                                
+                                if self.verbose:
+                                    print(f"INFO: Concatenating videos with FFmpeg: {' '.join(ffmpeg_concat_cmd)}")
                                     
+                                subprocess.run(ffmpeg_concat_cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                                
+                                if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
                                     if self.verbose:
-                                        print(f"INFO: Concatenating videos with FFmpeg: {' '.join(ffmpeg_concat_cmd)}")
-                                        
-                                    subprocess.run(ffmpeg_concat_cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                                    
-                                    if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
-                                        if self.verbose:
-                                            print(f"✅ Final video with birthday card slate saved to {output_path}")
-                                        return output_path
-                                    else:
-                                        if self.verbose:
-                                            print("WARNING: Failed to create concatenated video. Falling back to animated part only.")
-                                        # Copy the animated part as the result
-                                        shutil.copy(animated_video_path, output_path)
-                                        return output_path
+                                        print(f"✅ Final video with birthday card slate saved to {output_path}")
+                                    return output_path
                                 else:
                                     if self.verbose:
-                                        print("WARNING: Failed to create slate video. Proceeding with animated video only.")
-                            except subprocess.CalledProcessError as ffmpeg_e:
-                                if self.verbose:
-                                    print(f"WARNING: FFmpeg command failed: {ffmpeg_e}")
-                                    print("Proceeding with the animated portion only.")
-                            except Exception as e:
+                                        print("WARNING: Failed to create concatenated video. Falling back to animated part only.")
+                                    # Copy the animated part as the result
+                                    shutil.copy(animated_video_path, output_path)
+                                    return output_path
+                            else:
                                 if self.verbose:
-                                    print(f"WARNING: Error during slate video creation: {e}")
-                                    print("Proceeding with the animated portion only.")
+                                    print("WARNING: Failed to create slate video. Proceeding with animated video only.")
+                        except subprocess.CalledProcessError as ffmpeg_e:
+                            if self.verbose:
+                                print(f"WARNING: FFmpeg command failed: {ffmpeg_e}")
+                                print("Proceeding with the animated portion only.")
+                        except Exception as e:
+                            if self.verbose:
+                                print(f"WARNING: Error during slate video creation: {e}")
+                                print("Proceeding with the animated portion only.")
                             
                     except Exception as slate_e:
                         if self.verbose:
@@ -1281,24 +1301,27 @@ class ChibiClipGenerator:
                 # (Either because there's no birthday message or the slate creation failed)
                 if output_path is None:
                     base_filename = "chibi_clip_with_music"
-                    output_path = f"{base_filename}_{int(time.time())}.mp4"
+                    output_path = f"{base_filename}_{uuid.uuid4().hex[:12]}.mp4"
                 
                 if self.verbose:
                     print(f"⑨ Writing final video to {output_path}")
                 
-                # Even more memory optimization: Use ultrafast preset and lower bitrate
+                # Constant-quality encode from the encoding policy (capped when a size budget is set)
                 final_video_to_write.write_videofile(
                     output_path, 
                     codec="libx264", 
                     audio_codec="aac", 
                     fps=24,
-                    bitrate="4000k",  # Further reduced bitrate
-                    preset="ultrafast",  # Use ultrafast (lowest memory usage)
-                    threads=2,
-                    ffmpeg_params=["-pix_fmt", "yuv420p"],
+                    preset=encoding_policy.preset,
+                    threads=current_threads(),
+                    ffmpeg_params=[
+                        *encoding_policy.extra_args(duration=total_duration, audio_bitrate=parse_bitrate("128k")),
+                        *mp4_output_args()
+                    ],
                     logger=None,
                     verbose=False
                 )
+                enforce_max_size(output_path, encoding_policy, total_duration, verbose=self.verbose)
             
             except MemoryError as mem_e:
                 # Handle extreme memory pressure with ffmpeg direct manipulation if possible
@@ -1380,11 +1403,13 @@ class ChibiClipGenerator:
                     import shutil
                     shutil.rmtree(temp_dir, ignore_errors=True)
                     if self.verbose: print(f"   Removed temp directory: {temp_dir}")
+                if owned_scratch is not None:
+                    owned_scratch.cleanup()
             except Exception as e:
                 if self.verbose: print(f"   Warning: Error removing temp directory: {e}")
 
     # Step 7: High-level orchestrator (Updated to handle local file URLs)
-    def process_clip(self, photo_path: str, action: str = "running", ratio: str = "9:16", duration: int = 5, audio_path: str = None, extended_duration: int = 45, use_local_storage=False, birthday_message=None):
+    def process_clip(self, photo_path: str, action: str = "running", ratio: str = "9:16", duration: int = 5, audio_path: str = None, extended_duration: int = 45, use_local_storage=False, birthday_message=None, renditions=None, hls=False, video_sink=None, job_id=None, scratch=None):
         if self.verbose:
             print(f"▶ Generating clip (source: {photo_path}, action: {action}, ratio: {ratio}, duration: {duration}s)…")
             if birthday_message:
@@ -1406,6 +1431,32 @@ class ChibiClipGenerator:
                     if self.verbose:
                         print("Birthday song not found at expected location. Will generate video without audio.")
 
+        # Intermediate files of this job (prep, compose, image conversions) share one
+        # scratch workspace: the caller's (e.g. the task's, which also holds the
+        # downloaded inputs), or one reserved here and removed when the job ends
+        owned_scratch = None
+        if scratch is None:
+            scratch = owned_scratch = get_scratch_manager(verbose=self.verbose).workspace()
+        # Artifacts go to the job's own output namespace (reused when a job is retried)
+        job_id = job_id or uuid.uuid4().hex
+        job_dir = self.outputs.job_dir(job_id)
+
+        # Start the composition steps that do not depend on the Runway output now,
+        # so they overlap the OpenAI and Runway calls instead of following them
+        prep = None
+        # Holds the job's CPU lease once the Runway output is in (see below)
+        cpu_stage = ExitStack()
+        if action == "birthday-dance" or (audio_path and os.path.exists(audio_path)):
+            expected_size = tuple(int(v) for v in RATIO_MAP[ratio].split(":")) if ratio in RATIO_MAP else None
+            prep = CompositionPrep(
+                audio_path,
+                extended_duration,
+                birthday_message=birthday_message,
+                expected_size=expected_size,
+                scratch=scratch,
+                verbose=self.verbose
+            ).start()
+
         try:
             # ===== ENHANCED INITIAL VALIDATION BLOCK for photo_path =====
             if self.verbose:
@@ -1461,7 +1512,7 @@ class ChibiClipGenerator:
                  if self.verbose:
                     print(f"ChibiClip: Detected HEIC/HEIF variant based on header: {file_header_bytes_hex}. Attempting conversion to PNG.")
                  try:
-                    photo_path = self._to_png(photo_path) # Convert and update photo_path
+                    photo_path = self._to_png(photo_path, scratch=scratch) # Convert and update photo_path
                     if self.verbose:
                         print(f"ChibiClip: Successfully converted HEIC to PNG: {photo_path}")
                     # Re-check header after conversion
@@ -1481,7 +1532,7 @@ class ChibiClipGenerator:
                 if self.verbose:
                     print(f"ChibiClip: imghdr could not identify image type for {photo_path}. This might be an unsupported format (e.g., WebP before Pillow 10, AVIF) or not an image. Attempting conversion to PNG as a fallback.")
                 try:
-                    photo_path = self._to_png(photo_path) # Convert and update photo_path
+                    photo_path = self._to_png(photo_path, scratch=scratch) # Convert and update photo_path
                     image_type_imghdr = imghdr.what(photo_path) # Re-check
                     if self.verbose:
                         print(f"ChibiClip: Post-conversion, imghdr detected: {image_type_imghdr} for {photo_path}")
@@ -1601,10 +1652,8 @@ class ChibiClipGenerator:
                             print(f"ChibiClip: PIL Error opening BytesIO from validated file: {pil_error}")
                             print(f"ChibiClip: Attempting to save and reload the image file directly (again, from validated photo_path)...")
                         
-                        temp_image_path = os.path.join(self.output_dir, f"debug_image_validated_{uuid.uuid4().hex}.png")
+                        temp_image_path = scratch.file(f"debug_image_validated_{uuid.uuid4().hex}.png")
                         try:
-                            if not os.path.exists(self.output_dir):
-                                os.makedirs(self.output_dir, exist_ok=True)
                             # Re-read from the validated photo_path to ensure fresh data for this debug save
                             with open(photo_path, "rb") as f_orig_for_debug:
                                 original_data_for_debug = f_orig_for_debug.read()
@@ -1653,7 +1702,7 @@ class ChibiClipGenerator:
                                     if direct_img_convert.mode != "RGBA": # Prefer RGBA for consistency
                                         direct_img_convert = direct_img_convert.convert("RGBA")
                                     
-                                    converted_png_path = os.path.join(self.output_dir, f"converted_final_{uuid.uuid4().hex}.png")
+                                    converted_png_path = scratch.file(f"converted_final_{uuid.uuid4().hex}.png")
                                     direct_img_convert.save(converted_png_path, "PNG")
                                     direct_img_convert.close()
                                     
@@ -1696,12 +1745,12 @@ class ChibiClipGenerator:
             # Use local storage or ImgBB based on user preference
             if use_local_storage:
                 # Save image locally and get URL
-                local_result = self.save_image_locally(edited_b64)
+                local_result = self.save_image_locally(edited_b64, job_dir)
                 img_url = local_result["url"]
                 local_image_path = local_result["path"]
             else:
                 # Try ImgBB with fallback to local storage if it fails
-                img_url = self.upload_to_imgbb(edited_b64, use_local_fallback=True)
+                img_url = self.upload_to_imgbb(edited_b64, use_local_fallback=True, dest_dir=job_dir)
                 local_image_path = None
                 
                 # Check if the result is a local file URL
@@ -1717,8 +1766,15 @@ class ChibiClipGenerator:
             
             video_url = task_result["output"][0]
             
+            # Every encode from here on (composition, prep still in flight, thumbnails,
+            # renditions, HLS) shares this job's slice of the node's CPU budget. Prep that
+            # ran during the Runway wait used UNLEASED_THREADS rather than holding a lease
+            # through the wait.
+            cpu_stage.enter_context(cpu_lease(verbose=self.verbose))
+            
             # For birthday-dance or when audio_path is provided, add music to the video
             local_video_path = None
+            streamed_video_path = None
             if action == "birthday-dance" or (audio_path and os.path.exists(audio_path)):
                 if self.verbose:
                     if action == "birthday-dance":
@@ -1726,13 +1782,21 @@ class ChibiClipGenerator:
                     else:
                         print(f"Adding music from {audio_path} to video")
                 
-                # For birthday theme, use the Output directory with a descriptive name
-                if action == "birthday-dance":
-                    timestamp = int(time.time())
-                    output_filename = f"birthday_dog_video_{timestamp}.mp4"
-                    output_path = os.path.join(self.output_dir, output_filename)
-                else:
-                    output_path = None  # Default naming will be used
+                # The final video goes to the job's namespace with a descriptive name
+                output_filename = "birthday_dog_video.mp4" if action == "birthday-dance" else "dog_video_with_music.mp4"
+                output_path = os.path.join(job_dir, output_filename)
+                
+                # Renditions and HLS are derived from a local copy, and a size cap
+                # (CHIBICLIP_MAX_OUTPUT_MB) can only be checked, and met with a two-pass
+                # re-encode, on a finished file; only stream the final video to its sink
+                # when none of them applies
+                if renditions or hls:
+                    video_sink = None
+                elif video_sink is not None and get_encoding_policy().max_bytes:
+                    if self.verbose:
+                        print("Output size cap configured: composing locally and uploading afterwards "
+                              "instead of streaming the video to storage")
+                    video_sink = None
                 
                 # Add music and loop the video to the extended duration (default 45 seconds)
                 local_video_path = self.add_music_to_video(
@@ -1740,17 +1804,20 @@ class ChibiClipGenerator:
                     audio_path, 
                     output_path=output_path, 
                     total_duration=extended_duration,
-                    birthday_message=birthday_message
+                    birthday_message=birthday_message,
+                    prep=prep,
+                    video_sink=video_sink,
+                    scratch=scratch
                 )
+                if video_sink is not None and video_sink.url:
+                    streamed_video_path, local_video_path = local_video_path, None
             else:
                 # For non-birthday themes without audio, download and save the video locally 
                 # if using local storage
                 if use_local_storage:
                     try:
                         # Create a filename and path for the video
-                        timestamp = int(time.time())
-                        output_filename = f"dog_video_{timestamp}.mp4"
-                        local_video_path = os.path.join(self.output_dir, output_filename)
+                        local_video_path = os.path.join(job_dir, "dog_video.mp4")
                         
                         if self.verbose:
                             print(f"Downloading original video to: {local_video_path}")
@@ -1771,6 +1838,86 @@ class ChibiClipGenerator:
                 result["local_video_path"] = local_video_path
                 if action == "birthday-dance" or audio_path:
                     result["extended_duration"] = extended_duration
+            elif streamed_video_path:
+                # The final video went straight from ffmpeg to its sink (S3); there is no local copy
+                result["video_url"] = video_sink.url
+                result["s3_video_key"] = video_sink.key
+                result["extended_duration"] = extended_duration
+
+            composed_video_path = local_video_path or streamed_video_path
+            if composed_video_path:
+                # Poster and sprite let clients render before downloading the MP4. The ffmpeg
+                # composition writes them while decoding; other paths extract them here.
+                thumbs = thumbnail_paths(composed_video_path)
+                if local_video_path and not all(os.path.exists(p) for p in thumbs.values()):
+                    try:
+                        has_slate = bool(birthday_message and birthday_message.strip())
+                        extract_thumbnails(
+                            local_video_path,
+                            thumbs["poster"],
+                            thumbs["sprite"],
+                            duration,
+                            start=SLATE_DURATION if has_slate else 0,
+                            verbose=self.verbose
+                        )
+                    except RuntimeError as thumb_e:
+                        if self.verbose:
+                            print(f"Warning: Could not extract poster/sprite: {thumb_e}")
+                if os.path.exists(thumbs["poster"]):
+                    result["poster_path"] = thumbs["poster"]
+                if os.path.exists(thumbs["sprite"]):
+                    result["sprite_path"] = thumbs["sprite"]
+                    result["sprite"] = sprite_info(duration)
+
+            if local_video_path:
+                # Extra renditions (square crop, 480p, previews) come from one decode of the final video
+                if renditions:
+                    try:
+                        result["renditions"] = render_renditions(
+                            local_video_path,
+                            os.path.dirname(local_video_path) or job_dir,
+                            os.path.splitext(os.path.basename(local_video_path))[0],
+                            renditions,
+                            keyframe_interval=HLS_SEGMENT_SECONDS if hls else None,
+                            verbose=self.verbose
+                        )
+                    except RuntimeError as rendition_e:
+                        if self.verbose:
+                            print(f"Warning: Could not render renditions: {rendition_e}")
+
+                # Optional HLS package for adaptive playback; only renditions with the
+                # original's framing join the ladder (never the square crop)
+                if hls:
+                    sources = {"original": local_video_path}
+                    sources.update({
+                        name: path for name, path in result.get("renditions", {}).items()
+                        if name in LADDER_RENDITIONS
+                    })
+                    package_dir = os.path.splitext(local_video_path)[0] + "_hls"
+                    try:
+                        result["hls_playlist_path"] = package_hls(sources, package_dir, verbose=self.verbose)
+                        result["hls_dir"] = package_dir
+                    except (RuntimeError, ValueError) as hls_e:
+                        if self.verbose:
+                            print(f"Warning: Could not package HLS: {hls_e}")
+            
+            # Encoding is done; give the threads back before indexing
+            cpu_stage.close()
+            
+            # Index the job's artifacts for lookups and eviction
+            result["job_id"] = job_id
+            artifacts = {
+                name: result.get(field)
+                for name, field in (("image", "local_image_path"), ("video", "local_video_path"),
+                                    ("poster", "poster_path"), ("sprite", "sprite_path"), ("hls", "hls_dir"))
+            }
+            for name, path in result.get("renditions", {}).items():
+                artifacts[f"rendition:{name}"] = path
+            try:
+                self.outputs.record(job_id, artifacts)
+            except Exception as index_e:
+                if self.verbose:
+                    print(f"Warning: Could not index outputs of job {job_id}: {index_e}")
             
             if self.verbose:
                 print(f"✅ Clip processing complete. Image: {img_url}, Video: {video_url}")
@@ -1799,6 +1946,12 @@ class ChibiClipGenerator:
         except Exception as e: 
             if self.verbose: print(f"An unexpected error occurred: {e}")
             raise
+        finally:
+            cpu_stage.close()
+            if prep is not None:
+                prep.close()
+            if owned_scratch is not None:
+                owned_scratch.cleanup()
 
 # Step 9: CLI entry point (Updated to include local storage option)
 if __name__ == "__main__":
@@ -1841,6 +1994,10 @@ if __name__ == "__main__":
     ap.add_argument("--use-local-storage", action="store_true",
                     help="Save images locally instead of uploading to ImgBB. Auto-enabled for birthday-dance.")
     ap.add_argument("--output-dir", help="Directory to save locally stored images and videos")
+    ap.add_argument("--hls", action="store_true",
+                    help="Also package the video (and its MP4 renditions) as HLS.")
+    ap.add_argument("--renditions", default="",
+                    help=f"Comma-separated extra renditions of the final video ({', '.join(RENDITION_NAMES)})")
     args = ap.parse_args()
 
     # Print a special message for birthday theme
@@ -1867,7 +2024,9 @@ if __name__ == "__main__":
             duration=args.duration,
             audio_path=args.audio,
             extended_duration=args.extended_duration,
-            use_local_storage=args.use_local_storage
+            use_local_storage=args.use_local_storage,
+            renditions=parse_renditions(args.renditions),
+            hls=args.hls
         )
         
         print("\n✨ Clip Generation Result ✨") 
@@ -1884,6 +2043,10 @@ if __name__ == "__main__":
                 print(f"Extended video with music ({res.get('extended_duration', 45)}s) saved to: {res['local_video_path']}")
             else:
                 print(f"Video saved to: {res['local_video_path']}")
+        for name, path in res.get("renditions", {}).items():
+            print(f"Rendition '{name}' saved to: {path}")
+        if res.get("hls_playlist_path"):
+            print(f"HLS playlist saved to: {res['hls_playlist_path']}")
 
     except ValueError as e: 
         print(f"Error: {e}")
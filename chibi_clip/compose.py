@@ -0,0 +1,625 @@
+"""
+FFmpeg composition planning and execution.
+
+plan_composition() looks only at probed MediaInfo records and picks the
+cheapest valid way to turn a short Runway clip plus a soundtrack into the
+final looped video (encoder settings come from the EncodingPolicy):
+
+    copy       loop the clip with stream copy and mux the audio in
+    transcode  decode/encode once with ffmpeg (needed for the slate, or when
+               the clip cannot be stream-copied into MP4)
+    encode     fall back to the MoviePy pipeline (probe information missing)
+
+compose_video() executes "copy" and "transcode" plans; "encode" plans are
+left to ChibiClipGenerator.add_music_to_video.
+"""
+
+import os
+import math
+import shutil
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
+from dataclasses import dataclass
+from typing import Optional
+
+from .probe import probe_media
+from .cache import DiskLRUCache, DEFAULT_CACHE_ROOT
+from .audio import get_prepared_audio_cache
+from .encoding import get_encoding_policy, enforce_max_size, parse_bitrate
+from .cpu_budget import thread_args
+from .slate import (
+    get_slate_cache,
+    get_slate_renderer,
+    SLATE_DURATION,
+    SEGMENT_FPS,
+    SEGMENT_VIDEO_CODEC,
+    SEGMENT_PIX_FMT,
+    SEGMENT_AUDIO_CODEC,
+    SEGMENT_AUDIO_BITRATE,
+    SEGMENT_AUDIO_RATE,
+)
+
+# Video codecs / pixel formats that can be stream-copied into the MP4 output
+COPYABLE_VIDEO_CODECS = ("h264",)
+COPYABLE_PIX_FMTS = ("yuv420p", "yuvj420p")
+# Audio codecs that can be stream-copied into the MP4 output
+COPYABLE_AUDIO_CODECS = ("aac",)
+
+# Input options for remote clips read directly by ffmpeg
+HTTP_INPUT_OPTIONS = [
+    "-reconnect", "1",
+    "-reconnect_streamed", "1",
+    "-reconnect_delay_max", "5",
+    "-rw_timeout", "60000000",  # Microseconds
+]
+
+# Container layout for final MP4s (CHIBICLIP_MP4_LAYOUT): "faststart" moves the
+# moov atom to the front, "fragmented" writes fragments that play as they arrive,
+# "plain" leaves ffmpeg's default (moov at the end)
+MP4_LAYOUT = os.getenv("CHIBICLIP_MP4_LAYOUT", "faststart").lower()
+MP4_MOVFLAGS = {
+    "faststart": "+faststart",
+    "fragmented": "+frag_keyframe+empty_moov+default_base_moof",
+}
+
+# ffmpeg output target used when the final video is streamed to a sink
+PIPE_OUTPUT = "pipe:1"
+
+# Poster frame and thumbnail sprite written next to the composed video
+POSTER_FORMAT = os.getenv("CHIBICLIP_POSTER_FORMAT", "jpg").lower()  # "jpg" or "webp"
+POSTER_TIME = 1.0           # Seconds into the clip
+SPRITE_COLUMNS = 5
+SPRITE_ROWS = 2
+SPRITE_TILE_WIDTH = 160
+
+_runway_result_cache = None
+
+
+@dataclass(frozen=True)
+class CompositionPlan:
+    """How the final video will be produced."""
+    video_mode: str                 # "copy", "transcode" or "encode"
+    audio_mode: Optional[str]       # "copy", "encode" or None (no soundtrack)
+    loops: int                      # Number of times the clip is played
+    total_duration: float
+    width: Optional[int] = None
+    height: Optional[int] = None
+    fps: Optional[float] = None
+    slate: bool = False
+    audio_channels: Optional[int] = None
+    loop_audio: bool = True         # Soundtrack is shorter than the target and must be looped
+    reason: str = ""
+
+
+def is_url(path):
+    """True for remote inputs that ffmpeg reads over HTTP(S)."""
+    return path.startswith(("http://", "https://"))
+
+
+def runway_cache_key(video_url):
+    """Cache key for a Runway output URL (ignoring its expiring signature query)."""
+    return DiskLRUCache.make_key("runway", video_url.split("?", 1)[0])
+
+
+def get_runway_result_cache(verbose=False):
+    """
+    Return the node-local cache of downloaded Runway clips, or None if disabled.
+
+    Enabled by setting CHIBICLIP_RUNWAY_CACHE_MB to a positive size budget.
+    """
+    global _runway_result_cache
+    max_mb = int(os.getenv("CHIBICLIP_RUNWAY_CACHE_MB", "0"))
+    if max_mb <= 0:
+        return None
+    if _runway_result_cache is None:
+        _runway_result_cache = DiskLRUCache(
+            os.path.join(DEFAULT_CACHE_ROOT, "runway"), max_bytes=max_mb * 1024 * 1024, verbose=verbose
+        )
+    return _runway_result_cache
+
+
+def final_output_args(output_path):
+    """Container options for a delivered MP4 written to a file or to PIPE_OUTPUT."""
+    if output_path == PIPE_OUTPUT:
+        # A pipe cannot be seeked to rewrite the moov atom, so the output is fragmented
+        return mp4_output_args("fragmented") + ["-f", "mp4"]
+    return mp4_output_args()
+
+
+def mp4_output_args(layout=None):
+    """
+    Return the ffmpeg output options for a progressively playable MP4.
+
+    Args:
+        layout: "faststart", "fragmented" or "plain" (defaults to MP4_LAYOUT)
+
+    Returns:
+        Argument list to place before the output path
+    """
+    flags = MP4_MOVFLAGS.get(layout or MP4_LAYOUT)
+    return ["-movflags", flags] if flags else []
+
+
+def thumbnail_paths(output_path):
+    """
+    Return the poster and sprite paths that belong to a composed video.
+
+    Returns:
+        Dict with "poster" and "sprite" paths next to output_path
+    """
+    stem = os.path.splitext(output_path)[0]
+    return {
+        "poster": f"{stem}_poster.{POSTER_FORMAT}",
+        "sprite": f"{stem}_sprite.jpg",
+    }
+
+
+def sprite_info(source_duration):
+    """Describe the sprite grid so clients can map tiles to timestamps."""
+    tiles = SPRITE_COLUMNS * SPRITE_ROWS
+    return {
+        "columns": SPRITE_COLUMNS,
+        "rows": SPRITE_ROWS,
+        "tile_width": SPRITE_TILE_WIDTH,
+        "interval": round(source_duration / tiles, 3),
+    }
+
+
+def build_thumbnail_outputs(poster_path, sprite_path, source_duration, input_index=0):
+    """
+    Build extra ffmpeg outputs writing a poster frame and a thumbnail sprite.
+
+    Appended to a command that already reads the clip, they reuse its input
+    instead of opening and decoding the file a second time. Only the first
+    iteration of a looped clip is sampled, since every loop looks the same.
+
+    Args:
+        poster_path: Poster image path (.jpg or .webp)
+        sprite_path: Sprite sheet path (.jpg)
+        source_duration: Duration of one iteration of the clip
+        input_index: ffmpeg input index of the clip
+
+    Returns:
+        Argument list to append after the command's other outputs
+    """
+    tiles = SPRITE_COLUMNS * SPRITE_ROWS
+    args = []
+    if poster_path:
+        poster_time = min(POSTER_TIME, source_duration / 2)
+        args += ["-map", f"{input_index}:v:0", "-an", "-ss", str(poster_time), "-frames:v", "1"]
+        if poster_path.endswith(".webp"):
+            args += ["-c:v", "libwebp", "-q:v", "80"]
+        else:
+            args += ["-q:v", "3"]
+        args += thread_args()
+        args.append(poster_path)
+    if sprite_path:
+        args += [
+            "-map", f"{input_index}:v:0", "-an",
+            "-t", str(source_duration),
+            "-vf", f"fps={tiles}/{source_duration},scale={SPRITE_TILE_WIDTH}:-2,"
+                   f"tile={SPRITE_COLUMNS}x{SPRITE_ROWS}",
+            "-frames:v", "1", "-q:v", "5",
+            *thread_args(),
+            sprite_path,
+        ]
+    return args
+
+
+def extract_thumbnails(video_path, poster_path, sprite_path, duration, start=0, verbose=False):
+    """
+    Write a poster and sprite for a video that was produced without them.
+
+    Used by the MoviePy fallback; only duration seconds from start (e.g. past
+    the slate) are decoded.
+    """
+    cmd = ["ffmpeg", "-y"]
+    if start:
+        cmd += ["-ss", str(start)]
+    cmd += ["-t", str(duration), "-i", video_path]
+    cmd += build_thumbnail_outputs(poster_path, sprite_path, duration)
+    run_ffmpeg(cmd, verbose=verbose)
+
+
+def _even(value):
+    """Round a dimension down to an even number (required for yuv420p)."""
+    return max(2, int(value) // 2 * 2)
+
+
+def plan_composition(video_info, audio_info, total_duration, with_slate=False):
+    """
+    Choose the cheapest valid composition path.
+
+    Args:
+        video_info: MediaInfo of the animated clip (None if probing failed)
+        audio_info: MediaInfo of the soundtrack, or None for no audio
+        total_duration: Target duration of the animated part in seconds
+        with_slate: Whether a birthday card slate will be prepended
+
+    Returns:
+        CompositionPlan
+    """
+    if video_info is None or not video_info.has_video or video_info.duration <= 0:
+        return CompositionPlan("encode", "encode" if audio_info else None, 1, total_duration,
+                               slate=with_slate, reason="video metadata unavailable")
+
+    loops = max(1, math.ceil(total_duration / video_info.duration))
+
+    audio_mode = None
+    audio_channels = None
+    loop_audio = False
+    if audio_info is not None and audio_info.has_audio:
+        audio_channels = audio_info.channels
+        loop_audio = audio_info.duration < total_duration
+        audio_mode = "encode"
+        if audio_info.audio_codec in COPYABLE_AUDIO_CODECS:
+            # Segments joined with the slate must share its audio sample rate
+            if not with_slate or audio_info.sample_rate == SEGMENT_AUDIO_RATE:
+                audio_mode = "copy"
+
+    copyable = (video_info.video_codec in COPYABLE_VIDEO_CODECS
+                and video_info.pix_fmt in COPYABLE_PIX_FMTS)
+
+    if with_slate:
+        # The slate is concat-copied, so the animated part must carry exactly
+        # the segment codec parameters; the clip is re-encoded once to match.
+        return CompositionPlan(
+            "transcode", audio_mode, loops, total_duration,
+            width=_even(video_info.width), height=_even(video_info.height), fps=SEGMENT_FPS,
+            slate=True, audio_channels=audio_channels, loop_audio=loop_audio,
+            reason="slate requires segment codec parameters",
+        )
+    if copyable:
+        return CompositionPlan(
+            "copy", audio_mode, loops, total_duration,
+            width=video_info.width, height=video_info.height, fps=video_info.fps,
+            audio_channels=audio_channels, loop_audio=loop_audio,
+            reason=f"{video_info.video_codec}/{video_info.pix_fmt} can be stream-copied",
+        )
+    return CompositionPlan(
+        "transcode", audio_mode, loops, total_duration,
+        width=_even(video_info.width), height=_even(video_info.height), fps=SEGMENT_FPS,
+        audio_channels=audio_channels, loop_audio=loop_audio,
+        reason=f"{video_info.video_codec}/{video_info.pix_fmt} cannot be stream-copied",
+    )
+
+
+def run_ffmpeg(cmd, verbose=False):
+    """Run an ffmpeg command, raising RuntimeError with its stderr on failure."""
+    if verbose:
+        print(f"   Running FFmpeg command: {' '.join(cmd)}")
+    try:
+        subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except FileNotFoundError:
+        raise RuntimeError("ffmpeg not found. Ensure ffmpeg is installed and in PATH.")
+    except subprocess.CalledProcessError as e:
+        stderr = e.stderr.decode(errors="replace")[-2000:] if e.stderr else ""
+        raise RuntimeError(f"FFmpeg failed ({e.returncode}): {stderr}") from e
+
+
+def run_ffmpeg_to_sink(cmd, sink, verbose=False):
+    """
+    Run an ffmpeg command writing to PIPE_OUTPUT and hand its stdout to a sink.
+
+    The sink consumes the stream while ffmpeg is still encoding. It only
+    finalises the upload once ffmpeg has exited successfully, so a failed
+    encode never leaves a truncated object behind.
+
+    Returns:
+        Whatever sink.consume returns (the uploaded URL for S3StreamSink)
+
+    Raises:
+        RuntimeError: If ffmpeg or the sink fails
+    """
+    if verbose:
+        print(f"   Running FFmpeg command (streaming output): {' '.join(cmd)}")
+    stderr_file = tempfile.TemporaryFile()
+    try:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr_file)
+    except FileNotFoundError:
+        stderr_file.close()
+        raise RuntimeError("ffmpeg not found. Ensure ffmpeg is installed and in PATH.")
+
+    def check_exit():
+        returncode = proc.wait()
+        if returncode != 0:
+            stderr_file.seek(0)
+            stderr = stderr_file.read().decode(errors="replace")[-2000:]
+            raise RuntimeError(f"FFmpeg failed ({returncode}): {stderr}")
+
+    try:
+        return sink.consume(proc.stdout, before_complete=check_exit)
+    except RuntimeError:
+        raise
+    except Exception as e:
+        raise RuntimeError(f"Streaming the FFmpeg output failed: {e}") from e
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        proc.stdout.close()
+        stderr_file.close()
+
+
+def build_animated_cmd(plan, video_path, audio_path, output_path, tee_path=None, source_duration=None,
+                       thumbnails=None, final_output=True, policy=None):
+    """
+    Build the ffmpeg command that loops the clip and muxes the soundtrack.
+
+    Remote clips are read directly from their URL. When the clip is looped,
+    the input goes through ffmpeg's cache: protocol so later iterations are
+    served from the bytes already fetched instead of re-downloading.
+
+    Args:
+        plan: CompositionPlan with video_mode "copy" or "transcode"
+        video_path: Animated clip (local path or HTTP(S) URL)
+        audio_path: Soundtrack, or None
+        output_path: Output MP4 path
+        tee_path: Optional second output receiving one stream-copied
+            iteration of the clip (used to fill the Runway result cache)
+        source_duration: Duration of one iteration (required with tee_path
+            and thumbnails)
+        thumbnails: Optional dict with "poster"/"sprite" paths, written
+            from the same input (see build_thumbnail_outputs)
+        final_output: output_path is the delivered file (written with
+            mp4_output_args); False for intermediates joined later
+        policy: EncodingPolicy for transcode plans (defaults to
+            get_encoding_policy())
+
+    Returns:
+        Argument list for subprocess
+    """
+    policy = policy or get_encoding_policy()
+    cmd = ["ffmpeg", "-y"]
+    video_input = video_path
+    if is_url(video_path):
+        cmd += HTTP_INPUT_OPTIONS
+        if plan.loops > 1:
+            video_input = f"cache:{video_path}"
+    # -stream_loop N repeats the input N more times
+    if plan.loops > 1:
+        cmd += ["-stream_loop", str(plan.loops - 1)]
+    cmd += [*thread_args(), "-i", video_input]
+    if audio_path and plan.audio_mode:
+        if plan.loop_audio:
+            cmd += ["-stream_loop", "-1"]
+        cmd += ["-i", audio_path]
+    cmd += ["-map", "0:v:0"]
+    if audio_path and plan.audio_mode:
+        cmd += ["-map", "1:a:0"]
+    cmd += ["-t", str(plan.total_duration)]
+
+    if plan.video_mode == "copy":
+        cmd += ["-c:v", "copy"]
+    else:
+        cmd += [
+            "-vf", f"scale={plan.width}:{plan.height}",
+            *policy.video_args(
+                duration=plan.total_duration + (SLATE_DURATION if plan.slate else 0),
+                audio_bitrate=parse_bitrate(SEGMENT_AUDIO_BITRATE) if audio_path and plan.audio_mode else None
+            ),
+            "-r", str(plan.fps),
+        ]
+
+    if audio_path and plan.audio_mode == "copy":
+        cmd += ["-c:a", "copy"]
+    elif audio_path and plan.audio_mode == "encode":
+        cmd += ["-c:a", SEGMENT_AUDIO_CODEC, "-b:a", SEGMENT_AUDIO_BITRATE, "-ar", str(SEGMENT_AUDIO_RATE)]
+    else:
+        cmd += ["-an"]
+
+    if final_output:
+        cmd += final_output_args(output_path)
+    cmd += thread_args()
+    cmd.append(output_path)
+    if tee_path and source_duration:
+        cmd += ["-map", "0", "-c", "copy", "-t", str(source_duration), tee_path]
+    if thumbnails and source_duration:
+        cmd += build_thumbnail_outputs(thumbnails.get("poster"), thumbnails.get("sprite"), source_duration)
+    return cmd
+
+
+def compose_video(plan, video_path, audio_path, output_path, work_dir, birthday_message=None,
+                  tee_path=None, source_duration=None, thumbnails=None, sink=None, scratch=None,
+                  verbose=False):
+    """
+    Execute a "copy" or "transcode" plan with ffmpeg.
+
+    Args:
+        plan: CompositionPlan from plan_composition
+        video_path: Animated clip
+        audio_path: Soundtrack, or None
+        output_path: Final MP4 path
+        work_dir: Scratch directory for intermediate files
+        birthday_message: Slate text when plan.slate is set
+        tee_path: Optional path receiving a copy of the (remote) source clip
+        source_duration: Duration of the source clip (required with tee_path
+            and thumbnails)
+        thumbnails: Optional dict with "poster"/"sprite" output paths
+        sink: Optional stream sink (e.g. S3StreamSink); the final video is
+            written as fragmented MP4 to ffmpeg's stdout and consumed by the
+            sink as it is produced, so output_path itself is not written.
+            Ignored when the encoding policy has a size cap, which
+            enforce_max_size() can only apply to a finished local file
+        scratch: Optional ScratchSpace owning work_dir; large intermediates
+            take their paths from it so they respect its tmpfs budget
+        verbose: Print progress information
+
+    Returns:
+        output_path
+    """
+    if plan.video_mode not in ("copy", "transcode"):
+        raise ValueError(f"compose_video cannot execute a '{plan.video_mode}' plan")
+    if verbose:
+        print(f"   Composition plan: video={plan.video_mode}, audio={plan.audio_mode}, loops={plan.loops}, "
+              f"slate={plan.slate} ({plan.reason})")
+
+    if sink is not None and get_encoding_policy().max_bytes:
+        if verbose:
+            print("   Output size cap configured; writing the final video locally instead of streaming it")
+        sink = None
+
+    slate_path = None
+    if plan.slate and birthday_message and birthday_message.strip():
+        try:
+            slate_path = get_slate_cache(verbose=verbose).get_segment(
+                birthday_message, plan.width, plan.height, work_dir,
+                fps=plan.fps, duration=SLATE_DURATION,
+                audio_channels=plan.audio_channels if plan.audio_mode else None
+            )
+        except Exception as slate_e:
+            if verbose:
+                print(f"WARNING: Error creating birthday card slate: {slate_e}. Proceeding without it.")
+
+    # With a sink the delivered file never touches disk: ffmpeg writes it to stdout
+    final_target = PIPE_OUTPUT if sink else output_path
+    if not slate_path:
+        animated_path = final_target
+    elif scratch is not None:
+        animated_path = scratch.file("animated_part.mp4", work_dir)
+    else:
+        animated_path = os.path.join(work_dir, "animated_part.mp4")
+    animated_cmd = build_animated_cmd(plan, video_path, audio_path, animated_path,
+                                      tee_path=tee_path, source_duration=source_duration,
+                                      thumbnails=thumbnails, final_output=not slate_path)
+    if sink and not slate_path:
+        run_ffmpeg_to_sink(animated_cmd, sink, verbose=verbose)
+    else:
+        run_ffmpeg(animated_cmd, verbose=verbose)
+
+    if slate_path:
+        concat_file_path = os.path.join(work_dir, "concat.txt")
+        with open(concat_file_path, "w") as f:
+            f.write(f"file '{os.path.abspath(slate_path)}'\n")
+            f.write(f"file '{os.path.abspath(animated_path)}'\n")
+        concat_cmd = [
+            "ffmpeg", "-y",
+            "-f", "concat",
+            "-safe", "0",
+            "-i", concat_file_path,
+            "-c", "copy",  # Just copy, don't re-encode
+            *final_output_args(final_target),
+            *thread_args(),
+            final_target
+        ]
+        if sink:
+            run_ffmpeg_to_sink(concat_cmd, sink, verbose=verbose)
+        else:
+            run_ffmpeg(concat_cmd, verbose=verbose)
+
+    if sink:
+        if verbose:
+            print(f"✅ Final video streamed to {sink.url}")
+        return output_path
+    if not os.path.exists(output_path) or os.path.getsize(output_path) == 0:
+        raise RuntimeError(f"FFmpeg produced no output at {output_path}")
+    # Capped CRF keeps most outputs within the size budget; re-encode the rest
+    enforce_max_size(
+        output_path, get_encoding_policy(),
+        plan.total_duration + (SLATE_DURATION if slate_path else 0),
+        audio_bitrate=parse_bitrate(SEGMENT_AUDIO_BITRATE) if audio_path and plan.audio_mode else None,
+        verbose=verbose
+    )
+    if verbose:
+        print(f"✅ Final video saved to {output_path}")
+    return output_path
+
+
+class CompositionPrep:
+    """
+    Composition work that only depends on job parameters, run in the background.
+
+    Looping the soundtrack and rendering/encoding the slate do not need the
+    Runway output, so they are started as soon as a job starts and overlap the
+    Runway wait. Results land in the prepared-audio and slate caches; once
+    wait() returns, compose-time lookups for the same parameters are cache
+    hits and only the final loop and mux remain on the critical path.
+    """
+
+    def __init__(self, audio_path, total_duration, birthday_message=None, expected_size=None,
+                 fps=SEGMENT_FPS, scratch=None, verbose=False):
+        """
+        Initialize the preparation.
+
+        Args:
+            audio_path: Soundtrack to prepare, or None
+            total_duration: Target duration of the animated part in seconds
+            birthday_message: Slate text, or None for no slate
+            expected_size: (width, height) the Runway clip is expected to have
+            fps: Slate frame rate
+            scratch: Job's ScratchSpace for intermediates (defaults to the system temp directory)
+            verbose: Print progress information
+        """
+        self.audio_path = audio_path
+        self.total_duration = total_duration
+        self.birthday_message = birthday_message
+        self.expected_size = expected_size
+        self.fps = fps
+        self.scratch = scratch
+        self.verbose = verbose
+        self.work_dir = None
+        self._executor = None
+        self._futures = {}
+
+    def start(self):
+        """Submit the preparation tasks and return self."""
+        if self.scratch is not None:
+            self.work_dir = self.scratch.mkdtemp(prefix="prep_")
+        else:
+            self.work_dir = tempfile.mkdtemp(prefix="chibiclip_prep_")
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="compose-prep")
+        if self.audio_path:
+            self._futures["audio"] = self._executor.submit(self._prepare_audio)
+        if self.birthday_message and self.birthday_message.strip() and self.expected_size:
+            self._futures["slate"] = self._executor.submit(self._prepare_slate)
+        if self.verbose and self._futures:
+            print(f"Started background composition prep: {', '.join(self._futures)}")
+        return self
+
+    def _prepare_audio(self):
+        return get_prepared_audio_cache(verbose=self.verbose).prepare(
+            self.audio_path, self.total_duration, self.work_dir
+        )
+
+    def _prepare_slate(self):
+        width, height = self.expected_size
+        get_slate_renderer(verbose=self.verbose).warm([(width, height)])
+        # The slate's silent track must match the soundtrack's channel layout
+        # (prepared tracks keep the source channel count)
+        audio_channels = probe_media(self.audio_path).channels if self.audio_path else None
+        return get_slate_cache(verbose=self.verbose).get_segment(
+            self.birthday_message, width, height, self.work_dir,
+            fps=self.fps, duration=SLATE_DURATION, audio_channels=audio_channels
+        )
+
+    def wait(self, timeout=None):
+        """
+        Block until preparation finishes.
+
+        Failures are only logged: composition redoes any missing step itself.
+
+        Returns:
+            Dict of step name to result (None for failed steps)
+        """
+        if not self._futures:
+            return {}
+        wait_futures(list(self._futures.values()), timeout=timeout)
+        results = {}
+        for name, future in self._futures.items():
+            try:
+                results[name] = future.result(timeout=0)
+            except Exception as e:
+                results[name] = None
+                if self.verbose:
+                    print(f"Warning: Background {name} preparation failed: {e}")
+        return results
+
+    def close(self):
+        """Stop the worker threads and remove the scratch directory."""
+        if self._executor:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        if self.work_dir:
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+            self.work_dir = None
@@ -0,0 +1,180 @@
+"""
+Node-local CPU thread budget for ffmpeg encodes.
+
+Celery runs one worker process per core, and each job can spawn several
+ffmpeg processes that would otherwise all size their thread pools to the whole
+machine. Compose jobs instead take a lease from a budget shared by every
+worker process on the node:
+
+    threads = clamp(total / (active leases + 1), 1, free threads)
+
+so a lone job gets the whole machine and concurrent jobs split it. Leases are
+recorded in a small JSON token file guarded by an exclusive file lock; leases
+of processes that died are discarded on the next acquire.
+
+Celery's prefork workers run one job per process, so the lease is held per
+process and every thread of the job reads it through
+thread_args()/current_threads(). A job takes it when the Runway output
+arrives and holds it through composition, thumbnails, renditions and HLS,
+so background prep still running then is covered too. Prep that runs
+during the Runway wait, like any other ffmpeg run outside a lease, gets
+UNLEASED_THREADS, so it never oversubscribes the node while the job holds
+no share of it.
+"""
+
+import os
+import json
+import uuid
+import tempfile
+import threading
+from contextlib import contextmanager
+
+# fcntl is POSIX-only; without it every lease gets the full budget
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
+
+# Threads available to ffmpeg on this node (CHIBICLIP_CPU_THREADS, default: all cores)
+NODE_CPU_THREADS = int(os.getenv("CHIBICLIP_CPU_THREADS", "0")) or os.cpu_count() or 1
+CPU_STATE_DIR = os.getenv(
+    "CHIBICLIP_CPU_STATE_DIR",
+    os.path.join(tempfile.gettempdir(), "chibiclip_cpu")
+)
+# Threads for ffmpeg runs outside a lease (e.g. prep during the Runway wait)
+UNLEASED_THREADS = 1
+
+_lease_lock = threading.Lock()
+_lease = {"threads": None, "depth": 0, "token": None}
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class CPUBudget:
+    """Thread budget shared by all worker processes on a node through a token file."""
+
+    def __init__(self, total_threads=NODE_CPU_THREADS, state_dir=CPU_STATE_DIR):
+        """
+        Initialize the budget.
+
+        Args:
+            total_threads: Threads the node may spend on encoding
+            state_dir: Directory holding the token and lock files
+        """
+        self.total_threads = max(1, total_threads)
+        self.state_dir = state_dir
+        self.state_path = os.path.join(state_dir, "leases.json")
+        self.lock_path = os.path.join(state_dir, "leases.lock")
+        os.makedirs(state_dir, exist_ok=True)
+
+    @contextmanager
+    def _locked_state(self):
+        """Yield the lease table under an exclusive lock and write it back."""
+        with open(self.lock_path, "a") as lock_file:
+            if FCNTL_AVAILABLE:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                try:
+                    with open(self.state_path) as f:
+                        leases = json.load(f)
+                except (OSError, ValueError):
+                    leases = {}
+                # Drop leases of worker processes that died without releasing
+                leases = {token: lease for token, lease in leases.items() if _pid_alive(lease["pid"])}
+                yield leases
+                tmp_path = f"{self.state_path}.{os.getpid()}.tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump(leases, f)
+                os.replace(tmp_path, self.state_path)
+            finally:
+                if FCNTL_AVAILABLE:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def acquire(self):
+        """
+        Reserve threads for one compose job.
+
+        Returns:
+            Tuple of (token, threads)
+        """
+        token = uuid.uuid4().hex
+        if not FCNTL_AVAILABLE:
+            return token, self.total_threads
+        with self._locked_state() as leases:
+            used = sum(lease["threads"] for lease in leases.values())
+            free = max(1, self.total_threads - used)
+            fair_share = max(1, self.total_threads // (len(leases) + 1))
+            threads = min(free, fair_share)
+            leases[token] = {"pid": os.getpid(), "threads": threads}
+        return token, threads
+
+    def release(self, token):
+        """Return a lease's threads to the budget."""
+        if not FCNTL_AVAILABLE:
+            return
+        with self._locked_state() as leases:
+            leases.pop(token, None)
+
+    def active_leases(self):
+        """Return the current lease table (token -> {pid, threads})."""
+        with self._locked_state() as leases:
+            return dict(leases)
+
+
+_default_budget = None
+
+
+def get_cpu_budget():
+    """Return the process-wide CPUBudget."""
+    global _default_budget
+    if _default_budget is None:
+        _default_budget = CPUBudget()
+    return _default_budget
+
+
+@contextmanager
+def cpu_lease(verbose=False):
+    """
+    Hold a thread allocation for the current job.
+
+    Re-entrant within a process: nested leases (e.g. renditions inside a job
+    that already holds one) reuse the outer allocation.
+
+    Yields:
+        Number of threads allocated
+    """
+    with _lease_lock:
+        nested = _lease["depth"] > 0
+        if not nested:
+            _lease["token"], _lease["threads"] = get_cpu_budget().acquire()
+            if verbose:
+                print(f"CPU budget: leased {_lease['threads']} of {get_cpu_budget().total_threads} threads")
+        _lease["depth"] += 1
+        threads = _lease["threads"]
+    try:
+        yield threads
+    finally:
+        with _lease_lock:
+            _lease["depth"] -= 1
+            if _lease["depth"] == 0:
+                get_cpu_budget().release(_lease["token"])
+                _lease["token"], _lease["threads"] = None, None
+
+
+def current_threads():
+    """Threads the current process may give one ffmpeg/MoviePy encode."""
+    return _lease["threads"] or UNLEASED_THREADS
+
+
+def thread_args():
+    """ffmpeg -threads option for the current allocation."""
+    return ["-threads", str(current_threads())]
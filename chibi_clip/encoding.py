@@ -0,0 +1,306 @@
+"""
+Encoding policies for delivered video.
+
+The clips are flat-colour, cel-shaded animation at modest resolutions, which
+x264 compresses far better than the old fixed "4000k at ultrafast" settings
+assumed. An EncodingPolicy picks a constant quality (CRF), preset and tune per
+output instead of a fixed bitrate:
+
+    delivery   the main video, CRF 26 with tune=animation
+    low        the low-bandwidth rendition, CRF 30
+    legacy     the previous fixed-bitrate settings, kept for benchmarking
+
+An optional maximum file size turns the CRF encode into a capped CRF encode
+(-maxrate/-bufsize derived from the size budget). If the output still ends up
+over budget, enforce_max_size() re-encodes it with a two-pass average bitrate
+encode, which only happens for unusually busy content.
+
+Segments that are concatenated with stream copy (slate + animated part) must
+share their H.264 parameter sets, so every policy pins profile and level and
+both sides of a concat are encoded with the same policy.
+
+Benchmark the policies against each other on a sample clip with:
+
+    python -m chibi_clip.encoding sample.mp4 --policies legacy,delivery,low
+
+The size, encode time and SSIM of each policy are printed; SSIM compares
+each encode with the sample. The policies have not been benchmarked on real
+composed clips yet: CRF 26 with tune=animation and CRF 30 are starting
+points, not measured choices.
+"""
+
+import os
+import re
+import time
+import shutil
+import tempfile
+import subprocess
+from dataclasses import dataclass, replace, asdict
+from typing import Optional
+
+from .cpu_budget import thread_args
+
+VIDEO_CODEC = "libx264"
+PIX_FMT = "yuv420p"
+DEFAULT_POLICY = os.getenv("CHIBICLIP_ENCODING_POLICY", "delivery")
+# Optional size budget for the delivered video (CHIBICLIP_MAX_OUTPUT_MB, 0 = unlimited)
+MAX_OUTPUT_BYTES = int(float(os.getenv("CHIBICLIP_MAX_OUTPUT_MB", "0")) * 1024 * 1024) or None
+# Share of the size budget the video stream may use (the rest covers audio and container overhead)
+VIDEO_BUDGET_SHARE = 0.95
+
+
+@dataclass(frozen=True)
+class EncodingPolicy:
+    """How one output is encoded."""
+    name: str
+    preset: str
+    crf: Optional[int] = None       # Constant quality; ignored when bitrate is set
+    bitrate: Optional[str] = None   # Fixed average bitrate (legacy behaviour)
+    tune: Optional[str] = None
+    profile: str = "high"
+    level: str = "4.0"
+    max_bytes: Optional[int] = None
+
+    def extra_args(self, duration=None, audio_bitrate=None):
+        """
+        Encoder options other than codec and preset.
+
+        Args:
+            duration: Output duration in seconds (needed for the size cap)
+            audio_bitrate: Audio bitrate in bits/s sharing the size budget
+
+        Returns:
+            Argument list for ffmpeg (also usable as MoviePy ffmpeg_params)
+        """
+        args = []
+        if self.bitrate:
+            args += ["-b:v", self.bitrate]
+        elif self.crf is not None:
+            args += ["-crf", str(self.crf)]
+            if self.max_bytes and duration:
+                maxrate = target_video_bitrate(self.max_bytes, duration, audio_bitrate)
+                args += ["-maxrate", str(maxrate), "-bufsize", str(2 * maxrate)]
+        if self.tune:
+            args += ["-tune", self.tune]
+        args += ["-profile:v", self.profile, "-level:v", self.level, "-pix_fmt", PIX_FMT]
+        return args
+
+    def video_args(self, duration=None, audio_bitrate=None):
+        """Full ffmpeg video encoder options (codec, preset and extra_args)."""
+        return ["-c:v", VIDEO_CODEC, "-preset", self.preset] + self.extra_args(duration, audio_bitrate)
+
+    def cache_params(self):
+        """
+        Settings that affect encoded bytes (part of cache keys).
+
+        max_bytes is left out: it only caps outputs encoded with a duration.
+        """
+        params = asdict(self)
+        params.pop("max_bytes")
+        return params
+
+
+POLICIES = {
+    "delivery": EncodingPolicy("delivery", preset="veryfast", crf=26, tune="animation"),
+    "low": EncodingPolicy("low", preset="veryfast", crf=30, tune="animation"),
+    "legacy": EncodingPolicy("legacy", preset="ultrafast", bitrate="4000k"),
+}
+
+
+def get_encoding_policy(name=None, max_bytes=None):
+    """
+    Return an encoding policy by name.
+
+    Args:
+        name: Policy name (defaults to CHIBICLIP_ENCODING_POLICY, "delivery")
+        max_bytes: Size budget; defaults to CHIBICLIP_MAX_OUTPUT_MB for the
+            default policy and to no budget for the others
+
+    Raises:
+        ValueError: If the policy name is unknown
+    """
+    name = name or DEFAULT_POLICY
+    if name not in POLICIES:
+        raise ValueError(f"Unknown encoding policy '{name}'. Available: {', '.join(POLICIES)}")
+    policy = POLICIES[name]
+    if max_bytes is None and name == DEFAULT_POLICY:
+        max_bytes = MAX_OUTPUT_BYTES
+    return replace(policy, max_bytes=max_bytes) if max_bytes else policy
+
+
+
+def keyframe_args(interval):
+    """
+    Encoder options that place a keyframe every interval seconds (no scene-cut keyframes).
+
+    Renditions encoded with the same interval start a GOP at the same
+    timestamps, so their HLS segments line up and players can switch
+    between them at any segment boundary.
+
+    Returns:
+        Argument list for ffmpeg
+    """
+    return ["-force_key_frames", f"expr:gte(t,n_forced*{interval})", "-sc_threshold", "0"]
+
+def parse_bitrate(value):
+    """Convert an ffmpeg bitrate such as "192k" or "4M" into bits/s."""
+    value = str(value).strip().lower()
+    multiplier = {"k": 1000, "m": 1000000}.get(value[-1:], 1)
+    return int(float(value.rstrip("km")) * multiplier)
+
+
+def target_video_bitrate(max_bytes, duration, audio_bitrate=None):
+    """
+    Video bitrate (bits/s) that keeps an output of duration seconds under max_bytes.
+
+    Args:
+        max_bytes: Size budget
+        duration: Output duration in seconds
+        audio_bitrate: Audio bitrate in bits/s, or None for no audio
+    """
+    total = max_bytes * 8 * VIDEO_BUDGET_SHARE / max(duration, 0.1)
+    return max(100000, int(total - (audio_bitrate or 0)))
+
+
+def _run(cmd, verbose=False):
+    if verbose:
+        print(f"   Running FFmpeg command: {' '.join(cmd)}")
+    try:
+        subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except FileNotFoundError:
+        raise RuntimeError("ffmpeg not found. Ensure ffmpeg is installed and in PATH.")
+    except subprocess.CalledProcessError as e:
+        stderr = e.stderr.decode(errors="replace")[-2000:] if e.stderr else ""
+        raise RuntimeError(f"FFmpeg failed ({e.returncode}): {stderr}") from e
+
+
+def two_pass_encode(src_path, dest_path, policy, bitrate, work_dir, verbose=False):
+    """
+    Re-encode src_path at an average bitrate with a two-pass encode.
+
+    Audio is stream-copied; only the video is re-encoded.
+
+    Args:
+        src_path: Input video
+        dest_path: Output MP4
+        policy: EncodingPolicy supplying preset, tune, profile and level
+        bitrate: Target video bitrate in bits/s
+        work_dir: Directory for the pass log
+        verbose: Print the ffmpeg commands
+    """
+    passlog = os.path.join(work_dir, "x264_2pass")
+    base = replace(policy, crf=None, bitrate=str(bitrate), max_bytes=None).video_args()
+    _run(["ffmpeg", "-y", "-i", src_path, *base, "-pass", "1", "-passlogfile", passlog,
+          "-an", *thread_args(), "-f", "mp4", os.devnull], verbose=verbose)
+    _run(["ffmpeg", "-y", "-i", src_path, *base, "-pass", "2", "-passlogfile", passlog,
+          "-c:a", "copy", "-movflags", "+faststart", *thread_args(), dest_path], verbose=verbose)
+    return dest_path
+
+
+def enforce_max_size(path, policy, duration, audio_bitrate=None, verbose=False):
+    """
+    Make sure a delivered file fits policy.max_bytes, re-encoding it if needed.
+
+    Capped CRF normally keeps outputs within budget, so this is a no-op for
+    most jobs. Oversized files are replaced by a two-pass encode.
+
+    Returns:
+        True if the file was re-encoded
+    """
+    if not policy.max_bytes or not os.path.exists(path) or os.path.getsize(path) <= policy.max_bytes:
+        return False
+    if verbose:
+        print(f"   Output is {os.path.getsize(path)} bytes, over the {policy.max_bytes} byte budget. "
+              f"Re-encoding with two passes.")
+    work_dir = tempfile.mkdtemp(prefix="chibiclip_2pass_")
+    try:
+        tmp_path = os.path.join(work_dir, "two_pass.mp4")
+        two_pass_encode(path, tmp_path, policy, target_video_bitrate(policy.max_bytes, duration, audio_bitrate),
+                        work_dir, verbose=verbose)
+        os.replace(tmp_path, path)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return True
+
+
+def measure_ssim(encoded_path, reference_path, duration=None):
+    """
+    Mean SSIM of the video of encoded_path against reference_path.
+
+    Args:
+        encoded_path: Encoded video
+        reference_path: Video it was encoded from
+        duration: Only compare the first N seconds
+
+    Returns:
+        SSIM between 0 and 1, or None if ffmpeg did not report one
+    """
+    cmd = ["ffmpeg", "-i", encoded_path, "-i", reference_path]
+    if duration:
+        cmd += ["-t", str(duration)]
+    cmd += ["-lavfi", "[0:v][1:v]ssim", "-f", "null", "-"]
+    try:
+        proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except FileNotFoundError:
+        raise RuntimeError("ffmpeg not found. Ensure ffmpeg is installed and in PATH.")
+    match = re.search(r"SSIM .*All:([0-9.]+)", proc.stderr.decode(errors="replace"))
+    return float(match.group(1)) if match else None
+
+
+def benchmark(src_path, policy_names, duration=None, verbose=False):
+    """
+    Encode src_path with each policy and measure size, encode time and SSIM.
+
+    Returns:
+        List of dicts with policy, seconds, bytes, kbps and ssim
+    """
+    work_dir = tempfile.mkdtemp(prefix="chibiclip_bench_")
+    results = []
+    try:
+        for name in policy_names:
+            policy = get_encoding_policy(name)
+            dest = os.path.join(work_dir, f"{name}.mp4")
+            cmd = ["ffmpeg", "-y", "-i", src_path]
+            if duration:
+                cmd += ["-t", str(duration)]
+            cmd += policy.video_args(duration) + ["-c:a", "copy", *thread_args(), dest]
+            start = time.perf_counter()
+            _run(cmd, verbose=verbose)
+            elapsed = time.perf_counter() - start
+            size = os.path.getsize(dest)
+            probe = subprocess.run(
+                ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", dest],
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE
+            )
+            out_duration = float(probe.stdout.strip() or 0) or duration or 1
+            results.append({
+                "policy": name,
+                "seconds": round(elapsed, 2),
+                "bytes": size,
+                "kbps": round(size * 8 / out_duration / 1000),
+                "ssim": measure_ssim(dest, src_path, duration),
+            })
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    ap = argparse.ArgumentParser(description="Compare encoding policies on a sample clip (size, encode time and SSIM).")
+    ap.add_argument("input", help="Sample video, e.g. a composed birthday clip")
+    ap.add_argument("--policies", default="legacy,delivery,low",
+                    help=f"Comma-separated policies to compare ({', '.join(POLICIES)})")
+    ap.add_argument("--duration", type=float, help="Only encode the first N seconds")
+    ap.add_argument("--verbose", action="store_true", help="Print the ffmpeg commands")
+    args = ap.parse_args()
+
+    rows = benchmark(args.input, [p.strip() for p in args.policies.split(",") if p.strip()],
+                     duration=args.duration, verbose=args.verbose)
+    baseline = rows[0]
+    print(f"{'policy':<10} {'seconds':>8} {'bytes':>12} {'kbps':>7} {'size vs ' + baseline['policy']:>16} {'ssim':>7}")
+    for row in rows:
+        ratio = row["bytes"] / baseline["bytes"] if baseline["bytes"] else 0
+        ssim = f"{row['ssim']:.4f}" if row["ssim"] is not None else "n/a"
+        print(f"{row['policy']:<10} {row['seconds']:>8} {row['bytes']:>12} {row['kbps']:>7} {ratio:>15.0%} {ssim:>7}")
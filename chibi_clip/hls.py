@@ -0,0 +1,241 @@
+"""
+HLS packaging.
+
+Packages the composed MP4 (and any MP4 renditions) as HLS: each rendition is
+stream-copied into short MPEG-TS segments with its own media playlist, and a
+master playlist lists every rendition with its bandwidth, resolution and
+codecs so players can switch between them. BANDWIDTH is the peak segment
+bitrate, as HLS requires, and AVERAGE-BANDWIDTH the mean over all segments.
+
+Segments can only start on keyframes, and players switch variants at segment
+boundaries, so every variant needs a keyframe at each multiple of the segment
+length. Ladder renditions are encoded that way when HLS is requested (see
+encoding.keyframe_args). A source whose keyframes are not on that grid (the
+composed original, or a stream-copied Runway clip, which keeps x264's default
+interval of about 10 s) is re-encoded while it is segmented instead of copied.
+
+Variants of a ladder must show the same picture at different sizes; sources
+whose aspect ratio differs from the first are left out of the package.
+
+Layout (relative paths, so the directory can be uploaded as-is):
+
+    <package>/master.m3u8
+    <package>/<rendition>/index.m3u8
+    <package>/<rendition>/segment_000.ts
+"""
+
+import os
+import subprocess
+from dataclasses import replace
+
+from .probe import probe_media, keyframe_times
+from .encoding import get_encoding_policy, keyframe_args
+from .cpu_budget import thread_args
+
+# Target segment length in seconds (CHIBICLIP_HLS_SEGMENT_SECONDS)
+HLS_SEGMENT_SECONDS = int(os.getenv("CHIBICLIP_HLS_SEGMENT_SECONDS", "4"))
+HLS_MASTER_PLAYLIST = "master.m3u8"
+HLS_MEDIA_PLAYLIST = "index.m3u8"
+# How far a keyframe may be from its segment boundary and still count as on it
+KEYFRAME_TOLERANCE_SECONDS = 0.05
+# Profile and constraint bytes of avc1 codec strings (RFC 6381), by ffprobe profile name
+AVC_PROFILES = {
+    "Constrained Baseline": "42E0",
+    "Baseline": "4200",
+    "Main": "4D40",
+    "High": "6400",
+}
+# mp4a object types by ffprobe AAC profile name
+AAC_OBJECT_TYPES = {"LC": 2, "HE-AAC": 5, "HE-AACv2": 29}
+
+
+def keyframes_aligned(path, duration, segment_seconds=HLS_SEGMENT_SECONDS):
+    """
+    Whether a video has a keyframe at every multiple of segment_seconds.
+
+    Args:
+        path: Local video
+        duration: Its duration in seconds
+        segment_seconds: Segment length
+
+    Returns:
+        True if the video can be segmented with stream copy
+    """
+    times = keyframe_times(path)
+    boundary = 0.0
+    while boundary < duration - KEYFRAME_TOLERANCE_SECONDS:
+        if not any(abs(t - boundary) <= KEYFRAME_TOLERANCE_SECONDS for t in times):
+            return False
+        boundary += segment_seconds
+    return True
+
+
+def build_segment_cmd(source_path, rendition_dir, segment_seconds=HLS_SEGMENT_SECONDS, policy=None):
+    """
+    Build the ffmpeg command that segments one MP4 into an HLS media playlist.
+
+    Args:
+        source_path: MP4 to segment
+        rendition_dir: Directory for the playlist and segments
+        segment_seconds: Segment length
+        policy: EncodingPolicy to re-encode the video with, keyframes on the
+            segment grid; None stream-copies it (its keyframes must already be aligned)
+
+    Returns:
+        Argument list for subprocess
+    """
+    if policy is None:
+        codec_args = ["-c", "copy"]
+    else:
+        codec_args = [*policy.video_args(), *keyframe_args(segment_seconds), "-c:a", "copy"]
+    return [
+        "ffmpeg", "-y",
+        "-i", source_path,
+        "-map", "0:v:0", "-map", "0:a?",
+        *codec_args,
+        "-f", "hls",
+        "-hls_time", str(segment_seconds),
+        "-hls_playlist_type", "vod",
+        "-hls_segment_filename", os.path.join(rendition_dir, "segment_%03d.ts"),
+        *thread_args(),
+        os.path.join(rendition_dir, HLS_MEDIA_PLAYLIST)
+    ]
+
+
+def segment_bitrates(rendition_dir):
+    """
+    Peak and average bitrate of a segmented rendition, from its media playlist.
+
+    Returns:
+        (peak, average) in bits per second, or (None, None) if the playlist lists no segments
+    """
+    peak = 0
+    total_bits = 0
+    total_duration = 0.0
+    duration = None
+    with open(os.path.join(rendition_dir, HLS_MEDIA_PLAYLIST)) as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith("#EXTINF:"):
+                duration = float(line[len("#EXTINF:"):].split(",", 1)[0])
+            elif line and not line.startswith("#") and duration:
+                bits = os.path.getsize(os.path.join(rendition_dir, line)) * 8
+                peak = max(peak, int(bits / duration))
+                total_bits += bits
+                total_duration += duration
+                duration = None
+    if not total_duration:
+        return None, None
+    return peak, int(total_bits / total_duration)
+
+
+def codecs_attribute(info):
+    """
+    RFC 6381 codec string of a probed rendition (e.g. "avc1.640028,mp4a.40.2").
+
+    Returns:
+        The CODECS value, or None if a stream's codec cannot be described
+    """
+    codecs = []
+    if info.has_video:
+        profile = AVC_PROFILES.get(info.video_profile)
+        if info.video_codec != "h264" or profile is None or not info.video_level:
+            return None
+        codecs.append(f"avc1.{profile}{info.video_level:02X}")
+    if info.has_audio:
+        object_type = AAC_OBJECT_TYPES.get(info.audio_profile)
+        if info.audio_codec != "aac" or object_type is None:
+            return None
+        codecs.append(f"mp4a.40.{object_type}")
+    return ",".join(codecs) or None
+
+
+def _stream_inf(info, peak, average):
+    """Build the #EXT-X-STREAM-INF attributes for a probed, segmented rendition."""
+    if not peak:
+        # No segment sizes to go by; fall back on the file's mean bitrate
+        peak = average = int(info.size_bytes * 8 / info.duration) if info.size_bytes and info.duration else 1000000
+    attributes = [f"BANDWIDTH={peak}", f"AVERAGE-BANDWIDTH={average}"]
+    if info.width and info.height:
+        attributes.append(f"RESOLUTION={info.width}x{info.height}")
+    codecs = codecs_attribute(info)
+    if codecs:
+        attributes.append(f'CODECS="{codecs}"')
+    return ",".join(attributes)
+
+
+def _aspect(info):
+    return info.width / info.height if info.width and info.height else None
+
+
+def package_hls(sources, package_dir, segment_seconds=HLS_SEGMENT_SECONDS, policy=None, verbose=False):
+    """
+    Package MP4 renditions as HLS with a master playlist.
+
+    Args:
+        sources: Dict of rendition name to MP4 path; the first is the reference
+            picture, and non-MP4 entries or ones with another aspect ratio are skipped
+        package_dir: Output directory for the package (created if missing)
+        segment_seconds: Segment length
+        policy: EncodingPolicy for sources whose keyframes are off the segment
+            grid (default: the default policy)
+        verbose: Print progress information
+
+    Returns:
+        Path to the master playlist
+
+    Raises:
+        ValueError: If no MP4 source was given
+        RuntimeError: If ffmpeg/ffprobe fail
+    """
+    variants = []
+    reference_aspect = None
+    for name, path in sources.items():
+        if not path.lower().endswith(".mp4"):
+            continue
+        info = probe_media(path)
+        aspect = _aspect(info)
+        if reference_aspect is None:
+            reference_aspect = aspect
+        elif aspect is None or abs(aspect - reference_aspect) > 0.01:
+            if verbose:
+                print(f"Skipping {name} for HLS: its framing differs from the other variants")
+            continue
+        rendition_dir = os.path.join(package_dir, name)
+        os.makedirs(rendition_dir, exist_ok=True)
+        reencode_policy = None
+        if not keyframes_aligned(path, info.duration, segment_seconds):
+            # Copying would cut segments wherever the source happens to have keyframes
+            reencode_policy = policy or get_encoding_policy(max_bytes=0)
+            if verbose:
+                print(f"Re-encoding {name} for HLS: its keyframes are not every {segment_seconds}s")
+        cmd = build_segment_cmd(path, rendition_dir, segment_seconds, reencode_policy)
+        if verbose:
+            print(f"Packaging {name} as HLS: {' '.join(cmd)}")
+        try:
+            subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except FileNotFoundError:
+            raise RuntimeError("ffmpeg not found. Ensure ffmpeg is installed and in PATH.")
+        except subprocess.CalledProcessError as e:
+            stderr = e.stderr.decode(errors="replace")[-2000:] if e.stderr else ""
+            raise RuntimeError(f"FFmpeg HLS packaging failed for {name}: {stderr}") from e
+        if reencode_policy is not None:
+            # CODECS must describe the re-encoded stream, not the source
+            segment = probe_media(os.path.join(rendition_dir, "segment_000.ts"))
+            info = replace(info, video_codec=segment.video_codec, video_profile=segment.video_profile,
+                           video_level=segment.video_level)
+        variants.append((info, *segment_bitrates(rendition_dir), f"{name}/{HLS_MEDIA_PLAYLIST}"))
+
+    if not variants:
+        raise ValueError("HLS packaging needs at least one MP4 rendition")
+
+    # Highest bandwidth first, so players that pick the first entry start with the best quality
+    variants.sort(key=lambda variant: variant[2] or variant[0].size_bytes or 0, reverse=True)
+    master_path = os.path.join(package_dir, HLS_MASTER_PLAYLIST)
+    with open(master_path, "w") as f:
+        f.write("#EXTM3U\n#EXT-X-VERSION:3\n")
+        for info, peak, average, playlist in variants:
+            f.write(f"#EXT-X-STREAM-INF:{_stream_inf(info, peak, average)}\n{playlist}\n")
+    if verbose:
+        print(f"✅ HLS package with {len(variants)} rendition(s) written to {master_path}")
+    return master_path
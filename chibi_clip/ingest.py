@@ -0,0 +1,307 @@
+"""
+Streaming ingest of request uploads.
+
+Werkzeug normally spools every file part of a multipart request into a
+temporary file (on disk above 500 KB) before the view runs, and the view
+then reads it back. For /generate the server instead hands the form parser
+an upload sink per file part (see server.py's StreamingUploadRequest), so
+each chunk goes to its destination while the body is still being received:
+
+    StorageUploadSink   photos: chunks are passed to a thread that streams
+                        them into the storage backend (a multipart upload
+                        on S3)
+    AudioIngestSink     soundtracks: chunks are piped into ffmpeg, which
+                        keeps the seconds that can be used as AAC in a
+                        scratch workspace; only that AAC is stored
+    DiscardSink         parts the view will reject: counted and dropped
+
+Sinks never raise from write(): the form parser treats a ValueError as a
+malformed body and silently drops the whole form. Problems are recorded
+and raised from result(), which the view calls once the form is parsed.
+"""
+
+import uuid
+import queue
+import threading
+
+from .audio import AudioIngest, MAX_AUDIO_UPLOAD_BYTES
+
+# Chunks held between the request thread and an upload thread (about 64 KB each)
+PIPE_MAX_CHUNKS = 16
+PIPE_PUT_TIMEOUT = 1.0
+
+
+class UploadTooLarge(ValueError):
+    """Raised when a streamed file part exceeds its size limit."""
+
+
+class UploadAborted(Exception):
+    """Raised to the reading side of a ChunkPipe when the upload is abandoned."""
+
+
+class ChunkPipe:
+    """
+    Bounded hand-off of byte chunks from a writer thread to a reader thread.
+
+    The reading side is a non-seekable binary stream, so storage backends
+    upload it without a local copy (and without content-addressing, which
+    would need a second pass over the bytes).
+    """
+
+    def __init__(self, max_chunks=PIPE_MAX_CHUNKS):
+        self._queue = queue.Queue(max_chunks)
+        self._buffer = bytearray()
+        self._eof = False
+        self.reader_done = threading.Event()
+
+    # Writer side
+
+    def put(self, chunk):
+        """Queue a chunk; returns False if the reader has stopped and the chunk was dropped."""
+        while not self.reader_done.is_set():
+            try:
+                self._queue.put(chunk, timeout=PIPE_PUT_TIMEOUT)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def close(self):
+        """Signal the end of the stream to the reader."""
+        self.put(None)
+
+    def abort(self, error=None):
+        """Make the reader's next read raise error (UploadAborted by default)."""
+        self.put(error or UploadAborted("Upload abandoned"))
+
+    # Reader side
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def read(self, size=-1):
+        while not self._eof and (size is None or size < 0 or len(self._buffer) < size):
+            item = self._queue.get()
+            if item is None:
+                self._eof = True
+            elif isinstance(item, BaseException):
+                raise item
+            else:
+                self._buffer += item
+        if size is None or size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+
+class StorageUploadSink:
+    """
+    File part container that streams the part into a storage backend.
+
+    The upload runs on its own thread and reads the part through a
+    ChunkPipe while the form parser writes it, so nothing is spooled to
+    local disk and the upload finishes shortly after the body does.
+    """
+
+    def __init__(self, storage, filename, key_prefix="inputs", max_bytes=None):
+        """
+        Start the upload.
+
+        Args:
+            storage: StorageBackend to upload into
+            filename: Client filename (for the extension and content type)
+            key_prefix: Prefix for the stored key
+            max_bytes: Abandon the upload once the part is larger than this
+        """
+        self.filename = filename
+        self.max_bytes = max_bytes
+        self.received = 0
+        self.too_large = False
+        self._pipe = ChunkPipe()
+        self._result = None
+        self._error = None
+        self._closed = False
+        self._thread = threading.Thread(
+            target=self._upload, args=(storage, filename, key_prefix), name="upload-sink", daemon=True
+        )
+        self._thread.start()
+
+    def _upload(self, storage, filename, key_prefix):
+        try:
+            self._result = storage.upload_fileobj(self._pipe, filename, key_prefix=key_prefix)
+        except BaseException as e:
+            self._error = e
+        finally:
+            self._pipe.reader_done.set()
+
+    def write(self, chunk):
+        if self._closed:
+            return len(chunk)
+        self.received += len(chunk)
+        if self.max_bytes and self.received > self.max_bytes:
+            # Abandon the upload; the rest of the part is read off the socket and dropped
+            self.too_large = True
+            self._finish(self._pipe.abort)
+        else:
+            self._pipe.put(chunk)
+        return len(chunk)
+
+    def seek(self, offset, whence=0):
+        # The form parser rewinds each part once it has been written; there is nothing to rewind
+        return 0
+
+    def tell(self):
+        return self.received
+
+    def _finish(self, signal):
+        if not self._closed:
+            self._closed = True
+            signal()
+        self._thread.join()
+
+    def result(self):
+        """
+        Wait for the upload to complete (call once the form is parsed).
+
+        Returns:
+            URL and key of the stored object
+
+        Raises:
+            UploadTooLarge: If the part exceeded max_bytes
+            Exception: Whatever the storage backend raised
+        """
+        self._finish(self._pipe.close)
+        if self.too_large:
+            raise UploadTooLarge(f"{self.filename} exceeds the {self.max_bytes // (1024 * 1024)} MB limit")
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+    def discard(self):
+        """
+        Abandon an upload the view never collected.
+
+        In-flight uploads are aborted, so no object is created. An upload
+        that already completed is left to the lifecycle's orphan sweep.
+        """
+        self._finish(self._pipe.abort)
+
+    def close(self):
+        self.discard()
+
+
+class AudioIngestSink:
+    """
+    File part container that pipes a soundtrack into ffmpeg as it arrives.
+
+    ffmpeg writes at most max_seconds of AAC into a scratch workspace and
+    stops reading; the rest of the part is counted against max_bytes and
+    dropped. result() stores the AAC and removes the workspace.
+    """
+
+    def __init__(self, storage, filename, workspace, max_seconds, max_bytes=MAX_AUDIO_UPLOAD_BYTES,
+                 key_prefix="inputs", verbose=False):
+        """
+        Start ffmpeg.
+
+        Args:
+            storage: StorageBackend the AAC is stored in
+            filename: Client filename (for messages)
+            workspace: ScratchSpace owned by the sink from now on
+            max_seconds: Seconds of audio to keep
+            max_bytes: Largest part accepted
+            key_prefix: Prefix for the stored key
+            verbose: Print progress information
+        """
+        self.filename = filename
+        self.storage = storage
+        self.key_prefix = key_prefix
+        self.workspace = workspace
+        self.received = 0
+        self._ingest = None
+        self._error = None
+        try:
+            self._ingest = AudioIngest(
+                workspace.file(f"{uuid.uuid4().hex}_audio.m4a"), max_seconds, max_bytes=max_bytes, verbose=verbose
+            )
+        except RuntimeError as e:
+            # ffmpeg is missing; reported by result() so the form still parses
+            self._error = e
+
+    def write(self, chunk):
+        self.received += len(chunk)
+        if self._ingest is not None:
+            self._ingest.write(chunk)
+        return len(chunk)
+
+    def seek(self, offset, whence=0):
+        return 0
+
+    def tell(self):
+        return self.received
+
+    def result(self):
+        """
+        Wait for ffmpeg and store the AAC (call once the form is parsed).
+
+        Returns:
+            URL and key of the stored AAC
+
+        Raises:
+            AudioUploadTooLarge: If the part exceeded max_bytes
+            ValueError: If ffmpeg could not decode the part
+            RuntimeError: If ffmpeg is not installed
+        """
+        try:
+            if self._error is not None:
+                raise self._error
+            ingest, self._ingest = self._ingest, None
+            try:
+                audio_path = ingest.finish()
+            except BaseException:
+                ingest.abort()
+                raise
+            return self.storage.upload_file(audio_path, key_prefix=self.key_prefix)
+        finally:
+            self.workspace.cleanup()
+
+    def discard(self):
+        """Stop ffmpeg (if result() was never called) and remove the workspace."""
+        if self._ingest is not None:
+            self._ingest.abort()
+            self._ingest = None
+        self.workspace.cleanup()
+
+    def close(self):
+        self.discard()
+
+
+class DiscardSink:
+    """File part container for parts the view rejects: the bytes are counted and dropped."""
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.received = 0
+
+    def write(self, chunk):
+        self.received += len(chunk)
+        return len(chunk)
+
+    def seek(self, offset, whence=0):
+        return 0
+
+    def tell(self):
+        return self.received
+
+    def result(self):
+        raise ValueError(f"Upload {self.filename!r} is not an accepted file type")
+
+    def discard(self):
+        pass
+
+    def close(self):
+        pass
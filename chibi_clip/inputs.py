@@ -0,0 +1,418 @@
+"""
+Input fetching for worker tasks.
+
+A task's inputs (the photo and an optional soundtrack) are downloaded
+concurrently. Each download checks size and content type as it goes, and the
+photo is normalised to an RGBA PNG as soon as it arrives, while the soundtrack
+may still be downloading.
+
+S3 URLs are fetched through the worker's shared transfer manager. With the
+shared volume backend, inputs are read in place from the volume (no copy);
+with the memory backend they are copied out of the process's store. Other
+URLs are streamed over HTTP.
+
+S3 inputs go through a node-local DiskLRUCache keyed by the object's content
+identity (the sha256 metadata when the uploader set it, otherwise its ETag),
+so retried tasks and repeated uploads of the same file skip the download.
+Assets shipped with the image (the default birthday song, slate backdrops)
+are referenced as bundled://<name> and never touch the network; S3 objects
+whose ETag matches a bundled asset are served from the image as well.
+"""
+
+import os
+import time
+import hashlib
+import requests
+from functools import lru_cache
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+from PIL import Image, ImageFile
+
+from .storage import resolve_s3_url, get_s3_client
+from .audio import MAX_AUDIO_UPLOAD_BYTES
+from .cache import DiskLRUCache, DEFAULT_CACHE_ROOT
+from .slate import ASSETS_DIR
+
+# Largest photo a task will download (CHIBICLIP_MAX_PHOTO_MB)
+MAX_PHOTO_BYTES = int(os.getenv("CHIBICLIP_MAX_PHOTO_MB", "25")) * 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+PHOTO_DOWNLOAD_TIMEOUT = 60
+AUDIO_DOWNLOAD_TIMEOUT = 30
+# HTTP Content-Types accepted for soundtracks besides audio/* (e.g. M4A served as video/mp4)
+AUDIO_CONTENT_TYPES = ("audio/", "video/mp4", "application/octet-stream", "binary/octet-stream")
+# Size budget of the node-local S3 input cache (CHIBICLIP_INPUT_CACHE_MB, 0 disables it)
+INPUT_CACHE_MB = int(os.getenv("CHIBICLIP_INPUT_CACHE_MB", "512"))
+
+BUNDLED_SCHEME = "bundled"
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Files shipped with the image that requests may reference instead of uploading
+BUNDLED_ASSETS = {
+    "birthday_song.mp3": os.path.join(PROJECT_ROOT, "birthday_song.mp3"),
+    "birthday_card_backdrop.png": os.path.join(ASSETS_DIR, "birthday_card_backdrop.png"),
+    "birthday_card_backdrop_v2.png": os.path.join(ASSETS_DIR, "birthday_card_backdrop_v2.png"),
+}
+
+
+class InputTooLarge(ValueError):
+    """Raised when a downloaded input exceeds its size limit."""
+
+
+def bundled_asset_url(name):
+    """
+    URL that refers a task to a file shipped with the image.
+
+    Raises:
+        ValueError: If name is not a bundled asset
+    """
+    if name not in BUNDLED_ASSETS:
+        raise ValueError(f"Unknown bundled asset '{name}'. Available: {', '.join(BUNDLED_ASSETS)}")
+    return f"{BUNDLED_SCHEME}://{name}"
+
+
+def bundled_asset_path(url):
+    """Local path of a bundled:// URL's asset, or None for other URLs and missing assets."""
+    parsed = urlparse(url)
+    if parsed.scheme != BUNDLED_SCHEME:
+        return None
+    path = BUNDLED_ASSETS.get(parsed.netloc)
+    return path if path and os.path.exists(path) else None
+
+
+@lru_cache(maxsize=1)
+def _bundled_etags():
+    """Map the S3 ETag (MD5 of a single-part upload) of each bundled asset to its path."""
+    etags = {}
+    for path in BUNDLED_ASSETS.values():
+        if os.path.exists(path):
+            digest = hashlib.md5()
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(chunk)
+            etags[digest.hexdigest()] = path
+    return etags
+
+
+_input_cache = None
+
+
+def get_input_cache(verbose=False):
+    """Return the node-local cache of downloaded S3 inputs, or None if disabled."""
+    global _input_cache
+    if INPUT_CACHE_MB <= 0:
+        return None
+    if _input_cache is None:
+        _input_cache = DiskLRUCache(
+            os.path.join(DEFAULT_CACHE_ROOT, "inputs"), max_bytes=INPUT_CACHE_MB * 1024 * 1024, verbose=verbose
+        )
+    return _input_cache
+
+
+def local_filename(url, default_stem, default_ext):
+    """
+    Derive a local file name for a downloaded input from its URL.
+
+    Args:
+        url: Input URL
+        default_stem: Stem used when the URL has no file name
+        default_ext: Extension used when neither file name nor URL has one
+
+    Returns:
+        File name with an extension
+    """
+    parsed_url = urlparse(url)
+    filename = os.path.basename(parsed_url.path)
+    if not filename:  # Handle cases like "bucket/" or if path is just "/"
+        filename = f"{default_stem}_{int(time.time())}"
+    _, ext = os.path.splitext(filename)
+    if not ext:
+        _, url_ext = os.path.splitext(parsed_url.path)
+        filename += url_ext if url_ext and len(url_ext) <= 5 else default_ext
+    return filename
+
+
+def sniff_media_type(path):
+    """
+    Guess a file's media type from its first bytes.
+
+    Returns:
+        "image/...", "audio/...", "text" for XML/HTML/JSON documents, or None if unknown
+    """
+    with open(path, "rb") as f:
+        head = f.read(16)
+    if head.startswith(b"\x89PNG"):
+        return "image/png"
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith((b"GIF87a", b"GIF89a")):
+        return "image/gif"
+    if head.startswith(b"RIFF") and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head.startswith(b"RIFF") and head[8:12] == b"WAVE":
+        return "audio/wav"
+    if head.startswith(b"ID3") or head[:2] in (b"\xff\xfb", b"\xff\xf3", b"\xff\xf2"):
+        return "audio/mpeg"
+    if head.startswith(b"OggS"):
+        return "audio/ogg"
+    if head[4:8] == b"ftyp":
+        brand = head[8:12]
+        if brand.startswith((b"heic", b"heix", b"mif1", b"avif")):
+            return f"image/{brand.decode(errors='replace').strip()}"
+        return "audio/mp4"
+    if head.lstrip().startswith((b"<", b"{")):
+        return "text"
+    return None
+
+
+def check_download(path, kind, max_bytes):
+    """
+    Verify a downloaded input's size and content type.
+
+    Unknown types are let through; the photo is validated again by the generator.
+
+    Args:
+        path: Downloaded file
+        kind: "image" or "audio"
+        max_bytes: Size limit
+
+    Raises:
+        InputTooLarge: If the file exceeds max_bytes
+        ValueError: If the file is empty, a text document, or the wrong kind of media
+    """
+    size = os.path.getsize(path)
+    if size == 0:
+        raise ValueError(f"Downloaded {kind} is empty: {path}")
+    if size > max_bytes:
+        raise InputTooLarge(f"Downloaded {kind} is {size} bytes, over the {max_bytes} byte limit")
+    media_type = sniff_media_type(path)
+    if media_type == "text":
+        raise ValueError(f"Downloaded {kind} looks like an XML/HTML/JSON document (e.g. an error page): {path}")
+    if media_type and not media_type.startswith(f"{kind}/"):
+        raise ValueError(f"Downloaded {kind} is {media_type}: {path}")
+
+
+def s3_credentials_configured():
+    """Whether the worker environment has AWS credentials and a region."""
+    return all(os.getenv(name) for name in ("AWS_REGION", "AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY"))
+
+
+def download_http(url, dest_path, kind, max_bytes, timeout):
+    """
+    Stream an input over HTTP, checking Content-Type and size while downloading.
+
+    Raises:
+        ValueError: If the response is not the expected kind of media
+        InputTooLarge: If the body exceeds max_bytes
+        requests.exceptions.RequestException: On network errors
+    """
+    response = requests.get(url, stream=True, timeout=timeout)
+    response.raise_for_status()
+    content_type = response.headers.get("Content-Type", "")
+    print(f"Direct {kind} download: Status {response.status_code}, Content-Type='{content_type}', Final URL='{response.url}'")
+
+    accepted = ("image/",) if kind == "image" else AUDIO_CONTENT_TYPES
+    if not content_type.startswith(accepted):
+        preview_text = "(binary content)"
+        try:
+            if "text" in content_type or "xml" in content_type or "json" in content_type:
+                preview_text = response.text[:200]
+        except Exception:
+            preview_text = "(could not read preview)"
+        raise ValueError(f"Invalid Content-Type '{content_type}' from {kind} URL {response.url}. Preview: {preview_text}")
+
+    declared = int(response.headers.get("Content-Length") or 0)
+    if declared > max_bytes:
+        raise InputTooLarge(f"{kind} at {url} is {declared} bytes, over the {max_bytes} byte limit")
+    received = 0
+    with open(dest_path, "wb") as f:
+        for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+            received += len(chunk)
+            if received > max_bytes:
+                raise InputTooLarge(f"{kind} at {url} exceeds the {max_bytes} byte limit")
+            f.write(chunk)
+    return dest_path
+
+
+def fetch_s3_input(url, dest_path, kind, max_bytes, s3_transfer):
+    """
+    Fetch an S3 input, through the input cache when it is enabled.
+
+    A HEAD request identifies the object's content (sha256 metadata or ETag)
+    and size before anything is downloaded.
+
+    Returns:
+        Local path of the input: a bundled asset, a cache entry or dest_path
+    """
+    bucket, key = resolve_s3_url(url)
+    try:
+        head = get_s3_client().head_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        print(f"S3 {kind} lookup error for {url} (Key: s3://{bucket}/{key}): {e}")
+        raise
+    if head.get("ContentLength", 0) > max_bytes:
+        raise InputTooLarge(f"{kind} s3://{bucket}/{key} is {head['ContentLength']} bytes, over the {max_bytes} byte limit")
+
+    etag = head.get("ETag", "").strip('"')
+    bundled_path = _bundled_etags().get(etag)
+    if bundled_path:
+        print(f"s3://{bucket}/{key} is the bundled asset {os.path.basename(bundled_path)}, skipping download")
+        return bundled_path
+
+    cache = get_input_cache()
+    sha256 = head.get("Metadata", {}).get("sha256")
+    cache_key = DiskLRUCache.make_key("input", "sha256", sha256) if sha256 else DiskLRUCache.make_key("input", "etag", etag)
+    suffix = os.path.splitext(key)[1].lower()
+    if cache is not None and (sha256 or etag):
+        cached_path = cache.get(cache_key, suffix)
+        if cached_path:
+            print(f"Input cache hit for s3://{bucket}/{key}: {cached_path}")
+            return cached_path
+
+    print(f"Downloading s3://{bucket}/{key} to {dest_path}")
+    try:
+        s3_transfer.download_file(bucket, key, dest_path)
+    except ClientError as e:
+        print(f"S3 {kind} download error for {url} (Key: s3://{bucket}/{key}): {e}")
+        raise
+    check_download(dest_path, kind, max_bytes)
+    if cache is not None and (sha256 or etag):
+        cache.put(cache_key, dest_path, suffix)
+    return dest_path
+
+
+def fetch_storage_input(url, dest_path, kind, max_bytes, storage):
+    """
+    Fetch an input held by a local storage backend (shared volume or memory).
+
+    Returns:
+        Local path of the input (in place on the shared volume), or None if the
+        URL does not belong to the storage
+    """
+    path = storage.local_path(url)
+    if path:
+        print(f"Using {kind} {path} from {storage.name} storage in place")
+        check_download(path, kind, max_bytes)
+        return path
+    key = storage.key_for_url(url)
+    if not key:
+        return None
+    if not storage.download_file(key, dest_path):
+        raise ValueError(f"{kind.capitalize()} {url} not found in {storage.name} storage")
+    check_download(dest_path, kind, max_bytes)
+    return dest_path
+
+
+def fetch_input(url, dest_dir, kind, default_stem, default_ext, max_bytes, timeout,
+                use_s3=False, s3_transfer=None, storage=None):
+    """
+    Download one input into dest_dir and verify it.
+
+    Bundled assets and cached S3 inputs are returned in place, so the returned
+    path may lie outside dest_dir and must be treated as read-only.
+
+    Args:
+        url: S3 or HTTP URL
+        dest_dir: Directory for the download
+        kind: "image" or "audio"
+        default_stem: File name stem when the URL has none
+        default_ext: Extension when the URL has none
+        max_bytes: Size limit
+        timeout: HTTP timeout in seconds
+        use_s3: Treat the URL as an S3 object
+        s3_transfer: Shared S3Transfer for S3 downloads
+        storage: Storage backend the web tier stored the input with
+
+    Returns:
+        Local path of the verified input
+    """
+    bundled_path = bundled_asset_path(url)
+    if bundled_path:
+        print(f"Using bundled {kind} {bundled_path} for {url}")
+        return bundled_path
+
+    dest_path = os.path.join(dest_dir, local_filename(url, default_stem, default_ext))
+    if storage is not None and storage.name != "s3":
+        path = fetch_storage_input(url, dest_path, kind, max_bytes, storage)
+        if path:
+            return path
+    if use_s3:
+        if not s3_credentials_configured():
+            raise ValueError(f"Worker S3 {kind} download: AWS credentials/region not configured in worker environment.")
+        path = fetch_s3_input(url, dest_path, kind, max_bytes, s3_transfer)
+        if path != dest_path:
+            return path
+    else:
+        print(f"Attempting direct HTTP download for {kind}: {url}")
+        download_http(url, dest_path, kind, max_bytes, timeout)
+        check_download(dest_path, kind, max_bytes)
+    print(f"{kind.capitalize()} download successful: {dest_path} ({os.path.getsize(dest_path)} bytes)")
+    return dest_path
+
+
+def normalize_photo(photo_path, dest_dir):
+    """
+    Convert a downloaded photo to an RGBA PNG in dest_dir (OpenAI prefers PNG).
+
+    Returns:
+        Path to the PNG, or the original path if conversion fails
+    """
+    try:
+        ImageFile.LOAD_TRUNCATED_IMAGES = True  # Allow loading truncated images
+        stem = os.path.splitext(os.path.basename(photo_path))[0]
+        png_path = os.path.join(dest_dir, f"{stem}_standardized.png")
+        with Image.open(photo_path) as img:
+            img = img.convert("RGBA") if img.mode != "RGBA" else img
+            img.save(png_path, "PNG")
+        print(f"Photo standardized to PNG: {png_path}")
+        return png_path
+    except Exception as e:
+        # The generator re-validates the original download and may still fail on it
+        print(f"Warning: Error processing/converting downloaded photo {photo_path} to PNG: {e}. Using original download.")
+        return photo_path
+
+
+def _fetch_photo(photo_url, dest_dir, use_s3, s3_transfer, storage):
+    photo_path = fetch_input(photo_url, dest_dir, "image", "downloaded_photo", ".jpg",
+                             MAX_PHOTO_BYTES, PHOTO_DOWNLOAD_TIMEOUT, use_s3, s3_transfer, storage)
+    return normalize_photo(photo_path, dest_dir)
+
+
+def fetch_inputs(photo_url, audio_url, dest_dir, use_s3=False, s3_transfer=None, storage=None):
+    """
+    Download a task's photo and soundtrack concurrently.
+
+    The photo is required; a soundtrack that cannot be fetched is logged and
+    left out, so the job proceeds without it.
+
+    Args:
+        photo_url: Photo URL
+        audio_url: Soundtrack URL, or None
+        dest_dir: Directory for the downloads
+        use_s3: Treat the URLs as S3 objects
+        s3_transfer: Shared S3Transfer for S3 downloads
+        storage: Storage backend the web tier stored the inputs with
+
+    Returns:
+        Tuple of (normalised photo path, soundtrack path or None)
+    """
+    if use_s3 and audio_url and not bundled_asset_path(audio_url) and not s3_credentials_configured():
+        print("Worker S3 audio download: AWS credentials/region not configured. Skipping S3 audio.")
+        audio_url = None
+
+    with ThreadPoolExecutor(max_workers=2, thread_name_prefix="input-fetch") as pool:
+        photo_future = pool.submit(_fetch_photo, photo_url, dest_dir, use_s3, s3_transfer, storage)
+        audio_future = None
+        if audio_url:
+            audio_future = pool.submit(
+                fetch_input, audio_url, dest_dir, "audio", "downloaded_audio", ".mp3",
+                MAX_AUDIO_UPLOAD_BYTES, AUDIO_DOWNLOAD_TIMEOUT, use_s3, s3_transfer, storage
+            )
+
+        photo_path = photo_future.result()
+        audio_path = None
+        if audio_future is not None:
+            try:
+                audio_path = audio_future.result()
+            except Exception as e:
+                print(f"Audio download failed for {audio_url}: {e}. Proceeding without this audio.")
+    return photo_path, audio_path
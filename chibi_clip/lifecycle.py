@@ -0,0 +1,199 @@
+"""
+Lifecycle cleanup for stored inputs and outputs.
+
+Every job records the object keys it creates in a Redis sorted set scored by
+expiry time: inputs (photo, soundtrack) expire after
+CHIBICLIP_S3_INPUT_RETENTION_HOURS, outputs after
+CHIBICLIP_S3_OUTPUT_RETENTION_DAYS (0 keeps them). Content-addressed inputs
+that are reused by a later job are tracked again, which pushes their expiry
+back.
+
+A periodic cleanup deletes expired keys with batched DeleteObjects requests,
+then sweeps the managed prefixes for orphans: objects older than the
+retention that no job tracks (e.g. uploads whose job was never submitted, or
+outputs of attempts that were retried).
+
+Tracked entries ending in "/" stand for every object under that prefix (an
+HLS package).
+
+Cleanup only uses the StorageBackend interface, so it works the same for S3
+and the shared volume.
+"""
+
+import os
+import time
+from datetime import datetime, timezone
+
+import redis
+
+from .storage import DELETE_BATCH_SIZE
+
+INPUT_RETENTION_SECONDS = float(os.getenv("CHIBICLIP_S3_INPUT_RETENTION_HOURS", "24")) * 3600
+OUTPUT_RETENTION_SECONDS = float(os.getenv("CHIBICLIP_S3_OUTPUT_RETENTION_DAYS", "0")) * 86400
+# How often the beat schedule runs the cleanup (CHIBICLIP_S3_CLEANUP_INTERVAL_MINUTES)
+CLEANUP_INTERVAL_SECONDS = float(os.getenv("CHIBICLIP_S3_CLEANUP_INTERVAL_MINUTES", "60")) * 60
+INPUT_PREFIXES = ("inputs/",)
+OUTPUT_PREFIXES = ("images/", "videos/", "thumbnails/", "renditions/", "hls/")
+TRACKING_SET = "chibiclip:s3:expiry"
+
+
+class ObjectTracker:
+    """Expiry times of storage keys, shared by the web tier and workers through Redis."""
+
+    def __init__(self, redis_client, set_name=TRACKING_SET):
+        """
+        Initialize the tracker.
+
+        Args:
+            redis_client: redis.Redis connection
+            set_name: Sorted set holding key -> expiry timestamp
+        """
+        self.redis = redis_client
+        self.set_name = set_name
+
+    def track(self, keys, retention_seconds):
+        """
+        Schedule keys for deletion retention_seconds from now.
+
+        A retention of 0 or less leaves the keys untracked (kept forever).
+        """
+        keys = [key for key in keys if key]
+        if not keys or retention_seconds <= 0:
+            return
+        expires_at = time.time() + retention_seconds
+        self.redis.zadd(self.set_name, {key: expires_at for key in keys})
+
+    def due(self, now=None, limit=DELETE_BATCH_SIZE * 10):
+        """Return up to limit keys whose expiry has passed."""
+        now = now or time.time()
+        return [
+            key.decode() if isinstance(key, bytes) else key
+            for key in self.redis.zrangebyscore(self.set_name, 0, now, start=0, num=limit)
+        ]
+
+    def forget(self, keys):
+        """Stop tracking keys."""
+        keys = list(keys)
+        for start in range(0, len(keys), DELETE_BATCH_SIZE):
+            self.redis.zrem(self.set_name, *keys[start:start + DELETE_BATCH_SIZE])
+
+    def is_tracked(self, key):
+        """Whether key is tracked (and so will be deleted by the expiry pass, not the sweeper)."""
+        return self.redis.zscore(self.set_name, key) is not None
+
+    def tracked(self, keys):
+        """
+        Return the subset of keys that is tracked, with one round trip per batch.
+
+        Returns:
+            Set of tracked keys
+        """
+        keys = list(dict.fromkeys(keys))
+        tracked = set()
+        for start in range(0, len(keys), DELETE_BATCH_SIZE):
+            batch = keys[start:start + DELETE_BATCH_SIZE]
+            pipe = self.redis.pipeline(transaction=False)
+            for key in batch:
+                pipe.zscore(self.set_name, key)
+            tracked.update(key for key, score in zip(batch, pipe.execute()) if score is not None)
+        return tracked
+
+
+_default_tracker = None
+
+
+def get_object_tracker():
+    """Return the process-wide ObjectTracker on REDIS_URL."""
+    global _default_tracker
+    if _default_tracker is None:
+        redis_url = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+        _default_tracker = ObjectTracker(redis.Redis.from_url(redis_url))
+    return _default_tracker
+
+
+def delete_expired(storage, tracker, verbose=False):
+    """
+    Delete every tracked key whose retention has passed.
+
+    Returns:
+        Number of objects deleted
+    """
+    total = 0
+    while True:
+        due = tracker.due()
+        if not due:
+            return total
+        keys = []
+        for key in due:
+            if key.endswith("/"):
+                keys.extend(object_key for object_key, _ in storage.iter_objects(key))
+            else:
+                keys.append(key)
+        deleted = storage.delete_many(keys)
+        total += len(deleted)
+        # Entries are forgotten even if some deletes failed; the sweeper retries those objects
+        tracker.forget(due)
+        if verbose:
+            print(f"Lifecycle: deleted {len(deleted)} of {len(keys)} expired objects")
+
+
+def _package_key(key):
+    """Tracked entry of the HLS package holding key (hls/<id>/...)."""
+    return "/".join(key.split("/")[:2]) + "/"
+
+
+def _delete_untracked(storage, tracker, prefix, keys):
+    """Delete the keys no job tracks; returns the number deleted."""
+    lookup = list(keys)
+    if prefix == "hls/":
+        # Objects inside a tracked HLS package are covered by the package entry
+        lookup.extend(_package_key(key) for key in keys)
+    tracked = tracker.tracked(lookup)
+    orphans = [
+        key for key in keys
+        if key not in tracked and not (prefix == "hls/" and _package_key(key) in tracked)
+    ]
+    return len(storage.delete_many(orphans)) if orphans else 0
+
+
+def sweep_orphans(storage, tracker, prefixes, retention_seconds, verbose=False):
+    """
+    Delete untracked objects under prefixes that are older than the retention.
+
+    Returns:
+        Number of objects deleted
+    """
+    if retention_seconds <= 0:
+        return 0
+    cutoff = datetime.now(timezone.utc).timestamp() - retention_seconds
+    total = 0
+    for prefix in prefixes:
+        # Old objects are checked against the tracker a listing page at a time
+        candidates = []
+        for key, last_modified in storage.iter_objects(prefix):
+            if last_modified.timestamp() >= cutoff:
+                continue
+            candidates.append(key)
+            if len(candidates) >= DELETE_BATCH_SIZE:
+                total += _delete_untracked(storage, tracker, prefix, candidates)
+                candidates = []
+        if candidates:
+            total += _delete_untracked(storage, tracker, prefix, candidates)
+    if verbose and total:
+        print(f"Lifecycle: swept {total} orphaned objects under {', '.join(prefixes)}")
+    return total
+
+
+def run_cleanup(storage, tracker=None, verbose=False):
+    """
+    Run one cleanup pass: expired keys first, then the orphan sweep.
+
+    Returns:
+        Dict with the number of objects deleted by each step
+    """
+    tracker = tracker or get_object_tracker()
+    return {
+        "expired": delete_expired(storage, tracker, verbose=verbose),
+        "orphaned_inputs": sweep_orphans(storage, tracker, INPUT_PREFIXES, INPUT_RETENTION_SECONDS, verbose),
+        "orphaned_outputs": sweep_orphans(storage, tracker, OUTPUT_PREFIXES, OUTPUT_RETENTION_SECONDS, verbose),
+    }
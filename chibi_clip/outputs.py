@@ -0,0 +1,285 @@
+"""
+Output directory lifecycle.
+
+Every job writes its artifacts (edited image, final video, poster and
+sprite, renditions, HLS package) into its own namespace, Output/jobs/<job_id>/,
+so two jobs finishing in the same second can never overwrite each other.
+
+A small SQLite index maps each job to its artifacts and their total size.
+Lookups and eviction read the index; neither walks the output directory.
+Eviction runs on a background thread in every process that writes or serves
+outputs:
+
+    age      CHIBICLIP_OUTPUT_RETENTION_HOURS   jobs finished longer ago than
+                                                this are removed
+    quota    CHIBICLIP_OUTPUT_QUOTA_MB          finished jobs are removed, oldest
+                                                first, until the rest fit
+
+Jobs still being written are never evicted. A job that never finished (its
+process died) is removed once it is CHIBICLIP_OUTPUT_STALE_JOB_HOURS past
+the retention.
+
+The index lists every job, so it is kept outside the output root, which the
+server exposes over HTTP: by default in .output-index/ next to it, or at
+CHIBICLIP_OUTPUT_INDEX_PATH. Web and worker processes sharing outputs must
+share the index as well (docker-compose mounts a volume for it).
+"""
+
+import os
+import json
+import time
+import shutil
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# Age after which a job's outputs are removed (CHIBICLIP_OUTPUT_RETENTION_HOURS, 0 keeps them)
+OUTPUT_RETENTION_SECONDS = float(os.getenv("CHIBICLIP_OUTPUT_RETENTION_HOURS", "24")) * 3600
+# Total size of finished jobs kept on disk (CHIBICLIP_OUTPUT_QUOTA_MB, 0 disables the quota)
+OUTPUT_QUOTA_BYTES = int(os.getenv("CHIBICLIP_OUTPUT_QUOTA_MB", "4096")) * 1024 * 1024
+# How often the background thread evicts (CHIBICLIP_OUTPUT_EVICT_INTERVAL_SECONDS)
+EVICT_INTERVAL_SECONDS = int(os.getenv("CHIBICLIP_OUTPUT_EVICT_INTERVAL_SECONDS", "300"))
+# Grace beyond the retention before an unfinished job counts as abandoned (CHIBICLIP_OUTPUT_STALE_JOB_HOURS)
+STALE_JOB_SECONDS = float(os.getenv("CHIBICLIP_OUTPUT_STALE_JOB_HOURS", "6")) * 3600
+# Location of the artifact index (CHIBICLIP_OUTPUT_INDEX_PATH); must not be under the output root
+OUTPUT_INDEX_PATH = os.getenv("CHIBICLIP_OUTPUT_INDEX_PATH")
+JOBS_DIR_NAME = "jobs"
+INDEX_DIR_NAME = ".output-index"
+INDEX_NAME = "index.sqlite"
+# Flat-layout leftovers (pre-namespace request temp dirs) are removed by age as well
+LEGACY_TEMP_PREFIX = "temp_"
+
+
+def _path_size(path):
+    """Size in bytes of a file, or of the files below a directory."""
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, filename))
+            except OSError:
+                pass
+    return total
+
+
+class OutputManager:
+    """Per-job output namespaces with an artifact index and age/quota eviction."""
+
+    def __init__(self, output_dir, retention_seconds=OUTPUT_RETENTION_SECONDS,
+                 quota_bytes=OUTPUT_QUOTA_BYTES, index_path=OUTPUT_INDEX_PATH,
+                 stale_seconds=STALE_JOB_SECONDS, verbose=False):
+        """
+        Initialize the manager.
+
+        Args:
+            output_dir: Output root (namespaces go to <output_dir>/jobs)
+            retention_seconds: Time after finishing when jobs are removed (0 keeps them)
+            quota_bytes: Total bytes of finished jobs to keep (0 for no quota)
+            index_path: SQLite index file (default: .output-index/ next to output_dir)
+            stale_seconds: Grace beyond the retention before unfinished jobs are removed
+            verbose: Print eviction decisions
+
+        Raises:
+            ValueError: If index_path is inside output_dir, where it would be served
+        """
+        self.output_dir = os.path.abspath(output_dir)
+        self.jobs_dir = os.path.join(self.output_dir, JOBS_DIR_NAME)
+        os.makedirs(self.jobs_dir, exist_ok=True)
+        self.index_path = os.path.abspath(index_path or os.path.join(
+            os.path.dirname(self.output_dir), INDEX_DIR_NAME, INDEX_NAME
+        ))
+        if os.path.commonpath([self.index_path, self.output_dir]) == self.output_dir:
+            raise ValueError(f"Output index {self.index_path} must not be inside {self.output_dir}")
+        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+        self.retention_seconds = retention_seconds
+        self.quota_bytes = quota_bytes
+        self.stale_seconds = stale_seconds
+        self.verbose = verbose
+        self._evictor = None
+        self._evictor_lock = threading.Lock()
+        with self._connect() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " job_id TEXT PRIMARY KEY,"
+                " created_at REAL NOT NULL,"
+                " finished_at REAL,"
+                " bytes INTEGER NOT NULL DEFAULT 0,"
+                " artifacts TEXT NOT NULL DEFAULT '{}')"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS jobs_created ON jobs (created_at)")
+            db.execute("CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished_at)")
+
+    @contextmanager
+    def _connect(self):
+        # A connection per call: sqlite3 connections cannot be shared across threads,
+        # and the index is small enough that opening it is cheap
+        db = sqlite3.connect(self.index_path, timeout=30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def _job_path(self, job_id):
+        job_id = str(job_id)
+        if not job_id or os.sep in job_id or job_id.startswith("."):
+            raise ValueError(f"Invalid job id: {job_id!r}")
+        return os.path.join(self.jobs_dir, job_id)
+
+    def job_dir(self, job_id):
+        """
+        Create (or reuse, for a retried job) the namespace of a job.
+
+        Returns:
+            Path of the job's directory
+        """
+        path = self._job_path(job_id)
+        os.makedirs(path, exist_ok=True)
+        with self._connect() as db:
+            db.execute(
+                # A retried job is in progress again until it records its artifacts
+                "INSERT INTO jobs (job_id, created_at) VALUES (?, ?) "
+                "ON CONFLICT (job_id) DO UPDATE SET finished_at = NULL",
+                (str(job_id), time.time())
+            )
+        return path
+
+    def record(self, job_id, artifacts):
+        """
+        Mark a job finished and index its artifacts.
+
+        Args:
+            job_id: Job whose namespace holds the artifacts
+            artifacts: Dict of artifact name to path (files or directories); paths
+                outside the namespace are indexed but not counted or evicted
+        """
+        job_path = self._job_path(job_id)
+        relative = {}
+        for name, path in artifacts.items():
+            if path:
+                relative[name] = os.path.relpath(os.path.abspath(path), self.output_dir).replace(os.sep, "/")
+        size = _path_size(job_path)
+        with self._connect() as db:
+            db.execute(
+                "INSERT INTO jobs (job_id, created_at, finished_at, bytes, artifacts) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (job_id) DO UPDATE SET finished_at = excluded.finished_at,"
+                " bytes = excluded.bytes, artifacts = excluded.artifacts",
+                (str(job_id), time.time(), time.time(), size, json.dumps(relative))
+            )
+
+    def artifacts(self, job_id):
+        """
+        Look up a job's artifacts in the index.
+
+        Returns:
+            Dict of artifact name to path relative to the output root, or None if
+            the job is unknown or has not finished
+        """
+        with self._connect() as db:
+            row = db.execute(
+                "SELECT artifacts, finished_at FROM jobs WHERE job_id = ?", (str(job_id),)
+            ).fetchone()
+        if row is None or row[1] is None:
+            return None
+        return json.loads(row[0])
+
+    def total_bytes(self):
+        """Bytes held by finished jobs, according to the index."""
+        with self._connect() as db:
+            return db.execute("SELECT COALESCE(SUM(bytes), 0) FROM jobs").fetchone()[0]
+
+    def _remove(self, job_ids):
+        for job_id in job_ids:
+            shutil.rmtree(self._job_path(job_id), ignore_errors=True)
+        with self._connect() as db:
+            db.executemany("DELETE FROM jobs WHERE job_id = ?", [(job_id,) for job_id in job_ids])
+
+    def evict(self, now=None):
+        """
+        Remove jobs past the retention, then the oldest finished jobs over the quota.
+
+        Retention counts from when a job finished; jobs still in progress are
+        kept until they are stale_seconds past the retention.
+
+        Returns:
+            Number of jobs removed
+        """
+        now = now or time.time()
+        removed = 0
+        if self.retention_seconds > 0:
+            with self._connect() as db:
+                expired = [row[0] for row in db.execute(
+                    "SELECT job_id FROM jobs WHERE finished_at < ?"
+                    " OR (finished_at IS NULL AND created_at < ?)",
+                    (now - self.retention_seconds, now - self.retention_seconds - self.stale_seconds)
+                )]
+            self._remove(expired)
+            removed += len(expired)
+            removed += self._sweep_legacy(now)
+        total = self.total_bytes() if self.quota_bytes > 0 else 0
+        if total > self.quota_bytes > 0:
+            with self._connect() as db:
+                finished = db.execute(
+                    "SELECT job_id, bytes FROM jobs WHERE finished_at IS NOT NULL ORDER BY finished_at"
+                ).fetchall()
+            over_quota = []
+            for job_id, size in finished:
+                if total <= self.quota_bytes:
+                    break
+                over_quota.append(job_id)
+                total -= size
+            self._remove(over_quota)
+            removed += len(over_quota)
+        if self.verbose and removed:
+            print(f"Outputs: evicted {removed} job(s) from {self.jobs_dir}")
+        return removed
+
+    def _sweep_legacy(self, now):
+        """Remove request temp dirs of the flat layout that are past the retention."""
+        removed = 0
+        for entry in os.scandir(self.output_dir):
+            if not (entry.name.startswith(LEGACY_TEMP_PREFIX) and entry.is_dir()):
+                continue
+            try:
+                if entry.stat().st_mtime < now - self.retention_seconds:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                    removed += 1
+            except OSError:
+                pass
+        return removed
+
+    def start_eviction(self, interval_seconds=EVICT_INTERVAL_SECONDS):
+        """Start the background eviction thread of this process (once)."""
+        with self._evictor_lock:
+            if self._evictor is not None and self._evictor[0] == os.getpid() and self._evictor[1].is_alive():
+                return
+            thread = threading.Thread(
+                target=self._eviction_loop, args=(interval_seconds,), name="output-evictor", daemon=True
+            )
+            self._evictor = (os.getpid(), thread)
+            thread.start()
+
+    def _eviction_loop(self, interval_seconds):
+        while True:
+            try:
+                self.evict()
+            except Exception as e:
+                print(f"Warning: Output eviction failed: {e}")
+            time.sleep(interval_seconds)
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_output_manager(output_dir, verbose=False):
+    """Return the process-wide OutputManager for an output root."""
+    output_dir = os.path.abspath(output_dir)
+    with _managers_lock:
+        manager = _managers.get(output_dir)
+        if manager is None:
+            manager = OutputManager(output_dir, verbose=verbose)
+            _managers[output_dir] = manager
+    return manager
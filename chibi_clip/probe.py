@@ -0,0 +1,172 @@
+"""
+Media metadata probing.
+
+Runs a single ffprobe per input and returns an immutable MediaInfo record.
+Results are memoised per (path, size, mtime) so repeated composition decisions
+about the same file never spawn ffprobe twice.
+"""
+
+import os
+import json
+import subprocess
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional
+
+
+@dataclass(frozen=True)
+class MediaInfo:
+    """Basic facts about a media file, as reported by ffprobe."""
+    path: str
+    duration: float
+    format_name: str
+    size_bytes: Optional[int] = None
+    video_codec: Optional[str] = None
+    video_profile: Optional[str] = None
+    video_level: Optional[int] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+    fps: Optional[float] = None
+    pix_fmt: Optional[str] = None
+    audio_codec: Optional[str] = None
+    audio_profile: Optional[str] = None
+    sample_rate: Optional[int] = None
+    channels: Optional[int] = None
+    audio_bitrate: Optional[int] = None
+
+    @property
+    def has_video(self):
+        return self.video_codec is not None
+
+    @property
+    def has_audio(self):
+        return self.audio_codec is not None
+
+
+def _parse_rate(rate):
+    """Parse an ffprobe rational such as '24000/1001' into a float (None if unknown)."""
+    try:
+        num, _, den = (rate or "").partition("/")
+        value = float(num) / float(den or 1)
+        return value if value > 0 else None
+    except (ValueError, ZeroDivisionError):
+        return None
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+@lru_cache(maxsize=256)
+def _probe(path, size, mtime):
+    """Run ffprobe on path. size and mtime only take part in the memo key."""
+    cmd = [
+        "ffprobe", "-v", "error",
+        "-print_format", "json",
+        "-show_format", "-show_streams",
+        path
+    ]
+    try:
+        result = subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=30)
+    except FileNotFoundError:
+        raise RuntimeError("ffprobe not found. Ensure ffmpeg is installed and in PATH.")
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"ffprobe failed for {path}: {e.stderr.decode(errors='replace').strip()}") from e
+    except subprocess.TimeoutExpired as e:
+        raise RuntimeError(f"ffprobe timed out for {path}") from e
+
+    data = json.loads(result.stdout or b"{}")
+    fmt = data.get("format", {})
+    streams = data.get("streams", [])
+    video = next((s for s in streams if s.get("codec_type") == "video"
+                  and not s.get("disposition", {}).get("attached_pic")), None)
+    audio = next((s for s in streams if s.get("codec_type") == "audio"), None)
+
+    duration = fmt.get("duration")
+    if duration is None:
+        duration = (video or audio or {}).get("duration")
+
+    fields = {
+        "path": path,
+        "duration": float(duration or 0.0),
+        "format_name": fmt.get("format_name", ""),
+        "size_bytes": _to_int(fmt.get("size")) or size,
+    }
+    if video:
+        fields.update(
+            video_codec=video.get("codec_name"),
+            video_profile=video.get("profile"),
+            video_level=_to_int(video.get("level")),
+            width=_to_int(video.get("width")),
+            height=_to_int(video.get("height")),
+            fps=_parse_rate(video.get("avg_frame_rate")) or _parse_rate(video.get("r_frame_rate")),
+            pix_fmt=video.get("pix_fmt"),
+        )
+    if audio:
+        fields.update(
+            audio_codec=audio.get("codec_name"),
+            audio_profile=audio.get("profile"),
+            sample_rate=_to_int(audio.get("sample_rate")),
+            channels=_to_int(audio.get("channels")),
+            audio_bitrate=_to_int(audio.get("bit_rate")),
+        )
+    return MediaInfo(**fields)
+
+
+def probe_media(path):
+    """
+    Probe a local file or URL.
+
+    Args:
+        path: Local path or URL understood by ffprobe
+
+    Returns:
+        MediaInfo for the input
+
+    Raises:
+        RuntimeError: If ffprobe is unavailable or cannot read the input
+    """
+    if os.path.exists(path):
+        st = os.stat(path)
+        return _probe(os.path.abspath(path), st.st_size, st.st_mtime)
+    return _probe(path, None, None)
+
+
+def keyframe_times(path):
+    """
+    Presentation times of the video keyframes of a local file.
+
+    Only keyframes are decoded, so this is cheap even for long inputs.
+
+    Returns:
+        Sorted list of keyframe times in seconds
+
+    Raises:
+        RuntimeError: If ffprobe is unavailable or cannot read the input
+    """
+    cmd = [
+        "ffprobe", "-v", "error",
+        "-select_streams", "v:0",
+        "-skip_frame", "nokey",
+        "-show_entries", "frame=best_effort_timestamp_time",
+        "-of", "csv=p=0",
+        path
+    ]
+    try:
+        result = subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=60)
+    except FileNotFoundError:
+        raise RuntimeError("ffprobe not found. Ensure ffmpeg is installed and in PATH.")
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"ffprobe failed for {path}: {e.stderr.decode(errors='replace').strip()}") from e
+    except subprocess.TimeoutExpired as e:
+        raise RuntimeError(f"ffprobe timed out for {path}") from e
+    times = []
+    for line in result.stdout.decode(errors="replace").splitlines():
+        try:
+            times.append(float(line.strip().rstrip(",")))
+        except ValueError:
+            continue
+    return sorted(times)
@@ -0,0 +1,185 @@
+"""
+Multi-rendition output.
+
+The final video is decoded once and the decoded frames are fanned out with
+ffmpeg's split filter into one scale/crop/encode branch per rendition, so
+adding a 1:1 crop, a low-bandwidth version and an animated preview costs a
+single extra decode instead of one full composition per target.
+
+The composed video itself is the "original" rendition and is never
+re-encoded.
+"""
+
+import os
+import subprocess
+from dataclasses import dataclass, field
+from typing import Optional, Tuple
+
+from .compose import mp4_output_args
+from .encoding import get_encoding_policy, keyframe_args
+from .cpu_budget import thread_args, cpu_lease
+
+# Name of the pass-through rendition (the composed video as-is)
+ORIGINAL_RENDITION = "original"
+
+
+@dataclass(frozen=True)
+class Rendition:
+    """One output branch of the split graph."""
+    name: str
+    suffix: str
+    filters: str                    # Filter chain applied to this branch's frames
+    codec_args: Tuple[str, ...] = field(default_factory=tuple)
+    audio: bool = True              # Carry the (stream-copied) soundtrack
+    max_duration: Optional[float] = None
+    ladder: bool = False            # Same framing as the original, so usable as an adaptive variant
+
+
+RENDITIONS = {
+    "square": Rendition(
+        "square", ".mp4",
+        "crop='min(iw,ih)':'min(iw,ih)'",
+        (*get_encoding_policy("delivery", max_bytes=0).video_args(), *mp4_output_args()),
+    ),
+    "480p": Rendition(
+        "480p", ".mp4",
+        # Short side 480, long side scaled to keep the aspect ratio (even for yuv420p)
+        "scale='if(gt(iw,ih),-2,480)':'if(gt(iw,ih),480,-2)'",
+        (*get_encoding_policy("low").video_args(), *mp4_output_args()),
+        ladder=True,
+    ),
+    "preview": Rendition(
+        "preview", ".webp",
+        "fps=10,scale=320:-2",
+        ("-c:v", "libwebp_anim", "-lossless", "0", "-q:v", "60", "-loop", "0"),
+        audio=False, max_duration=4,
+    ),
+    "gif": Rendition(
+        "gif", ".gif",
+        # Per-clip palette for decent colours at 256 entries
+        "fps=10,scale=320:-2:flags=lanczos,split[pa][pb];[pa]palettegen[pal];[pb][pal]paletteuse",
+        ("-loop", "0"),
+        audio=False, max_duration=4,
+    ),
+}
+
+RENDITION_NAMES = (ORIGINAL_RENDITION,) + tuple(RENDITIONS)
+# Renditions that only rescale the original; an adaptive (HLS) ladder may switch between them
+LADDER_RENDITIONS = tuple(name for name, rendition in RENDITIONS.items() if rendition.ladder)
+
+
+def parse_renditions(value):
+    """
+    Parse a comma-separated rendition list (e.g. from a form field or CLI flag).
+
+    Returns:
+        List of rendition names in request order, without duplicates
+
+    Raises:
+        ValueError: If a name is not in RENDITION_NAMES
+    """
+    if not value:
+        return []
+    items = value.split(",") if isinstance(value, str) else value
+    names = []
+    for item in items:
+        name = item.strip().lower()
+        if not name or name in names:
+            continue
+        if name not in RENDITION_NAMES:
+            raise ValueError(f"Unknown rendition '{name}'. Available: {', '.join(RENDITION_NAMES)}")
+        names.append(name)
+    return names
+
+
+def build_renditions_cmd(source_path, outputs, keyframe_interval=None):
+    """
+    Build one ffmpeg command producing every rendition from a single decode.
+
+    Args:
+        source_path: Composed video to decode
+        outputs: List of (Rendition, output_path)
+        keyframe_interval: Seconds between keyframes of ladder renditions
+            (the HLS segment length), or None for the encoder's default
+
+    Returns:
+        Argument list for subprocess
+    """
+    labels = [f"s{i}" for i in range(len(outputs))]
+    graph = [f"[0:v]split={len(outputs)}" + "".join(f"[{label}]" for label in labels)]
+    for i, (rendition, _) in enumerate(outputs):
+        chain = rendition.filters
+        if rendition.max_duration:
+            chain = f"trim=duration={rendition.max_duration},setpts=PTS-STARTPTS,{chain}"
+        # Filter chains with inner labels (e.g. the GIF palette) are scoped per branch
+        chain = chain.replace("[p", f"[r{i}p")
+        graph.append(f"[{labels[i]}]{chain}[v{i}]")
+
+    cmd = ["ffmpeg", "-y", *thread_args(), "-i", source_path, "-filter_complex", ";".join(graph)]
+    for i, (rendition, output_path) in enumerate(outputs):
+        cmd += ["-map", f"[v{i}]"]
+        if rendition.audio:
+            cmd += ["-map", "0:a?", "-c:a", "copy"]
+        else:
+            cmd += ["-an"]
+        if rendition.max_duration:
+            cmd += ["-t", str(rendition.max_duration)]
+        cmd += list(rendition.codec_args)
+        if keyframe_interval and rendition.ladder:
+            cmd += keyframe_args(keyframe_interval)
+        cmd += thread_args()
+        cmd.append(output_path)
+    return cmd
+
+
+def render_renditions(source_path, output_dir, base_name, names, keyframe_interval=None, verbose=False):
+    """
+    Produce the requested renditions of a composed video.
+
+    Args:
+        source_path: Composed video (the "original" rendition)
+        output_dir: Directory for the rendition files
+        base_name: File name stem; renditions are written as <base_name>_<name><suffix>
+        names: Rendition names (see RENDITION_NAMES)
+        keyframe_interval: Seconds between keyframes of ladder renditions, so
+            they segment on the same boundaries (pass the HLS segment length)
+        verbose: Print progress information
+
+    Returns:
+        Dict of rendition name to local path
+
+    Raises:
+        ValueError: If a rendition name is unknown
+        RuntimeError: If ffmpeg fails
+    """
+    names = parse_renditions(names)
+    results = {}
+    outputs = []
+    for name in names:
+        if name == ORIGINAL_RENDITION:
+            results[name] = source_path
+            continue
+        rendition = RENDITIONS[name]
+        outputs.append((rendition, os.path.join(output_dir, f"{base_name}_{name}{rendition.suffix}")))
+    if not outputs:
+        return results
+
+    with cpu_lease(verbose=verbose):
+        cmd = build_renditions_cmd(source_path, outputs, keyframe_interval)
+        if verbose:
+            print(f"Rendering {len(outputs)} rendition(s) in one pass: {' '.join(cmd)}")
+        try:
+            subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except FileNotFoundError:
+            raise RuntimeError("ffmpeg not found. Ensure ffmpeg is installed and in PATH.")
+        except subprocess.CalledProcessError as e:
+            stderr = e.stderr.decode(errors="replace")[-2000:] if e.stderr else ""
+            raise RuntimeError(f"FFmpeg rendition pass failed ({e.returncode}): {stderr}") from e
+
+    for rendition, output_path in outputs:
+        if not os.path.exists(output_path) or os.path.getsize(output_path) == 0:
+            raise RuntimeError(f"FFmpeg produced no {rendition.name} rendition at {output_path}")
+        results[rendition.name] = output_path
+        if verbose:
+            print(f"   {rendition.name}: {output_path}")
+    return results
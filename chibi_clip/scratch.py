@@ -0,0 +1,286 @@
+"""
+Scratch space for intermediate media.
+
+Compose jobs write several short-lived files (the looped clip, the prepared
+soundtrack, slate and animated segments, the concat list, converted images)
+that are read back once and thrown away. Keeping them on tmpfs (/dev/shm)
+takes the temp-file writes, fsyncs and read-backs off the disk.
+
+Each job gets a workspace directory. It lives on tmpfs when the node has room
+for the job's reservation and falls back to disk otherwise:
+
+    per-job budget   CHIBICLIP_SCRATCH_JOB_MB   bytes one job may keep on tmpfs;
+                                                 once a workspace is past it, new
+                                                 directories and files spill to disk
+    node budget      CHIBICLIP_SCRATCH_NODE_MB  sum of reservations held on tmpfs
+                                                 by all worker processes
+
+The budget is checked whenever a directory or file is allocated through the
+workspace (mkdtemp()/file()), so a job's tmpfs usage can only exceed it by
+the file being written when it was crossed. Writers must take their paths
+from the workspace for the check to apply; only small, bounded files (slate
+stills, prepared audio, concat lists) are written straight into workspace
+directories.
+
+Workspace directories are named <pid>-<token>-<reserved bytes>, so any worker
+can account for the others' reservations and remove workspaces left behind by
+processes that died. Workspaces are removed when their context exits, at
+interpreter exit, and by the stale sweep on the next allocation.
+"""
+
+import os
+import uuid
+import atexit
+import shutil
+import tempfile
+import threading
+
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
+
+# tmpfs mount for fast scratch (CHIBICLIP_SCRATCH_TMPFS, empty to disable)
+SCRATCH_TMPFS_ROOT = os.getenv("CHIBICLIP_SCRATCH_TMPFS", "/dev/shm")
+# Disk fallback (CHIBICLIP_SCRATCH_DISK, default: the system temp directory)
+SCRATCH_DISK_ROOT = os.getenv("CHIBICLIP_SCRATCH_DISK", tempfile.gettempdir())
+SCRATCH_DIR_NAME = "chibiclip_scratch"
+SCRATCH_JOB_BYTES = int(os.getenv("CHIBICLIP_SCRATCH_JOB_MB", "512")) * 1024 * 1024
+SCRATCH_NODE_BYTES = int(os.getenv("CHIBICLIP_SCRATCH_NODE_MB", "2048")) * 1024 * 1024
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _dir_size(path):
+    """Total size in bytes of the files below path."""
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, filename))
+            except OSError:
+                pass
+    return total
+
+
+def _parse_workspace_name(name):
+    """Return (pid, reserved_bytes) for a workspace directory name, or None."""
+    parts = name.split("-")
+    if len(parts) != 3 or not parts[0].isdigit() or not parts[2].isdigit():
+        return None
+    return int(parts[0]), int(parts[2])
+
+
+class ScratchSpace:
+    """One job's scratch workspace; use as a context manager to guarantee cleanup."""
+
+    def __init__(self, manager, path, on_tmpfs, max_bytes):
+        """
+        Initialize the workspace (see ScratchManager.workspace).
+
+        Args:
+            manager: Owning ScratchManager
+            path: Workspace directory (already created)
+            on_tmpfs: Whether the directory lives on tmpfs
+            max_bytes: Bytes the workspace may keep on tmpfs
+        """
+        self.manager = manager
+        self.path = path
+        self.on_tmpfs = on_tmpfs
+        self.max_bytes = max_bytes
+        self._spill_dir = None
+        self._lock = threading.Lock()
+
+    def usage(self):
+        """Bytes currently stored in the workspace (including spilled files)."""
+        total = _dir_size(self.path)
+        if self._spill_dir:
+            total += _dir_size(self._spill_dir)
+        return total
+
+    def _over_budget(self):
+        return self.on_tmpfs and _dir_size(self.path) >= self.max_bytes
+
+    def _spill_root(self):
+        with self._lock:
+            if self._spill_dir is None:
+                self._spill_dir = self.manager.disk_dir(os.path.basename(self.path))
+                if self.manager.verbose:
+                    print(f"Scratch: {self.path} is over its {self.max_bytes} byte budget, "
+                          f"spilling to {self._spill_dir}")
+            return self._spill_dir
+
+    def mkdtemp(self, prefix=""):
+        """
+        Create a directory for a group of intermediates.
+
+        Directories are created on tmpfs while the workspace is within its
+        budget, and on disk once it is not.
+
+        Returns:
+            Path to the new directory
+        """
+        base = self._spill_root() if self._over_budget() else self.path
+        return tempfile.mkdtemp(prefix=prefix, dir=base)
+
+    def file(self, filename, directory=None):
+        """
+        Path for a new file in the workspace or one of its directories.
+
+        While the workspace is within its budget the path is in directory
+        (default: the workspace itself). Once it is not, the path is at the
+        same relative place in the workspace's disk spill directory.
+
+        Returns:
+            Path for the file (its directory exists)
+        """
+        directory = directory or self.path
+        relative = os.path.relpath(directory, self.path)
+        if relative.startswith(os.pardir) or not self._over_budget():
+            # Directories outside the tmpfs workspace (e.g. already spilled) are not budgeted
+            return os.path.join(directory, filename)
+        spilled = os.path.normpath(os.path.join(self._spill_root(), relative))
+        os.makedirs(spilled, exist_ok=True)
+        return os.path.join(spilled, filename)
+
+    def cleanup(self):
+        """Remove the workspace and anything it spilled to disk."""
+        for path in (self.path, self._spill_dir):
+            if path:
+                shutil.rmtree(path, ignore_errors=True)
+        self.manager._forget(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.cleanup()
+        return False
+
+
+class ScratchManager:
+    """Allocates job workspaces on tmpfs within the node budget, or on disk."""
+
+    def __init__(self, tmpfs_root=SCRATCH_TMPFS_ROOT, disk_root=SCRATCH_DISK_ROOT,
+                 job_bytes=SCRATCH_JOB_BYTES, node_bytes=SCRATCH_NODE_BYTES, verbose=False):
+        """
+        Initialize the manager.
+
+        Args:
+            tmpfs_root: tmpfs mount point, or None/"" to always use disk
+            disk_root: Directory for disk workspaces
+            job_bytes: Default reservation (and tmpfs budget) per workspace
+            node_bytes: Total reservations allowed on tmpfs across the node
+            verbose: Print allocation decisions
+        """
+        self.tmpfs_dir = None
+        if tmpfs_root and os.path.isdir(tmpfs_root) and os.access(tmpfs_root, os.W_OK):
+            self.tmpfs_dir = os.path.join(tmpfs_root, SCRATCH_DIR_NAME)
+            os.makedirs(self.tmpfs_dir, exist_ok=True)
+        self.disk_dir_root = os.path.join(disk_root, SCRATCH_DIR_NAME)
+        os.makedirs(self.disk_dir_root, exist_ok=True)
+        self.job_bytes = job_bytes
+        self.node_bytes = node_bytes
+        self.verbose = verbose
+        self._lock = threading.Lock()
+        self._live = set()
+        atexit.register(self._cleanup_all)
+
+    def _sweep(self, root):
+        """Remove workspaces of dead processes below root; return live reservations in bytes."""
+        reserved = 0
+        for entry in os.scandir(root):
+            parsed = _parse_workspace_name(entry.name)
+            if parsed is None or not entry.is_dir():
+                continue
+            pid, entry_bytes = parsed
+            if pid == os.getpid() or _pid_alive(pid):
+                reserved += entry_bytes
+            else:
+                shutil.rmtree(entry.path, ignore_errors=True)
+                if self.verbose:
+                    print(f"Scratch: removed stale workspace {entry.path}")
+        return reserved
+
+    def _reserve_tmpfs(self, name, max_bytes):
+        """Create a tmpfs workspace if the node budget and free space allow, else return None."""
+        lock_path = os.path.join(self.tmpfs_dir, ".lock")
+        with open(lock_path, "a") as lock_file:
+            if FCNTL_AVAILABLE:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                reserved = self._sweep(self.tmpfs_dir)
+                stat = os.statvfs(self.tmpfs_dir)
+                free = stat.f_bavail * stat.f_frsize
+                if reserved + max_bytes > self.node_bytes or free < max_bytes:
+                    if self.verbose:
+                        print(f"Scratch: tmpfs full ({reserved} bytes reserved, {free} free), using disk")
+                    return None
+                path = os.path.join(self.tmpfs_dir, name)
+                os.makedirs(path)
+                return path
+            finally:
+                if FCNTL_AVAILABLE:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def disk_dir(self, name):
+        """Create and return a disk workspace directory called name."""
+        path = os.path.join(self.disk_dir_root, name)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def workspace(self, max_bytes=None):
+        """
+        Allocate a workspace for one job.
+
+        Args:
+            max_bytes: Reservation and tmpfs budget (defaults to the per-job budget)
+
+        Returns:
+            ScratchSpace (a context manager that removes the workspace on exit)
+        """
+        max_bytes = max_bytes or self.job_bytes
+        name = f"{os.getpid()}-{uuid.uuid4().hex[:12]}-{max_bytes}"
+        path = self._reserve_tmpfs(name, max_bytes) if self.tmpfs_dir else None
+        on_tmpfs = path is not None
+        if not on_tmpfs:
+            self._sweep(self.disk_dir_root)
+            path = self.disk_dir(name)
+        space = ScratchSpace(self, path, on_tmpfs, max_bytes)
+        with self._lock:
+            self._live.add(space)
+        if self.verbose:
+            print(f"Scratch: workspace {path} ({'tmpfs' if on_tmpfs else 'disk'})")
+        return space
+
+    def _forget(self, space):
+        with self._lock:
+            self._live.discard(space)
+
+    def _cleanup_all(self):
+        with self._lock:
+            live = list(self._live)
+        for space in live:
+            space.cleanup()
+
+
+_default_manager = None
+_default_manager_lock = threading.Lock()
+
+
+def get_scratch_manager(verbose=False):
+    """Return the process-wide ScratchManager."""
+    global _default_manager
+    with _default_manager_lock:
+        if _default_manager is None:
+            _default_manager = ScratchManager(verbose=verbose)
+    return _default_manager
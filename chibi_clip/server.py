@@ -1,11 +1,13 @@
-from flask import Flask, request, jsonify, abort, send_from_directory, render_template
+from flask import Flask, Request, request, jsonify, abort, send_from_directory, render_template
 import os
+import re
 import uuid
 import tempfile # For secure temporary file creation
 from werkzeug.utils import secure_filename # For secure filenames
 
 # Note: This server has been modified to support distributed deployment with Render.com
-# It uploads files to S3 and passes S3 URLs between web and worker services.
+# It stores inputs in the configured storage backend (S3, or a volume shared with
+# the workers) and passes storage URLs between web and worker services.
 
 # Import Celery tasks
 try:
@@ -23,15 +25,53 @@ except ImportError:
         print("ERROR: Failed to import process_clip task")
         raise
 
-# Import S3 storage
+# Import storage backends
 try:
-    from .storage import S3Storage
+    from .backends import get_storage, SHARED_STORAGE_DIR
 except ImportError:
-    try:
-        from storage import S3Storage
-    except ImportError:
-        print("Warning: S3Storage not available. S3 functionality will be disabled.")
-        S3Storage = None
+    from backends import get_storage, SHARED_STORAGE_DIR
+
+# File parts of /generate are streamed to their destination while the body is parsed
+try:
+    from .ingest import StorageUploadSink, AudioIngestSink, DiscardSink, UploadTooLarge
+except ImportError:
+    from ingest import StorageUploadSink, AudioIngestSink, DiscardSink, UploadTooLarge
+
+# Import upload-time audio ingest
+try:
+    from .audio import ingest_audio_upload, AudioUploadTooLarge, MAX_AUDIO_UPLOAD_BYTES
+except ImportError:
+    from audio import ingest_audio_upload, AudioUploadTooLarge, MAX_AUDIO_UPLOAD_BYTES
+
+# Bundled assets are referenced by workers from their own image instead of being uploaded
+try:
+    from .inputs import bundled_asset_url, MAX_PHOTO_BYTES
+except ImportError:
+    from inputs import bundled_asset_url, MAX_PHOTO_BYTES
+
+# Ingested soundtracks only touch a scratch workspace before they are stored
+try:
+    from .scratch import get_scratch_manager
+except ImportError:
+    from scratch import get_scratch_manager
+
+# Uploaded inputs are scheduled for lifecycle cleanup
+try:
+    from .lifecycle import get_object_tracker, INPUT_RETENTION_SECONDS
+except ImportError:
+    from lifecycle import get_object_tracker, INPUT_RETENTION_SECONDS
+
+# HLS packages are indexed by directory; clients need the master playlist
+try:
+    from .hls import HLS_MASTER_PLAYLIST
+except ImportError:
+    from hls import HLS_MASTER_PLAYLIST
+
+# Import rendition names for request validation
+try:
+    from .renditions import parse_renditions
+except ImportError:
+    from renditions import parse_renditions
 
 # Assuming chibi_clip.py is in the same directory or package
 try:
@@ -63,6 +103,10 @@ except (ImportError, ModuleNotFoundError) as e:
             raise
 
 app = Flask(__name__)
+# Reject absurd request bodies before reading them (photo + soundtrack + form fields)
+app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('CHIBICLIP_MAX_UPLOAD_MB', '64')) * 1024 * 1024
+# Browser cache lifetime for served videos; generated files never change once written
+VIDEO_CACHE_MAX_AGE = int(os.getenv('CHIBICLIP_VIDEO_CACHE_MAX_AGE', '3600'))
 
 # Load .env variables for the server context as well
 try:
@@ -118,51 +162,220 @@ gen = ChibiClipGenerator(
     output_dir=OUTPUT_DIR 
 )
 
+# Remove old job outputs in the background (age and size quota, see outputs.py)
+gen.outputs.start_eviction()
+
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'} # Add more if needed
+AUDIO_EXTENSIONS = {'mp3', 'wav', 'ogg'}
+# Keys issued by /uploads for direct browser uploads (the only keys /generate accepts)
+DIRECT_UPLOAD_PREFIX = "inputs"
+DIRECT_UPLOAD_KEY_RE = re.compile(r'^inputs/[0-9a-f]{32}\.[a-z0-9]{1,5}$')
+# Scratch reserved for one ingested soundtrack (AAC of at most MAX_EXTENDED_DURATION seconds)
+AUDIO_INGEST_SCRATCH_BYTES = 32 * 1024 * 1024
+MAX_EXTENDED_DURATION = int(os.getenv('CHIBICLIP_MAX_EXTENDED_DURATION', '300'))
 
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def _output_url(route, path):
+    """Server URL of a file below the output directory (job namespaces included)."""
+    rel_path = os.path.relpath(path, OUTPUT_DIR).replace(os.sep, '/')
+    return request.url_root.rstrip('/') + f"/{route}/{rel_path}"
+
+def _send_output(filename, **kwargs):
+    """
+    send_from_directory for the output directory.
+
+    A shared storage root configured inside it (CHIBICLIP_SHARED_STORAGE_DIR)
+    is only served by /files, which checks the backend; the output routes
+    answer 404 for it.
+    """
+    path = os.path.abspath(os.path.join(OUTPUT_DIR, filename))
+    storage_root = os.path.abspath(SHARED_STORAGE_DIR)
+    if os.path.commonpath([path, storage_root]) == storage_root:
+        abort(404)
+    return send_from_directory(OUTPUT_DIR, filename, **kwargs)
+
 # Route to serve locally stored images
-@app.route('/images/<filename>')
+@app.route('/images/<path:filename>')
 def serve_image(filename):
-    return send_from_directory(OUTPUT_DIR, filename)
+    return _send_output(filename)
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
-# Determine if we should use S3 storage
-use_s3 = os.getenv('USE_S3_STORAGE', 'false').lower() == 'true'
+# Initialize the storage backend shared with the workers (CHIBICLIP_STORAGE_BACKEND)
+storage = None
+try:
+    storage = get_storage()
+    print(f"{storage.name} storage initialized successfully")
+except Exception as e:
+    print(f"Error initializing storage: {e}")
+
+@app.route("/uploads", methods=["POST"])
+def create_upload():
+    """
+    Issue a presigned S3 upload for a photo or soundtrack.
+
+    Browsers call this as soon as a file is picked and upload it straight to
+    S3 while the rest of the form is filled in, then submit /generate with
+    photo_key (and audio_key) instead of the files, so media bytes never pass
+    through the web tier.
+
+    Request (JSON or form fields): filename, kind ("image" or "audio",
+    default "image") and method ("post" or "put", default "post").
+    """
+    if storage is None or storage.name != "s3":
+        return jsonify({"error": "Direct uploads need S3 storage; send the files to /generate instead"}), 501
+
+    data = request.get_json(silent=True) or request.form
+    filename = secure_filename(data.get("filename", ""))
+    kind = data.get("kind", "image")
+    method = data.get("method", "post").lower()
+    if kind == "image":
+        allowed, max_bytes = ALLOWED_EXTENSIONS, MAX_PHOTO_BYTES
+    elif kind == "audio":
+        allowed, max_bytes = AUDIO_EXTENSIONS, MAX_AUDIO_UPLOAD_BYTES
+    else:
+        return jsonify({"error": "kind must be 'image' or 'audio'"}), 400
+    if '.' not in filename or filename.rsplit('.', 1)[1].lower() not in allowed:
+        return jsonify({"error": f"Invalid {kind} file type. Allowed: {', '.join(sorted(allowed))}"}), 400
+    if method not in ("post", "put"):
+        return jsonify({"error": "method must be 'post' or 'put'"}), 400
+
+    try:
+        upload = storage.presign_upload(filename, key_prefix=DIRECT_UPLOAD_PREFIX, max_bytes=max_bytes, method=method)
+    except Exception as e:
+        app.logger.error(f"Error presigning upload: {e}")
+        return jsonify({"error": "Could not create an upload URL"}), 500
+
+    # Uploads that no job ever references expire like other inputs
+    try:
+        get_object_tracker().track([upload["key"]], INPUT_RETENTION_SECONDS)
+    except Exception as e:
+        app.logger.warning(f"Could not record upload key for cleanup: {e}")
+    upload["max_bytes"] = max_bytes
+    return jsonify(upload), 201
+
+def _direct_upload_key(field):
+    """
+    Read a direct upload key from the form.
+
+    Returns:
+        Tuple of (key or None, error message or None)
+    """
+    key = request.form.get(field, "").strip()
+    if not key:
+        return None, None
+    if not DIRECT_UPLOAD_KEY_RE.match(key):
+        return None, f"Invalid {field}"
+    return key, None
+
+class StreamingUploadRequest(Request):
+    """
+    Request whose /generate file parts stream into storage while the body is parsed.
+
+    Werkzeug would spool each part to a temporary file (on disk above
+    500 KB) for the view to read back. Here the form parser writes photo
+    parts straight into a StorageUploadSink and soundtracks into an
+    AudioIngestSink instead, so storing and transcoding overlap receiving
+    the body and the upload itself never touches local disk. Other
+    endpoints, and /generate without storage, keep werkzeug's default.
+
+    Form fields may follow the file parts, so soundtracks are cut at
+    MAX_EXTENDED_DURATION here; workers trim them to the requested length.
+    """
 
-# Initialize S3 storage if enabled
-s3_storage = None
-if use_s3 and S3Storage:
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.endpoint != "generate_route" or storage is None:
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        name = secure_filename(filename or "")
+        ext = name.rsplit('.', 1)[1].lower() if '.' in name else ''
+        if ext in ALLOWED_EXTENSIONS:
+            sink = StorageUploadSink(storage, name, key_prefix="inputs", max_bytes=MAX_PHOTO_BYTES)
+        elif ext in AUDIO_EXTENSIONS:
+            sink = AudioIngestSink(
+                storage, name,
+                get_scratch_manager().workspace(max_bytes=AUDIO_INGEST_SCRATCH_BYTES),
+                max_seconds=MAX_EXTENDED_DURATION,
+                max_bytes=MAX_AUDIO_UPLOAD_BYTES,
+                verbose=SERVER_VERBOSE
+            )
+        else:
+            sink = DiscardSink(name)
+        self.__dict__.setdefault("upload_sinks", []).append(sink)
+        return sink
+
+app.request_class = StreamingUploadRequest
+
+@app.teardown_request
+def _discard_upload_sinks(exc):
+    """Abort streamed uploads of a request that never collected them (e.g. rejected ones)."""
+    for sink in request.__dict__.get("upload_sinks", ()):
+        try:
+            sink.discard()
+        except Exception as e:
+            app.logger.warning(f"Could not discard streamed upload: {e}")
+
+def _ingest_direct_audio(audio_key, max_seconds):
+    """
+    Trim and transcode a soundtrack the browser uploaded through /uploads.
+
+    The same limits as for soundtracks sent to /generate apply: objects over
+    MAX_AUDIO_UPLOAD_BYTES are rejected (a presigned PUT cannot enforce
+    them), and only the first max_seconds are decoded, reading the object
+    only as far as ffmpeg needs. The AAC replaces the raw upload.
+
+    Returns:
+        URL and key of the stored AAC, or None if the object does not exist
+
+    Raises:
+        AudioUploadTooLarge, ValueError, RuntimeError: See ingest_audio_upload
+    """
+    size = storage.object_size(audio_key)
+    if size is None:
+        return None
+    if size > MAX_AUDIO_UPLOAD_BYTES:
+        raise AudioUploadTooLarge(f"Audio upload exceeds the {MAX_AUDIO_UPLOAD_BYTES // (1024 * 1024)} MB limit")
+    with get_scratch_manager().workspace(max_bytes=AUDIO_INGEST_SCRATCH_BYTES) as scratch:
+        audio_path = scratch.file(f"{uuid.uuid4().hex}_audio.m4a")
+        body = storage.open_object(audio_key)
+        try:
+            ingest_audio_upload(body, audio_path, max_seconds=max_seconds, verbose=SERVER_VERBOSE)
+        finally:
+            body.close()
+        stored = storage.upload_file(audio_path, key_prefix="inputs")
     try:
-        s3_storage = S3Storage()
-        print("S3 storage initialized successfully")
+        storage.delete_file(audio_key)
     except Exception as e:
-        print(f"Error initializing S3 storage: {e}")
-        use_s3 = False
-else:
-    print("S3 storage is disabled")
+        app.logger.warning(f"Could not delete raw audio upload {audio_key}: {e}")
+    return stored
 
 @app.route("/generate", methods=["POST"])
 def generate_route(): # Renamed from generate to avoid conflict with module
     if not all([OPENAI_KEY, RUNWAY_KEY]):
         return jsonify({"error": "Server is not configured with necessary API keys."}), 500
 
-    if 'imageFile' not in request.files and 'photo' not in request.files:
-        return jsonify({"error": "No photo file part in the request"}), 400
-    
-    # Support both 'imageFile' (for new frontend) and 'photo' (for legacy)
-    file = request.files.get("imageFile") or request.files.get("photo")
-    if file.filename == '' :
-        return jsonify({"error": "No selected file"}), 400
+    # Photo and soundtrack already uploaded through /uploads are referenced by key
+    photo_key, key_error = _direct_upload_key("photo_key")
+    audio_key, audio_key_error = _direct_upload_key("audio_key")
+    if key_error or audio_key_error:
+        return jsonify({"error": key_error or audio_key_error}), 400
+
+    file = None
+    if not photo_key:
+        if 'imageFile' not in request.files and 'photo' not in request.files:
+            return jsonify({"error": "No photo file part in the request"}), 400
+        
+        # Support both 'imageFile' (for new frontend) and 'photo' (for legacy)
+        file = request.files.get("imageFile") or request.files.get("photo")
+        if file.filename == '' :
+            return jsonify({"error": "No selected file"}), 400
 
-    if not file or not allowed_file(file.filename):
-        return jsonify({"error": "Invalid file type. Allowed: png, jpg, jpeg, gif"}), 400
+        if not file or not allowed_file(file.filename):
+            return jsonify({"error": "Invalid file type. Allowed: png, jpg, jpeg, gif"}), 400
 
     action = request.form.get("action", "birthday-dance")
     ratio = request.form.get("ratio", "9:16")
@@ -177,6 +390,17 @@ def generate_route(): # Renamed from generate to avoid conflict with module
         extended_duration = int(request.form.get("extended_duration", 45))
     except ValueError:
         return jsonify({"error": "Extended duration must be an integer"}), 400
+    if not 1 <= extended_duration <= MAX_EXTENDED_DURATION:
+        return jsonify({"error": f"Extended duration must be between 1 and {MAX_EXTENDED_DURATION} seconds"}), 400
+    
+    # Optional HLS packaging of the result
+    hls = request.form.get("hls", "false").lower() == "true"
+    
+    # Optional extra renditions, e.g. "square,480p,preview"
+    try:
+        renditions = parse_renditions(request.form.get("renditions", ""))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     
     # New parameter to use local storage instead of ImgBB
     use_local_storage = request.form.get("use_local_storage", "false").lower() == "true"
@@ -201,11 +425,11 @@ def generate_route(): # Renamed from generate to avoid conflict with module
     
     # Check if audio file was uploaded
     custom_audio = None
-    if 'audio' in request.files:
+    if 'audio' in request.files and not audio_key:
         custom_audio = request.files['audio']
         if custom_audio.filename != '':
             # Process the uploaded audio file
-            if custom_audio.filename.lower().endswith(('.mp3', '.wav', '.ogg')):
+            if custom_audio.filename.lower().endswith(tuple(f".{ext}" for ext in AUDIO_EXTENSIONS)):
                 # We'll handle saving this audio file later
                 pass
             else:
@@ -214,71 +438,77 @@ def generate_route(): # Renamed from generate to avoid conflict with module
     # Create a unique job ID
     job_id = str(uuid.uuid4())
     
-    # Create temporary directory for processing files
-    temp_dir = os.path.join(OUTPUT_DIR, f"temp_{job_id}")
-    os.makedirs(temp_dir, exist_ok=True)
+    if not storage:
+        app.logger.error("A storage backend is required to pass inputs to the workers")
+        return jsonify({"error": "Storage is not available on this server"}), 500
     
-    # Securely save the uploaded file to the temp directory
-    filename = secure_filename(file.filename) # Sanitize filename
-    file_ext = os.path.splitext(filename)[1]
-    saved_filename = f"{job_id}{file_ext}"
-    saved_path = os.path.join(temp_dir, saved_filename)
-    file.save(saved_path)
+    # Inputs are streamed from the request into storage; nothing is written under Output/
+    stored_photo_url = None
+    stored_photo_key = None
+    stored_audio_url = None
+    stored_audio_key = None
     
-    # Save audio file if provided
-    saved_audio_path = None
-    if custom_audio and custom_audio.filename != '':
-        audio_filename = secure_filename(custom_audio.filename)
-        audio_ext = os.path.splitext(audio_filename)[1]
-        saved_audio_filename = f"{job_id}_audio{audio_ext}"
-        saved_audio_path = os.path.join(temp_dir, saved_audio_filename)
-        custom_audio.save(saved_audio_path)
-        audio_path = saved_audio_path
-    
-    # If S3 storage is enabled, upload the input files
-    s3_photo_url = None
-    s3_audio_url = None
-    
-    if use_s3 and s3_storage:
+    # Soundtracks are stored as compact AAC of the seconds that can be used, so that
+    # is all that is moved to workers: request parts were transcoded while the body
+    # was parsed (see StreamingUploadRequest), direct uploads are transcoded here
+    if (custom_audio and custom_audio.filename != '') or audio_key:
         try:
-            # Upload the input photo to S3
-            s3_photo_url, s3_photo_key = s3_storage.upload_file(
-                saved_path, 
-                key_prefix="inputs"
-            )
-            
-            app.logger.info(f"Uploaded input photo to S3: {s3_photo_url}")
-            
-            # Upload the audio file if available
-            if saved_audio_path:
-                s3_audio_url, s3_audio_key = s3_storage.upload_file(
-                    saved_audio_path, 
-                    key_prefix="inputs"
-                )
-                app.logger.info(f"Uploaded input audio to S3: {s3_audio_url}")
-            elif audio_path:  # If using default birthday song
-                # We need to upload the default audio file to S3 as well
-                s3_audio_url, s3_audio_key = s3_storage.upload_file(
-                    audio_path,
-                    key_prefix="inputs"
-                )
-                app.logger.info(f"Uploaded default audio to S3: {s3_audio_url}")
+            if audio_key:
+                stored_audio = _ingest_direct_audio(audio_key, extended_duration)
+                if stored_audio is None:
+                    return jsonify({"error": "Audio upload not found. Upload it before submitting."}), 400
+                stored_audio_url, stored_audio_key = stored_audio
+            else:
+                stored_audio_url, stored_audio_key = custom_audio.stream.result()
+        except AudioUploadTooLarge as e:
+            return jsonify({"error": str(e)}), 413
+        except ValueError as e:
+            app.logger.warning(f"Rejected audio upload: {e}")
+            return jsonify({"error": "Could not decode the uploaded audio file"}), 400
+        except RuntimeError as e:
+            app.logger.error(f"Audio ingest failed: {e}")
+            return jsonify({"error": "Audio processing is unavailable on this server"}), 500
         except Exception as e:
-            app.logger.error(f"Error uploading to S3: {e}")
-            return jsonify({"error": f"S3 upload failed: {str(e)}"}), 500
-    else:
-        app.logger.error("S3 storage is required for distributed processing")
-        return jsonify({"error": "S3 storage must be enabled for this application"}), 500
+            app.logger.error(f"Error storing audio in {storage.name} storage: {e}")
+            return jsonify({"error": f"Input upload failed: {str(e)}"}), 500
+        app.logger.info(f"Stored input audio in {storage.name} storage: {stored_audio_url}")
+    
+    try:
+        if photo_key:
+            # Uploaded by the browser with a presigned request
+            if not storage.object_exists(photo_key):
+                return jsonify({"error": "Photo upload not found. Upload it before submitting."}), 400
+            stored_photo_url, stored_photo_key = storage.url_for(photo_key), photo_key
+        else:
+            # The photo was streamed into storage while the request was parsed
+            # (see StreamingUploadRequest); wait for that upload to complete
+            try:
+                stored_photo_url, stored_photo_key = file.stream.result()
+            except UploadTooLarge as e:
+                return jsonify({"error": str(e)}), 413
+        
+        app.logger.info(f"Stored input photo in {storage.name} storage: {stored_photo_url}")
+        
+        if audio_path and not stored_audio_url:  # If using default birthday song
+            # Workers ship the default song, so only a reference is sent
+            stored_audio_url = bundled_asset_url(os.path.basename(audio_path))
+            app.logger.info(f"Using bundled default audio: {stored_audio_url}")
+    except Exception as e:
+        app.logger.error(f"Error storing inputs in {storage.name} storage: {e}")
+        return jsonify({"error": f"Input upload failed: {str(e)}"}), 500
+    
+    # Inputs are only needed while the job runs (and for retries)
+    try:
+        get_object_tracker().track([stored_photo_key, stored_audio_key], INPUT_RETENTION_SECONDS)
+    except Exception as e:
+        app.logger.warning(f"Could not record input keys for cleanup: {e}")
         
     if SERVER_VERBOSE:
-        print(f"File saved to: {saved_path}")
-        print(f"S3 photo URL: {s3_photo_url}")
-        if audio_path:
-            print(f"Audio file path: {audio_path}")
-            if s3_audio_url:
-                print(f"S3 audio URL: {s3_audio_url}")
+        print(f"Stored photo URL: {stored_photo_url}")
+        if stored_audio_url:
+            print(f"Stored audio URL: {stored_audio_url}")
         print(f"Using local storage: {use_local_storage}")
-        print(f"Using S3 storage: {use_s3}")
+        print(f"Using storage backend: {storage.name}")
         if action == "birthday-dance":
             print("Birthday theme selected - will use local storage and add birthday music")
 
@@ -287,19 +517,21 @@ def generate_route(): # Renamed from generate to avoid conflict with module
         app.logger.info(f"Starting async task: action={action}, ratio={ratio}, duration={duration}, extended_duration={extended_duration}")
         
         # Add detailed logging
-        print(f"DEBUG: Task parameters - photo_url={s3_photo_url}, audio_url={s3_audio_url}")
+        print(f"DEBUG: Task parameters - photo_url={stored_photo_url}, audio_url={stored_audio_url}")
         print(f"DEBUG: About to submit task to Celery with Redis URL: {os.environ.get('REDIS_URL')}")
         
         # Launch the task
         task = process_clip_task.delay(
-            photo_url=s3_photo_url,  # Pass S3 URL instead of local path
-            audio_url=s3_audio_url,  # Pass S3 URL instead of local path
+            photo_url=stored_photo_url,  # Pass the storage URL instead of a local path
+            audio_url=stored_audio_url,  # Pass the storage URL instead of a local path
             action=action, 
             ratio=ratio, 
             duration=duration,
             extended_duration=extended_duration,
             use_local_storage=use_local_storage,
-            birthday_message=birthday_message
+            birthday_message=birthday_message,
+            renditions=renditions,
+            hls=hls
         )
         
         # Log task ID
@@ -343,22 +575,41 @@ def check_status(task_id):
             
             # Add server URLs for local files
             if "local_image_path" in task.result and task.result.get("image_url", "").startswith("file://"):
-                # Extract filename from the path
-                filename = os.path.basename(task.result["local_image_path"])
                 # Replace file:// URL with our server endpoint
-                server_url = request.url_root.rstrip('/') + f"/images/{filename}"
-                response['result']["image_url"] = server_url
+                response['result']["image_url"] = _output_url("images", task.result["local_image_path"])
             
             # Add local video endpoint if available
             if "local_video_path" in task.result:
-                filename = os.path.basename(task.result["local_video_path"])
+                server_url = _output_url("videos", task.result["local_video_path"])
                 # Only replace if it starts with file:// (unlikely but possible)
                 if task.result.get("video_url", "").startswith("file://"):
-                    server_url = request.url_root.rstrip('/') + f"/videos/{filename}"
                     response['result']["video_url"] = server_url
                 # Add a local video URL
-                server_url = request.url_root.rstrip('/') + f"/videos/{filename}"
                 response['result']["local_video_url"] = server_url
+            
+            # Serve poster and sprite from the videos endpoint when they were not uploaded to S3
+            for thumb_name in ("poster", "sprite"):
+                if task.result.get(f"{thumb_name}_path") and not task.result.get(f"{thumb_name}_url"):
+                    response['result'][f"{thumb_name}_url"] = _output_url("videos", task.result[f"{thumb_name}_path"])
+            
+            # Serve a local HLS package when it was not uploaded to S3
+            if task.result.get("hls_playlist_path") and not task.result.get("hls_url"):
+                response['result']["hls_url"] = _output_url("hls", task.result["hls_playlist_path"])
+            
+            # Serve renditions that were not uploaded to S3 from the videos endpoint
+            if task.result.get("renditions") and not task.result.get("rendition_urls"):
+                response['result']["rendition_urls"] = {
+                    name: _output_url("videos", path)
+                    for name, path in task.result["renditions"].items()
+                }
+            
+            # Shared volume storage returns URLs relative to this server
+            for field, value in list(response['result'].items()):
+                if field.endswith("_url") and isinstance(value, str) and value.startswith("/"):
+                    response['result'][field] = request.url_root.rstrip('/') + value
+            for name, url in (response['result'].get("rendition_urls") or {}).items():
+                if url.startswith("/"):
+                    response['result']["rendition_urls"][name] = request.url_root.rstrip('/') + url
         else:
             response = {
                 'status': 'processing',
@@ -370,9 +621,74 @@ def check_status(task_id):
         return jsonify({"error": "An error occurred checking task status"}), 500
 
 # Route to serve locally stored videos
-@app.route('/videos/<filename>')
+@app.route('/videos/<path:filename>')
 def serve_video(filename):
-    return send_from_directory(OUTPUT_DIR, filename)
+    """
+    Serve a generated video (or its poster/sprite/renditions).
+
+    Responses are conditional: Range requests get 206 partial content, and
+    ETag/Last-Modified let clients revalidate instead of re-downloading, so
+    playback of faststart/fragmented MP4s starts after the first bytes and
+    seeking only fetches the needed ranges.
+    """
+    response = _send_output(
+        filename,
+        conditional=True,
+        etag=True,
+        max_age=VIDEO_CACHE_MAX_AGE
+    )
+    response.headers['Accept-Ranges'] = 'bytes'
+    return response
+
+# Route to serve locally stored HLS packages (playlists and segments)
+@app.route('/hls/<path:path>')
+def serve_hls(path):
+    """Serve files of an HLS package from the output directory."""
+    response = _send_output(path, conditional=True, max_age=VIDEO_CACHE_MAX_AGE)
+    if path.endswith('.m3u8'):
+        response.headers['Content-Type'] = 'application/vnd.apple.mpegurl'
+    elif path.endswith('.ts'):
+        response.headers['Content-Type'] = 'video/mp2t'
+    return response
+
+# Route to serve objects of the shared volume storage backend
+@app.route('/files/<path:key>')
+def serve_stored_file(key):
+    """
+    Serve an object stored by the shared volume backend.
+
+    Inputs and outputs are written to the volume by the web service and the
+    workers; this route is how clients fetch them when S3 is not used.
+    Responses are conditional and support Range requests, like /videos.
+    """
+    if storage is None or storage.name != "shared":
+        abort(404)
+    response = send_from_directory(storage.root, key, conditional=True, max_age=VIDEO_CACHE_MAX_AGE)
+    response.headers['Accept-Ranges'] = 'bytes'
+    if key.endswith('.m3u8'):
+        response.headers['Content-Type'] = 'application/vnd.apple.mpegurl'
+    elif key.endswith('.ts'):
+        response.headers['Content-Type'] = 'video/mp2t'
+    return response
+
+# Look up a finished job's local artifacts in the output index
+@app.route('/jobs/<job_id>/artifacts', methods=['GET'])
+def job_artifacts(job_id):
+    """Return server URLs of the artifacts a job (by task ID) left in the output directory."""
+    try:
+        artifacts = gen.outputs.artifacts(job_id)
+    except ValueError:
+        abort(404)
+    if artifacts is None:
+        return jsonify({"error": "No outputs recorded for this job"}), 404
+    routes = {"image": "images", "hls": "hls"}
+    urls = {}
+    for name, rel_path in artifacts.items():
+        path = os.path.join(OUTPUT_DIR, rel_path)
+        if name == "hls":
+            path = os.path.join(path, HLS_MASTER_PLAYLIST)
+        urls[name] = _output_url(routes.get(name, "videos"), path)
+    return jsonify({"job_id": job_id, "artifacts": urls})
 
 # Add health check endpoint
 @app.route('/health', methods=['GET'])
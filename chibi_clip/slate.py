@@ -0,0 +1,436 @@
+"""
+Birthday card slate rendering and encoding.
+
+A slate is the short still segment shown before the animated clip. Slate
+segments are encoded with the same codec parameters as the animated part (the
+SEGMENT_* constants below and the default EncodingPolicy) so that the two can
+be joined with ffmpeg's concat demuxer using stream copy. Encoded segments are cached on disk, keyed by
+everything that affects their bytes, because most birthday messages repeat.
+"""
+
+import os
+import threading
+import subprocess
+from PIL import Image, ImageDraw, ImageFont
+
+from .cache import DiskLRUCache, DEFAULT_CACHE_ROOT, content_hash
+from .encoding import get_encoding_policy, VIDEO_CODEC, PIX_FMT
+from .cpu_budget import thread_args
+
+ASSETS_DIR = os.path.join(os.path.dirname(__file__), "assets")
+
+# How long the slate should appear (seconds)
+SLATE_DURATION = 5
+
+# Codec parameters shared by slate segments and the animated part.
+# Changing any of these invalidates cached slates (they are part of the key).
+SEGMENT_FPS = 24
+SEGMENT_VIDEO_CODEC = VIDEO_CODEC
+SEGMENT_PIX_FMT = PIX_FMT
+SEGMENT_AUDIO_CODEC = "aac"
+SEGMENT_AUDIO_BITRATE = "192k"
+SEGMENT_AUDIO_RATE = 44100
+
+FONT_SIZE = 70
+MIN_FONT_SIZE = 28
+# Bump when the slate layout changes so cached segments are re-rendered
+SLATE_LAYOUT_VERSION = 2
+MAX_CACHED_LAYOUTS = 512
+FONT_LOCATIONS = [
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",  # Linux
+    "/usr/share/fonts/TTF/Arial.ttf",                        # Some Linux
+    "/Library/Fonts/Arial.ttf",                              # macOS
+    "C:\\Windows\\Fonts\\Arial.ttf",                         # Windows
+    # Add fallbacks
+    "/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf",
+    "/usr/share/fonts/truetype/freefont/FreeSansBold.ttf",
+]
+
+_default_slate_cache = None
+_default_slate_renderer = None
+
+
+def backdrop_path_for(width, height):
+    """
+    Choose the backdrop image for a slate of the given size.
+
+    Returns:
+        Path to the backdrop PNG, or None if no backdrop asset exists
+    """
+    candidates = []
+    if width * 16 == height * 9:  # Portrait 9:16 gets the dedicated artwork
+        candidates.append(os.path.join(ASSETS_DIR, "birthday_card_backdrop_v2.png"))
+    candidates.append(os.path.join(ASSETS_DIR, "birthday_card_backdrop.png"))
+    for path in candidates:
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def find_font_path():
+    """Return the first available TrueType font from FONT_LOCATIONS, or None."""
+    for font_path in FONT_LOCATIONS:
+        if os.path.exists(font_path):
+            return font_path
+    return None
+
+
+def segment_codec_params():
+    """Codec parameters that must match between concatenated segments."""
+    return {
+        "fps": SEGMENT_FPS,
+        "vcodec": SEGMENT_VIDEO_CODEC,
+        "encoding": get_encoding_policy().cache_params(),
+        "pix_fmt": SEGMENT_PIX_FMT,
+        "acodec": SEGMENT_AUDIO_CODEC,
+        "abitrate": SEGMENT_AUDIO_BITRATE,
+        "arate": SEGMENT_AUDIO_RATE,
+    }
+
+
+class SlateRenderer:
+    """
+    Draws birthday slates with fonts and backdrops held in memory.
+
+    One renderer is shared per process (see get_slate_renderer). Fonts are
+    loaded once per point size and backdrops are decoded and scaled once per
+    output resolution, so rendering a slate only copies a prepared backdrop
+    and draws the text. Long messages are wrapped and shrunk to fit the frame.
+    """
+
+    def __init__(self, font_path=None, base_font_size=FONT_SIZE, min_font_size=MIN_FONT_SIZE,
+                 margin_ratio=0.08, verbose=False):
+        """
+        Initialize the renderer.
+
+        Args:
+            font_path: TrueType font to use (defaults to the first of FONT_LOCATIONS found)
+            base_font_size: Font size when the frame's short side is 720 px; scaled with the frame
+            min_font_size: Smallest size auto-fit may shrink to
+            margin_ratio: Fraction of each frame edge kept clear of text
+            verbose: Print progress information
+        """
+        self.font_path = font_path or find_font_path()
+        self.base_font_size = base_font_size
+        self.min_font_size = min_font_size
+        self.margin_ratio = margin_ratio
+        self.verbose = verbose
+        self._fonts = {}
+        self._backdrops = {}
+        self._layouts = {}
+        self._lock = threading.Lock()
+        if self.verbose:
+            print(f"INFO: SlateRenderer using font: {self.font_path or 'Pillow default'}")
+        self.font(self.base_font_size)  # Preload the common size
+
+    def cache_params(self):
+        """Renderer settings that affect slate pixels (part of slate cache keys)."""
+        return {
+            "font": self.font_path,
+            "base_size": self.base_font_size,
+            "min_size": self.min_font_size,
+            "margin": self.margin_ratio,
+            "layout": SLATE_LAYOUT_VERSION,
+        }
+
+    def font(self, size):
+        """Return the font at the given size, loading it on first use."""
+        font = self._fonts.get(size)
+        if font is None:
+            # Prep threads and composition may ask for the same size concurrently
+            with self._lock:
+                font = self._fonts.get(size)
+                if font is None:
+                    if self.font_path:
+                        try:
+                            font = ImageFont.truetype(self.font_path, size)
+                        except Exception as font_e:
+                            if self.verbose: print(f"WARNING: Could not load font {self.font_path}: {font_e}")
+                    if font is None:
+                        try:
+                            font = ImageFont.load_default(size=size)  # Pillow >= 10.1
+                        except TypeError:
+                            font = ImageFont.load_default()
+                    self._fonts[size] = font
+        return font
+
+    def backdrop(self, width, height):
+        """
+        Return the backdrop scaled to width x height, or None if no asset exists.
+
+        The returned image is shared; callers must copy it before drawing.
+        """
+        backdrop_path = backdrop_path_for(width, height)
+        if backdrop_path is None:
+            return None
+        memo_key = (backdrop_path, width, height)
+        img = self._backdrops.get(memo_key)
+        if img is None:
+            with self._lock:
+                img = self._backdrops.get(memo_key)
+                if img is None:
+                    with Image.open(backdrop_path) as src:
+                        img = src.convert("RGB")
+                    if img.size != (width, height):
+                        if self.verbose: print(f"INFO: Scaling backdrop {os.path.basename(backdrop_path)} to {width}x{height}")
+                        img = img.resize((width, height), Image.LANCZOS)
+                    self._backdrops[memo_key] = img
+        return img
+
+    def warm(self, resolutions):
+        """Pre-scale backdrops for a list of (width, height) output resolutions."""
+        for width, height in resolutions:
+            self.backdrop(width, height)
+
+    def _wrap(self, message, font, max_width):
+        """Greedy word wrap of message into lines no wider than max_width."""
+        lines = []
+        for paragraph in message.splitlines() or [""]:
+            current = ""
+            for word in paragraph.split():
+                candidate = f"{current} {word}" if current else word
+                if not current or font.getlength(candidate) <= max_width:
+                    current = candidate
+                else:
+                    lines.append(current)
+                    current = word
+            lines.append(current)
+        return "\n".join(lines)
+
+    def layout(self, draw, message, width, height):
+        """
+        Pick the largest font size at which the wrapped message fits the frame.
+
+        Layouts are memoised per (message, width, height), so repeated
+        messages skip the fitting search entirely.
+
+        Returns:
+            Tuple of (font, wrapped_text, stroke_width, bbox)
+        """
+        memo_key = (message, width, height)
+        cached = self._layouts.get(memo_key)
+        if cached is None:
+            # Fit outside the lock (it loads fonts, which take it); only the insert is guarded
+            cached = self._fit(draw, message, width, height)
+            with self._lock:
+                if memo_key not in self._layouts and len(self._layouts) >= MAX_CACHED_LAYOUTS:
+                    self._layouts.pop(next(iter(self._layouts)))  # Drop the oldest entry
+                self._layouts[memo_key] = cached
+        return cached
+
+    def _fit(self, draw, message, width, height):
+        """Search font sizes from large to small until the message fits."""
+        max_width = width * (1 - 2 * self.margin_ratio)
+        max_height = height * (1 - 2 * self.margin_ratio)
+        start_size = max(self.min_font_size, round(self.base_font_size * min(width, height) / 720))
+        size = start_size
+        while True:
+            font = self.font(size)
+            stroke_width = max(1, round(size / 35))
+            text = self._wrap(message, font, max_width) if hasattr(font, "getlength") else message
+            bbox = draw.multiline_textbbox((0, 0), text, font=font, align="center", stroke_width=stroke_width)
+            fits = (bbox[2] - bbox[0]) <= max_width and (bbox[3] - bbox[1]) <= max_height
+            if fits or size <= self.min_font_size:
+                return font, text, stroke_width, bbox
+            size = max(self.min_font_size, int(size * 0.9))
+
+    def render(self, message, width, height):
+        """
+        Render a slate image.
+
+        Args:
+            message: Birthday message to draw
+            width: Output width in pixels
+            height: Output height in pixels
+
+        Returns:
+            PIL Image, or None if no backdrop asset is available
+        """
+        backdrop = self.backdrop(width, height)
+        if backdrop is None:
+            if self.verbose:
+                print("WARNING: No backdrop images found. Skipping card slate.")
+            return None
+
+        img = backdrop.copy()
+        draw = ImageDraw.Draw(img)
+        font, text, stroke_width, bbox = self.layout(draw, message.strip(), width, height)
+        position = ((width - (bbox[2] - bbox[0])) // 2 - bbox[0], (height - (bbox[3] - bbox[1])) // 2 - bbox[1])
+        draw.multiline_text(
+            position, text, font=font, fill=(255, 255, 255), align="center",
+            stroke_width=stroke_width, stroke_fill=(0, 0, 0)
+        )
+        return img
+
+    def render_to_file(self, message, width, height, dest_path):
+        """
+        Render a slate and save it to dest_path.
+
+        The file is only an ffmpeg input and is discarded after encoding, so
+        an uncompressed format such as BMP keeps the save as cheap as the render.
+
+        Returns:
+            dest_path, or None if no backdrop asset is available
+        """
+        img = self.render(message, width, height)
+        if img is None:
+            return None
+        img.save(dest_path)
+        img.close()
+        return dest_path
+
+
+def encode_slate_segment(image_path, dest_path, width, height, fps=SEGMENT_FPS, duration=SLATE_DURATION,
+                         audio_channels=None, verbose=False):
+    """
+    Encode a still image into a slate segment that can be concat-copied.
+
+    When audio_channels is set, a silent AAC track with the segment audio
+    parameters is added so the segment's stream layout matches the animated
+    part it will be joined with.
+
+    Args:
+        image_path: Slate image
+        dest_path: Output MP4 path
+        width: Output width in pixels
+        height: Output height in pixels
+        fps: Output frame rate
+        duration: Segment duration in seconds
+        audio_channels: Channel count of the animated part's audio, or None if it has no audio
+        verbose: Print the ffmpeg command
+
+    Returns:
+        dest_path
+    """
+    cmd = ["ffmpeg", "-y", "-loop", "1", "-framerate", str(fps), "-i", image_path]
+    if audio_channels:
+        cmd += [
+            "-f", "lavfi",
+            "-i", f"anullsrc=channel_layout={'mono' if audio_channels == 1 else 'stereo'}:sample_rate={SEGMENT_AUDIO_RATE}",
+        ]
+    cmd += [
+        "-t", str(duration),
+        "-vf", f"scale={width}:{height}:force_original_aspect_ratio=decrease,pad={width}:{height}:(ow-iw)/2:(oh-ih)/2",
+        # Same encoder settings as the animated part (not tune=stillimage): the
+        # concatenated segments have to share one set of H.264 parameter sets
+        *get_encoding_policy().video_args(),
+        "-r", str(fps),
+    ]
+    if audio_channels:
+        cmd += ["-c:a", SEGMENT_AUDIO_CODEC, "-b:a", SEGMENT_AUDIO_BITRATE, "-ar", str(SEGMENT_AUDIO_RATE)]
+    cmd += thread_args()
+    cmd.append(dest_path)
+
+    if verbose:
+        print(f"INFO: Creating slate video with FFmpeg: {' '.join(cmd)}")
+    subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    if not os.path.exists(dest_path) or os.path.getsize(dest_path) == 0:
+        raise RuntimeError(f"FFmpeg produced no slate segment at {dest_path}")
+    return dest_path
+
+
+class SlateSegmentCache:
+    """Cache of encoded slate segments keyed by message, font, format and backdrop."""
+
+    def __init__(self, cache=None, renderer=None, verbose=False):
+        """
+        Initialize the slate cache.
+
+        Args:
+            cache: DiskLRUCache to store segments in (defaults to a node-local cache)
+            renderer: SlateRenderer used on misses (defaults to the process-wide one)
+            verbose: Print progress information
+        """
+        self.cache = cache or DiskLRUCache(os.path.join(DEFAULT_CACHE_ROOT, "slates"), verbose=verbose)
+        self.renderer = renderer or get_slate_renderer(verbose=verbose)
+        self.verbose = verbose
+
+    def key_for(self, message, width, height, fps=SEGMENT_FPS, duration=SLATE_DURATION, audio_channels=None):
+        """
+        Build the cache key for a slate segment.
+
+        Returns:
+            Cache key string, or None if no backdrop asset exists
+        """
+        backdrop_path = backdrop_path_for(width, height)
+        if backdrop_path is None:
+            return None
+        return DiskLRUCache.make_key(
+            "slate", message, self.renderer.cache_params(),
+            width, height, fps, duration, audio_channels,
+            segment_codec_params(), content_hash(backdrop_path),
+        )
+
+    def get_segment(self, message, width, height, work_dir, fps=SEGMENT_FPS, duration=SLATE_DURATION,
+                    audio_channels=None):
+        """
+        Return an encoded slate segment, rendering and encoding it on a miss.
+
+        Args:
+            message: Birthday message to show on the slate
+            width: Segment width in pixels
+            height: Segment height in pixels
+            work_dir: Scratch directory for intermediate files
+            fps: Segment frame rate
+            duration: Segment duration in seconds
+            audio_channels: Channel count of the animated part's audio, or None
+
+        Returns:
+            Path to the cached MP4 segment, or None if no backdrop is available
+        """
+        key = self.key_for(message, width, height, fps, duration, audio_channels)
+        if key is None:
+            if self.verbose:
+                print("WARNING: No backdrop images found. Skipping card slate.")
+            return None
+
+        cached = self.cache.get(key, suffix=".mp4")
+        if cached:
+            return cached
+
+        if self.verbose: print("INFO: Creating card slate using PIL and FFmpeg (bypassing MoviePy)")
+        image_path = os.path.join(work_dir, "birthday_card_slate.bmp")
+        video_path = os.path.join(work_dir, "birthday_card_slate.mp4")
+        if self.renderer.render_to_file(message, width, height, image_path) is None:
+            return None
+        encode_slate_segment(image_path, video_path, width, height, fps=fps, duration=duration,
+                             audio_channels=audio_channels, verbose=self.verbose)
+        return self.cache.put(key, video_path, suffix=".mp4", move=True)
+
+
+def get_slate_renderer(verbose=False):
+    """Return the process-wide SlateRenderer, creating it on first use."""
+    global _default_slate_renderer
+    if _default_slate_renderer is None:
+        _default_slate_renderer = SlateRenderer(verbose=verbose)
+    return _default_slate_renderer
+
+
+def get_slate_cache(verbose=False):
+    """
+    Return the process-wide slate segment cache.
+
+    Configured via environment variables:
+        CHIBICLIP_SLATE_CACHE_MB: Local size budget (default 256)
+        CHIBICLIP_SLATE_CACHE_S3: Mirror segments to S3 under cache/slates (default false)
+    """
+    global _default_slate_cache
+    if _default_slate_cache is None:
+        s3_storage = None
+        if os.getenv("CHIBICLIP_SLATE_CACHE_S3", "false").lower() == "true":
+            try:
+                from .storage import S3Storage
+                s3_storage = S3Storage()
+            except Exception as e:
+                print(f"Warning: Slate cache S3 mirror disabled: {e}")
+        max_bytes = int(os.getenv("CHIBICLIP_SLATE_CACHE_MB", "256")) * 1024 * 1024
+        cache = DiskLRUCache(
+            os.path.join(DEFAULT_CACHE_ROOT, "slates"),
+            max_bytes=max_bytes,
+            s3_storage=s3_storage,
+            s3_prefix="cache/slates",
+            verbose=verbose,
+        )
+        _default_slate_cache = SlateSegmentCache(cache=cache, verbose=verbose)
+    return _default_slate_cache
@@ -8,6 +8,28 @@ document.addEventListener('DOMContentLoaded', () => {
     const videoResultDiv = document.getElementById('videoResult');
     const errorResultDiv = document.getElementById('errorResult');
 
+    // The photo starts uploading straight to S3 as soon as it is picked, and the
+    // form then only sends its key. If the server does not offer direct uploads
+    // (no S3) or the upload fails, the file is sent with the form as before.
+    let pendingPhotoUpload = null;
+
+    async function uploadDirect(file, kind) {
+        const response = await fetch('/uploads', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ filename: file.name, kind: kind }),
+        });
+        if (!response.ok) {
+            return null;
+        }
+        const upload = await response.json();
+        const body = new FormData();
+        Object.entries(upload.fields).forEach(([name, value]) => body.append(name, value));
+        body.append('file', file); // S3 requires the file after the policy fields
+        const uploadResponse = await fetch(upload.url, { method: 'POST', body: body });
+        return uploadResponse.ok ? upload.key : null;
+    }
+
     // Trigger file input when custom upload area is clicked
     if (fileUploadArea) {
         fileUploadArea.addEventListener('click', () => {
@@ -19,6 +41,7 @@ document.addEventListener('DOMContentLoaded', () => {
     if (dogPhotoInput) {
         dogPhotoInput.addEventListener('change', function(event) {
             const file = event.target.files[0];
+            pendingPhotoUpload = file ? uploadDirect(file, 'image').catch(() => null) : null;
             if (file) {
                 const reader = new FileReader();
                 reader.onload = function(e) {
@@ -48,6 +71,14 @@ document.addEventListener('DOMContentLoaded', () => {
             errorResultDiv.textContent = '';
 
             const formData = new FormData(form);
+
+            if (pendingPhotoUpload) {
+                const photoKey = await pendingPhotoUpload;
+                if (photoKey) {
+                    formData.delete('photo');
+                    formData.set('photo_key', photoKey);
+                }
+            }
             
             // Ensure use_local_storage is true, as the frontend expects to display results from server paths
             formData.set('use_local_storage', 'true');
@@ -89,7 +120,9 @@ document.addEventListener('DOMContentLoaded', () => {
                 const displayVideoUrl = result.local_video_url || result.video_url; 
 
                 if (displayVideoUrl) {
-                     resultHTML += `<h3>Video Ready!</h3><video controls src="${displayVideoUrl}"></video>`;
+                     // Show the poster right away and only fetch the MP4 when playback starts
+                     const posterAttr = result.poster_url ? ` poster="${result.poster_url}" preload="none"` : '';
+                     resultHTML += `<h3>Video Ready!</h3><video controls${posterAttr} src="${displayVideoUrl}"></video>`;
                 }
                 // Fallback for image if video URL isn't primary
                 else if (result.image_url) { 
@@ -1,80 +1,302 @@
 """
 S3 Storage integration for Dog Reels application.
 This module handles uploading and managing files in S3.
+
+In content-addressed mode (the default) uploads are keyed by the SHA-256 of
+their bytes, <prefix>/<sha256><ext>. An object that is already in the bucket
+is not uploaded again; the check costs one HEAD request, or nothing when this
+process has seen the key before. Because a key's bytes never change, such
+objects are served with immutable cache headers.
 """
 
 import os
+import re
+import time
 import uuid
+import hashlib
+import threading
 import boto3
+from boto3.s3.transfer import S3Transfer, TransferConfig
+from botocore.config import Config
 from botocore.exceptions import ClientError
-from urllib.parse import urlparse
+from urllib.parse import urlparse, unquote
 from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
+
+from .cache import content_hash
+from .backends import StorageBackend, CONTENT_ADDRESSED, hash_fileobj
+
+# Multipart part size for streamed uploads (S3 requires >= 5 MB for all but the last part)
+STREAM_PART_SIZE = int(os.getenv('CHIBICLIP_STREAM_PART_MB', '8')) * 1024 * 1024
+# Parts uploaded concurrently while the producer keeps writing
+STREAM_UPLOAD_CONCURRENCY = 2
+# Cache headers for objects whose key changes whenever their bytes do
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# Keys remembered as present in the bucket, per S3Storage, and for how long
+# (shorter than any lifecycle retention, so deleted objects are not assumed present)
+KNOWN_KEYS_LIMIT = 10000
+KNOWN_KEYS_TTL = 3600
+# Keys per DeleteObjects request (the S3 maximum)
+DELETE_BATCH_SIZE = 1000
+# Connections kept open by each shared client (CHIBICLIP_S3_POOL_CONNECTIONS)
+S3_MAX_POOL_CONNECTIONS = int(os.getenv('CHIBICLIP_S3_POOL_CONNECTIONS', '32'))
+# Files upload_many sends at once; each splits into concurrent multipart parts
+UPLOAD_MANY_CONCURRENCY = int(os.getenv('CHIBICLIP_S3_UPLOAD_CONCURRENCY', '4'))
+# Managed transfers switch to multipart above this size, in parts of MULTIPART_CHUNKSIZE
+MULTIPART_THRESHOLD = int(os.getenv('CHIBICLIP_S3_MULTIPART_THRESHOLD_MB', '8')) * 1024 * 1024
+MULTIPART_CHUNKSIZE = int(os.getenv('CHIBICLIP_S3_MULTIPART_CHUNK_MB', '8')) * 1024 * 1024
+# Lifetime of presigned upload requests handed to browsers (CHIBICLIP_PRESIGNED_UPLOAD_SECONDS)
+PRESIGNED_UPLOAD_EXPIRES = int(os.getenv('CHIBICLIP_PRESIGNED_UPLOAD_SECONDS', '900'))
+# Open uploaded images with PIL before sending them (CHIBICLIP_VALIDATE_IMAGE_UPLOADS)
+VALIDATE_IMAGE_UPLOADS = os.getenv('CHIBICLIP_VALIDATE_IMAGE_UPLOADS', 'false').lower() == 'true'
+
+# Virtual-hosted (bucket.s3.region.amazonaws.com) and path-style (s3.region.amazonaws.com/bucket) hosts
+_VIRTUAL_HOST_RE = re.compile(r'^(?P<bucket>.+)\.s3(?:[.-][a-z0-9-]+)?\.amazonaws\.com$')
+_PATH_STYLE_HOST_RE = re.compile(r'^s3(?:[.-][a-z0-9-]+)?\.amazonaws\.com$')
+
+_clients = {}
+_transfers = {}
+_clients_lock = threading.Lock()
+
+
+def get_s3_client(region=None):
+    """
+    Return the process-wide S3 client for a region.
+    
+    boto3 clients are thread-safe and keep their connection pool, so one client
+    per region serves every task in a worker process. The cache is keyed by PID
+    too: a client created before a fork is never reused in the child.
+    
+    Args:
+        region: AWS region (defaults to env var AWS_REGION)
+    """
+    region = region or os.getenv('AWS_REGION', 'us-east-2')
+    cache_key = (os.getpid(), region)
+    with _clients_lock:
+        client = _clients.get(cache_key)
+        if client is None:
+            # Sessions are not thread-safe; give each client its own
+            client = boto3.session.Session().client(
+                's3', region_name=region, config=Config(max_pool_connections=S3_MAX_POOL_CONNECTIONS)
+            )
+            _clients[cache_key] = client
+        return client
 
-class S3Storage:
+
+def get_s3_transfer(region=None):
+    """Return the process-wide managed transfer (multipart uploads/downloads) for a region."""
+    region = region or os.getenv('AWS_REGION', 'us-east-2')
+    client = get_s3_client(region)
+    cache_key = (os.getpid(), region)
+    with _clients_lock:
+        transfer = _transfers.get(cache_key)
+        if transfer is None:
+            transfer = S3Transfer(client, _transfer_config())
+            _transfers[cache_key] = transfer
+        return transfer
+
+
+def _transfer_config():
+    # Concurrent parts per file, sized so UPLOAD_MANY_CONCURRENCY files fit the connection pool
+    return TransferConfig(
+        multipart_threshold=MULTIPART_THRESHOLD,
+        multipart_chunksize=MULTIPART_CHUNKSIZE,
+        max_concurrency=max(1, S3_MAX_POOL_CONNECTIONS // UPLOAD_MANY_CONCURRENCY),
+    )
+
+
+def resolve_s3_url(url, default_bucket=None):
+    """
+    Resolve an S3 object URL to its bucket and key.
+    
+    Accepts s3://bucket/key, virtual-hosted and path-style HTTPS URLs. Other
+    URLs are taken as keys in default_bucket.
+    
+    Args:
+        url: Object URL
+        default_bucket: Bucket for URLs that do not name one (defaults to env var S3_BUCKET_NAME)
+        
+    Returns:
+        Tuple of (bucket, key)
+        
+    Raises:
+        ValueError: If no bucket or key can be determined
+    """
+    parsed = urlparse(url)
+    host = (parsed.hostname or '').lower()
+    path = parsed.path.lstrip('/')
+    bucket = None
+    if parsed.scheme == 's3':
+        bucket, key = parsed.netloc, path
+    elif _VIRTUAL_HOST_RE.match(host):
+        bucket, key = _VIRTUAL_HOST_RE.match(host).group('bucket'), path
+    elif _PATH_STYLE_HOST_RE.match(host):
+        bucket, _, key = path.partition('/')
+    else:
+        key = path
+    bucket = bucket or default_bucket or os.getenv('S3_BUCKET_NAME')
+    key = unquote(key)
+    if not bucket or not key:
+        raise ValueError(f"Could not determine S3 bucket/key for URL: {url}")
+    return bucket, key
+
+
+class S3Storage(StorageBackend):
     """Storage handler for AWS S3."""
     
-    def __init__(self, bucket_name=None, aws_region=None):
+    name = 's3'
+    
+    def __init__(self, bucket_name=None, aws_region=None, content_addressed=CONTENT_ADDRESSED):
         """
         Initialize S3 storage handler.
         
         Args:
             bucket_name: S3 bucket name (defaults to env var S3_BUCKET_NAME)
             aws_region: AWS region (defaults to env var AWS_REGION)
+            content_addressed: Default key scheme for uploads without an explicit key
         """
         self.bucket_name = bucket_name or os.getenv('S3_BUCKET_NAME')
         self.region = aws_region or os.getenv('AWS_REGION', 'us-east-2')
+        super().__init__(content_addressed)
+        self._known_keys = {}
+        self._known_keys_lock = threading.Lock()
+        self._upload_executor = None
+        self._upload_executor_lock = threading.Lock()
         
         if not self.bucket_name:
             raise ValueError("S3 bucket name not provided. Set S3_BUCKET_NAME environment variable.")
         
-        # Initialize S3 client with the specific region
-        self.s3 = boto3.client('s3', region_name=self.region)
+        # Shared per-process client and transfer manager for the region
+        self.s3 = get_s3_client(self.region)
+        self.transfer = get_s3_transfer(self.region)
         
         # Public URL format
         self.url_format = f"https://{self.bucket_name}.s3.{self.region}.amazonaws.com/{{}}"
     
-    def upload_file(self, file_path, key_prefix='uploads'):
+    def url_for(self, key):
+        return self.url_format.format(key)
+    
+    def key_for_url(self, url):
+        """Key of an object URL in this bucket, or None for other buckets and non-S3 URLs."""
+        parsed = urlparse(url)
+        host = (parsed.hostname or '').lower()
+        if parsed.scheme != 's3' and not (_VIRTUAL_HOST_RE.match(host) or _PATH_STYLE_HOST_RE.match(host)):
+            return None
+        try:
+            bucket, key = resolve_s3_url(url, default_bucket=self.bucket_name)
+        except ValueError:
+            return None
+        return key if bucket == self.bucket_name else None
+    
+    def object_exists(self, key):
+        """
+        Check whether an object is in the bucket.
+        
+        Keys this process uploaded or found before are answered from memory;
+        others cost one HEAD request.
+        """
+        with self._known_keys_lock:
+            if time.time() - self._known_keys.get(key, 0) < KNOWN_KEYS_TTL:
+                return True
+        try:
+            self.s3.head_object(Bucket=self.bucket_name, Key=key)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+        self._remember_key(key)
+        return True
+    
+    def object_size(self, key):
+        """Size in bytes of an object (one HEAD request), or None if it does not exist."""
+        try:
+            response = self.s3.head_object(Bucket=self.bucket_name, Key=key)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+        self._remember_key(key)
+        return response['ContentLength']
+    
+    def open_object(self, key):
+        """
+        Stream an object's bytes from S3.
+        
+        The body is fetched as it is read, so a reader that stops early
+        (e.g. after the seconds of audio it needs) does not download the rest.
+        """
+        return self.s3.get_object(Bucket=self.bucket_name, Key=key)['Body']
+    
+    def _remember_key(self, key):
+        with self._known_keys_lock:
+            if len(self._known_keys) >= KNOWN_KEYS_LIMIT:
+                self._known_keys.clear()
+            self._known_keys[key] = time.time()
+    
+    def _forget_key(self, key):
+        with self._known_keys_lock:
+            self._known_keys.pop(key, None)
+    
+    def upload_file(self, file_path, key_prefix='uploads', key=None, content_addressed=None,
+                    validate_image=None, callback=None):
         """
         Upload a file to S3 bucket.
         
         Args:
             file_path: Path to the local file
             key_prefix: Prefix for the S3 key (folder)
+            key: Explicit S3 key to use instead of a generated one
+            content_addressed: Key the object by its SHA-256 and skip the upload if it
+                already exists (defaults to the storage's mode; ignored with an explicit key)
+            validate_image: Open images with PIL before uploading (defaults to
+                CHIBICLIP_VALIDATE_IMAGE_UPLOADS)
+            callback: Called with the number of bytes sent as parts complete
             
         Returns:
             URL of the uploaded file
         """
         try:
-            # Generate a unique filename with original extension
             _, ext = os.path.splitext(file_path)
-            unique_name = f"{uuid.uuid4().hex}{ext}"
-            
-            # Create the full S3 key
-            key = f"{key_prefix}/{unique_name}"
+            if content_addressed is None:
+                content_addressed = self.content_addressed
+            content_addressed = content_addressed and key is None
+            digest = None
+            if content_addressed:
+                digest = content_hash(file_path)
+                key = f"{key_prefix}/{digest}{ext.lower()}"
+                if self.object_exists(key):
+                    print(f"{file_path} already in S3 as {key}, skipping upload")
+                    return self.url_format.format(key), key
+            elif key is None:
+                # Generate a unique filename with original extension
+                unique_name = f"{uuid.uuid4().hex}{ext}"
+                
+                # Create the full S3 key
+                key = f"{key_prefix}/{unique_name}"
             
             # Get content type and validate image format for image files
             content_type = self._get_content_type(ext)
             extra_args = {'ContentType': content_type}
+            if digest:
+                extra_args['CacheControl'] = IMMUTABLE_CACHE_CONTROL
+                extra_args['Metadata'] = {'sha256': digest}
             
-            # For image files, validate and standardize format if needed
             if content_type.startswith('image/'):
-                try:
-                    # Open image to verify it's valid
-                    with Image.open(file_path) as img:
-                        # If it's an image, set appropriate cache control for browser caching
-                        extra_args['CacheControl'] = 'max-age=31536000'  # 1 year
-                        print(f"Validated image: format={img.format}, mode={img.mode}, size={img.size}")
-                except Exception as e:
-                    print(f"Warning: Could not validate image file {file_path}: {e}")
+                # Set appropriate cache control for browser caching
+                extra_args.setdefault('CacheControl', 'max-age=31536000')  # 1 year
+                if VALIDATE_IMAGE_UPLOADS if validate_image is None else validate_image:
+                    try:
+                        # Open image to verify it's valid
+                        with Image.open(file_path) as img:
+                            print(f"Validated image: format={img.format}, mode={img.mode}, size={img.size}")
+                    except Exception as e:
+                        print(f"Warning: Could not validate image file {file_path}: {e}")
             
             # Upload the file with extra arguments
             print(f"Uploading {file_path} to S3 with content type: {content_type}")
-            self.s3.upload_file(
-                Filename=file_path,
-                Bucket=self.bucket_name,
-                Key=key,
-                ExtraArgs=extra_args
-            )
+            self.transfer.upload_file(file_path, self.bucket_name, key, extra_args=extra_args, callback=callback)
+            if digest:
+                self._remember_key(key)
             
             # Return the URL and key
             return self.url_format.format(key), key
@@ -82,7 +304,36 @@ class S3Storage:
             print(f"Error uploading file to S3: {e}")
             raise
     
-    def upload_data(self, file_data, filename, key_prefix='uploads'):
+    def upload_many(self, uploads, progress=None):
+        """
+        Upload several files in parallel.
+        
+        Up to UPLOAD_MANY_CONCURRENCY files are in flight at once, each using
+        the shared transfer manager's concurrent multipart parts.
+        
+        Args:
+            uploads: Iterable of dicts of upload_file keyword arguments
+                (at least file_path)
+            progress: Optional callable(file_path, bytes_sent, total_bytes), called
+                from the upload threads as parts complete
+                
+        Returns:
+            List of futures in the order of uploads, each resolving to (url, key)
+        """
+        with self._upload_executor_lock:
+            if self._upload_executor is None:
+                self._upload_executor = ThreadPoolExecutor(
+                    max_workers=UPLOAD_MANY_CONCURRENCY, thread_name_prefix="s3-upload"
+                )
+        futures = []
+        for upload in uploads:
+            kwargs = dict(upload)
+            if progress is not None:
+                kwargs['callback'] = _ProgressCallback(kwargs['file_path'], progress)
+            futures.append(self._upload_executor.submit(self.upload_file, **kwargs))
+        return futures
+    
+    def upload_data(self, file_data, filename, key_prefix='uploads', content_addressed=None):
         """
         Upload file data directly to S3.
         
@@ -90,25 +341,41 @@ class S3Storage:
             file_data: Binary data to upload
             filename: Original filename for content type detection
             key_prefix: Prefix for the S3 key (folder)
+            content_addressed: Key the object by its SHA-256 and skip the upload if it
+                already exists (defaults to the storage's mode)
             
         Returns:
             URL of the uploaded file
         """
         try:
-            # Generate a unique filename with original extension
             _, ext = os.path.splitext(filename)
-            unique_name = f"{uuid.uuid4().hex}{ext}"
-            
-            # Create the full S3 key
-            key = f"{key_prefix}/{unique_name}"
+            if content_addressed is None:
+                content_addressed = self.content_addressed
+            extra_args = {}
+            if content_addressed:
+                digest = hashlib.sha256(file_data).hexdigest()
+                key = f"{key_prefix}/{digest}{ext.lower()}"
+                if self.object_exists(key):
+                    print(f"{filename} already in S3 as {key}, skipping upload")
+                    return self.url_format.format(key), key
+                extra_args = {'CacheControl': IMMUTABLE_CACHE_CONTROL, 'Metadata': {'sha256': digest}}
+            else:
+                # Generate a unique filename with original extension
+                unique_name = f"{uuid.uuid4().hex}{ext}"
+                
+                # Create the full S3 key
+                key = f"{key_prefix}/{unique_name}"
             
             # Upload the data
             self.s3.put_object(
                 Body=file_data,
                 Bucket=self.bucket_name,
                 Key=key,
-                ContentType=self._get_content_type(ext)
+                ContentType=self._get_content_type(ext),
+                **extra_args
             )
+            if content_addressed:
+                self._remember_key(key)
             
             # Return the URL
             return self.url_format.format(key), key
@@ -116,6 +383,197 @@ class S3Storage:
             print(f"Error uploading data to S3: {e}")
             raise
     
+    def upload_fileobj(self, fileobj, filename, key_prefix='uploads', content_addressed=None):
+        """
+        Upload a binary stream (e.g. a request's file) without writing it to disk.
+        
+        The stream is sent with the transfer settings of the shared transfer
+        manager (multipart above MULTIPART_THRESHOLD). Content-addressed keys
+        need the hash before the upload, so seekable streams are read twice
+        (hashing, then uploading) and others get a unique key.
+        
+        Args:
+            fileobj: Binary file-like object to read until EOF
+            filename: Original filename for the extension and content type
+            key_prefix: Prefix for the S3 key (folder)
+            content_addressed: Key the object by its SHA-256 and skip the upload if it
+                already exists (defaults to the storage's mode)
+            
+        Returns:
+            URL and key of the uploaded object
+        """
+        _, ext = os.path.splitext(filename)
+        if content_addressed is None:
+            content_addressed = self.content_addressed
+        digest = hash_fileobj(fileobj) if content_addressed else None
+        key = self._new_key(key_prefix, ext, digest)
+        extra_args = {'ContentType': self._get_content_type(ext)}
+        if digest:
+            if self.object_exists(key):
+                print(f"{filename} already in S3 as {key}, skipping upload")
+                return self.url_format.format(key), key
+            extra_args['CacheControl'] = IMMUTABLE_CACHE_CONTROL
+            extra_args['Metadata'] = {'sha256': digest}
+        try:
+            self.s3.upload_fileobj(fileobj, self.bucket_name, key, ExtraArgs=extra_args, Config=_transfer_config())
+        except ClientError as e:
+            print(f"Error uploading stream to S3: {e}")
+            raise
+        if digest:
+            self._remember_key(key)
+        print(f"Uploaded {filename} to S3 key {key}")
+        return self.url_format.format(key), key
+    
+    def upload_stream(self, stream, extension, key_prefix='uploads', part_size=STREAM_PART_SIZE,
+                      before_complete=None):
+        """
+        Upload a byte stream of unknown length with a multipart upload.
+        
+        Parts are sent while the stream is still being read (up to
+        STREAM_UPLOAD_CONCURRENCY in flight), so a producer such as ffmpeg
+        and the upload overlap. Only one part per in-flight upload is held in
+        memory. The upload is aborted if anything fails.
+        
+        Args:
+            stream: Binary file-like object to read until EOF
+            extension: File extension for the key and content type (e.g. '.mp4')
+            key_prefix: Prefix for the S3 key (folder)
+            part_size: Bytes per part
+            before_complete: Optional callable run after EOF and before the upload
+                is completed; raising from it aborts the upload
+            
+        Returns:
+            URL and key of the uploaded object
+        """
+        key = f"{key_prefix}/{uuid.uuid4().hex}{extension}"
+        upload_id = self.s3.create_multipart_upload(
+            Bucket=self.bucket_name,
+            Key=key,
+            ContentType=self._get_content_type(extension)
+        )['UploadId']
+        
+        def upload_part(part_number, body):
+            response = self.s3.upload_part(
+                Bucket=self.bucket_name,
+                Key=key,
+                PartNumber=part_number,
+                UploadId=upload_id,
+                Body=body
+            )
+            return {'ETag': response['ETag'], 'PartNumber': part_number}
+        
+        futures = []
+        try:
+            with ThreadPoolExecutor(max_workers=STREAM_UPLOAD_CONCURRENCY) as executor:
+                while True:
+                    body = _read_part(stream, part_size)
+                    if not body:
+                        break
+                    # Bound memory: wait for the oldest part before buffering too many
+                    in_flight = [f for f in futures if not f.done()]
+                    if len(in_flight) >= STREAM_UPLOAD_CONCURRENCY:
+                        in_flight[0].result()
+                    futures.append(executor.submit(upload_part, len(futures) + 1, body))
+                parts = [f.result() for f in futures]
+            
+            if before_complete:
+                before_complete()
+            if not parts:
+                raise ValueError("Nothing to upload: the stream was empty")
+            
+            self.s3.complete_multipart_upload(
+                Bucket=self.bucket_name,
+                Key=key,
+                UploadId=upload_id,
+                MultipartUpload={'Parts': parts}
+            )
+        except BaseException:
+            try:
+                self.s3.abort_multipart_upload(Bucket=self.bucket_name, Key=key, UploadId=upload_id)
+            except ClientError as e:
+                print(f"Error aborting multipart upload {key}: {e}")
+            raise
+        
+        print(f"Streamed {len(parts)} part(s) to S3 key {key}")
+        return self.url_format.format(key), key
+    
+    def presign_upload(self, filename, key_prefix='inputs', max_bytes=None, method='post',
+                       expires_in=PRESIGNED_UPLOAD_EXPIRES):
+        """
+        Issue a presigned request that lets a client upload one object directly.
+        
+        POST policies pin the Content-Type and, with max_bytes, the size range.
+        PUT URLs are signed for the Content-Type only; S3 cannot limit their
+        size, so the object's size must be checked before it is used (workers
+        do so with a HEAD request before downloading inputs).
+        
+        Args:
+            filename: Client file name, for the extension and content type
+            key_prefix: Prefix for the S3 key (folder)
+            max_bytes: Largest accepted upload (POST only)
+            method: 'post' (browser form upload) or 'put'
+            expires_in: Seconds the request stays valid
+            
+        Returns:
+            Dict with method, url, fields (form fields for POST, headers for PUT),
+            key, object_url and expires_in
+            
+        Raises:
+            ValueError: If method is not 'post' or 'put'
+        """
+        _, ext = os.path.splitext(filename)
+        key = f"{key_prefix}/{uuid.uuid4().hex}{ext.lower()}"
+        content_type = self._get_content_type(ext)
+        if method == 'post':
+            conditions = [{'Content-Type': content_type}]
+            if max_bytes:
+                conditions.append(['content-length-range', 1, max_bytes])
+            presigned = self.s3.generate_presigned_post(
+                Bucket=self.bucket_name,
+                Key=key,
+                Fields={'Content-Type': content_type},
+                Conditions=conditions,
+                ExpiresIn=expires_in
+            )
+            url, fields = presigned['url'], presigned['fields']
+        elif method == 'put':
+            url = self.s3.generate_presigned_url(
+                'put_object',
+                Params={'Bucket': self.bucket_name, 'Key': key, 'ContentType': content_type},
+                ExpiresIn=expires_in
+            )
+            fields = {'Content-Type': content_type}
+        else:
+            raise ValueError(f"Unsupported presigned upload method '{method}'. Use 'post' or 'put'.")
+        return {
+            'method': method.upper(),
+            'url': url,
+            'fields': fields,
+            'key': key,
+            'object_url': self.url_for(key),
+            'expires_in': expires_in,
+        }
+    
+    def download_file(self, key, dest_path):
+        """
+        Download an object from the bucket to a local path.
+        
+        Args:
+            key: S3 key of the object
+            dest_path: Local path to write to
+            
+        Returns:
+            True if downloaded, False if the object does not exist
+        """
+        try:
+            self.transfer.download_file(self.bucket_name, key, dest_path)
+            return True
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            print(f"Error downloading file from S3: {e}")
+            raise
+    
     def delete_file(self, url_or_key):
         """
         Delete a file from S3.
@@ -128,9 +586,11 @@ class S3Storage:
         """
         try:
             # Extract the key if a URL was provided
-            if url_or_key.startswith("http"):
-                parsed = urlparse(url_or_key)
-                key = parsed.path.lstrip('/')
+            if url_or_key.startswith(("http://", "https://", "s3://")):
+                bucket, key = resolve_s3_url(url_or_key, default_bucket=self.bucket_name)
+                if bucket != self.bucket_name:
+                    print(f"Not deleting {url_or_key}: object is not in bucket {self.bucket_name}")
+                    return False
             else:
                 key = url_or_key
             
@@ -139,11 +599,55 @@ class S3Storage:
                 Bucket=self.bucket_name,
                 Key=key
             )
+            self._forget_key(key)
             return True
         except ClientError as e:
             print(f"Error deleting file from S3: {e}")
             return False
     
+    def delete_many(self, keys):
+        """
+        Delete objects with batched DeleteObjects requests (DELETE_BATCH_SIZE keys each).
+        
+        Args:
+            keys: Iterable of S3 keys
+            
+        Returns:
+            List of keys that were deleted (missing objects count as deleted)
+        """
+        keys = list(dict.fromkeys(keys))
+        deleted = []
+        for start in range(0, len(keys), DELETE_BATCH_SIZE):
+            batch = keys[start:start + DELETE_BATCH_SIZE]
+            try:
+                response = self.s3.delete_objects(
+                    Bucket=self.bucket_name,
+                    Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True}
+                )
+            except ClientError as e:
+                print(f"Error deleting {len(batch)} objects from S3: {e}")
+                continue
+            failed = {error['Key'] for error in response.get('Errors', [])}
+            for error in response.get('Errors', [])[:5]:
+                print(f"Could not delete {error['Key']}: {error.get('Code')} {error.get('Message')}")
+            for key in batch:
+                if key not in failed:
+                    self._forget_key(key)
+                    deleted.append(key)
+        return deleted
+    
+    def iter_objects(self, prefix):
+        """
+        List the objects under a prefix.
+        
+        Yields:
+            Tuples of (key, last_modified datetime)
+        """
+        paginator = self.s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                yield obj['Key'], obj['LastModified']
+    
     def _get_content_type(self, extension):
         """
         Determine the content type based on file extension.
@@ -160,9 +664,77 @@ class S3Storage:
             '.jpeg': 'image/jpeg',
             '.png': 'image/png',
             '.gif': 'image/gif',
+            '.webp': 'image/webp',
             '.mp4': 'video/mp4',
             '.mp3': 'audio/mpeg',
+            '.m4a': 'audio/mp4',
+            '.m3u8': 'application/vnd.apple.mpegurl',
+            '.ts': 'video/mp2t',
             '.wav': 'audio/wav',
             '.ogg': 'audio/ogg',
         }
-        return content_types.get(extension, 'application/octet-stream') 
\ No newline at end of file
+        return content_types.get(extension, 'application/octet-stream') 
+
+
+class _ProgressCallback:
+    """Turns the transfer manager's per-part byte counts into running totals for one file."""
+    
+    def __init__(self, file_path, progress):
+        self.file_path = file_path
+        self.progress = progress
+        self.total = os.path.getsize(file_path)
+        self.sent = 0
+        self._lock = threading.Lock()
+    
+    def __call__(self, bytes_sent):
+        with self._lock:
+            self.sent += bytes_sent
+            sent = self.sent
+        self.progress(self.file_path, sent, self.total)
+
+
+def _read_part(stream, size):
+    """Read up to size bytes, looping over short reads from pipes."""
+    chunks = []
+    remaining = size
+    while remaining > 0:
+        chunk = stream.read(remaining)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b''.join(chunks)
+
+
+class S3StreamSink:
+    """Output sink that uploads a producer's stdout to S3 as it is written."""
+    
+    def __init__(self, storage, key_prefix='videos', extension='.mp4'):
+        """
+        Initialize the sink.
+        
+        Args:
+            storage: S3Storage to upload with
+            key_prefix: Prefix for the S3 key (folder)
+            extension: File extension of the streamed object
+        """
+        self.storage = storage
+        self.key_prefix = key_prefix
+        self.extension = extension
+        self.url = None
+        self.key = None
+    
+    def consume(self, stream, before_complete=None):
+        """
+        Upload everything read from stream; see S3Storage.upload_stream.
+        
+        Returns:
+            URL of the uploaded object
+        """
+        self.url, self.key = self.storage.upload_stream(
+            stream,
+            self.extension,
+            key_prefix=self.key_prefix,
+            before_complete=before_complete
+        )
+        return self.url
@@ -3,23 +3,20 @@ Background task processing using Celery.
 This module handles moving the video generation process to background workers.
 
 Note: This worker has been modified to support distributed deployment with Render.com
-It downloads files from S3 URLs before processing, and uploads results back to S3.
+It fetches inputs from the configured storage backend (S3, or a volume shared
+with the web service) before processing, and stores results back there.
 """
 
 import os
-import time
-import tempfile
 from celery import Celery
 from celery.exceptions import Ignore # Import Ignore
+from celery.signals import worker_process_init
 import traceback
-import requests
-from urllib.parse import urlparse
 import shutil
 from PIL import Image
 import io
 import re # For parsing XML endpoint
-import boto3 # Add boto3 import
-from botocore.exceptions import ClientError # For boto3 error handling
+import threading
 
 # Try to import magic but don't fail if it's not available
 try:
@@ -65,38 +62,137 @@ app.conf.update(
 
 # Import generator here to avoid circular imports
 from .chibi_clip import ChibiClipGenerator
-# Import S3 storage
-from .storage import S3Storage
+# Import storage backends
+from .storage import S3StreamSink, get_s3_client, get_s3_transfer
+from .backends import get_storage
+from .scratch import get_scratch_manager
+from .inputs import fetch_inputs
+from .lifecycle import (
+    get_object_tracker, run_cleanup, CLEANUP_INTERVAL_SECONDS, OUTPUT_RETENTION_SECONDS
+)
+
+# Delete expired and orphaned stored objects periodically. Run exactly one `celery beat`
+# (its own service): beat embedded in each worker would schedule every sweep once per replica.
+app.conf.beat_schedule = {
+    'cleanup-storage': {
+        'task': 'chibi_clip.tasks.cleanup_storage',
+        'schedule': CLEANUP_INTERVAL_SECONDS,
+    },
+}
 
 # Initialize the generator with env variables
 openai_key = os.getenv("OPENAI_API_KEY")
 imgbb_key = os.getenv("IMGBB_API_KEY")
 runway_key = os.getenv("RUNWAY_API_KEY")
 
-# Determine if we should use S3 storage
-use_s3 = os.getenv('USE_S3_STORAGE', 'false').lower() == 'true'
+# Stream the final video from ffmpeg straight into S3 instead of writing it to Output/ first
+stream_upload = os.getenv('CHIBICLIP_STREAM_UPLOAD', 'true').lower() == 'true'
 
 # Set up output directory
 output_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Output")
 os.makedirs(output_dir, exist_ok=True)
 
+# Objects reused by every task in a worker process (see init_worker_process)
+_worker_resources = {}
+
+
+def _build_worker_resources():
+    """Create the generator and storage handles shared by the tasks of this process."""
+    resources = {
+        "pid": os.getpid(),
+        "generator": ChibiClipGenerator(
+            openai_api_key=openai_key,
+            imgbb_api_key=imgbb_key,
+            runway_api_key=runway_key,
+            verbose=True,
+            output_dir=output_dir
+        ),
+        "s3_client": None,
+        "s3_transfer": None,
+        "storage": None,
+    }
+    # Remove old job outputs in the background (age and size quota, see outputs.py)
+    resources["generator"].outputs.start_eviction()
+    try:
+        resources["storage"] = get_storage()
+        print(f"{resources['storage'].name} storage initialized successfully")
+    except Exception as e:
+        print(f"Error initializing storage: {e}")
+    if resources["storage"] is not None and resources["storage"].name == "s3":
+        region = os.getenv("AWS_REGION")
+        resources["s3_client"] = get_s3_client(region)
+        resources["s3_transfer"] = get_s3_transfer(region)
+    return resources
+
+
+@worker_process_init.connect
+def init_worker_process(**kwargs):
+    """Build the per-process singletons once, right after the prefork child starts."""
+    try:
+        _worker_resources.clear()
+        _worker_resources.update(_build_worker_resources())
+        print(f"Worker process {os.getpid()} resources initialized")
+    except Exception as e:
+        # The first task retries and reports the error (e.g. missing API keys)
+        _worker_resources.clear()
+        print(f"WARNING: Worker process resource initialization failed: {e}")
+
+
+def _upload_progress_logger():
+    """
+    Return a progress callback for one storage.upload_many call.
+
+    The callback prints progress at every quarter of a file. It is called
+    from the upload threads, including concurrently for the parts of one
+    file, so the quarters already printed are kept per call under a lock.
+    """
+    logged = {}
+    lock = threading.Lock()
+
+    def log_progress(file_path, bytes_sent, total_bytes):
+        if not total_bytes:
+            return
+        quarter = min(4, bytes_sent * 4 // total_bytes)
+        with lock:
+            if quarter <= logged.get(file_path, 0):
+                return
+            logged[file_path] = quarter
+        print(f"Uploading {os.path.basename(file_path)}: {quarter * 25}% of {total_bytes} bytes")
+
+    return log_progress
+
+
+def get_worker_resources():
+    """
+    Return this process's shared generator and storage handles.
+
+    Built lazily when worker_process_init did not run (solo pool, eager tasks)
+    or failed.
+    """
+    if _worker_resources.get("pid") != os.getpid():
+        _worker_resources.clear()
+        _worker_resources.update(_build_worker_resources())
+    return _worker_resources
+
 # Register tasks explicitly
 # Create a unique task name that will be consistent across services
 @app.task(bind=True, max_retries=3, name='chibi_clip.tasks.process_clip')
 def process_clip(self, photo_url, audio_url=None, action="running", ratio="9:16", duration=5, 
-                extended_duration=45, use_local_storage=False, birthday_message=None):
+                extended_duration=45, use_local_storage=False, birthday_message=None, renditions=None, hls=False):
     """
     Celery task to process a video clip in the background.
     
     Args:
-        photo_url: S3 URL to the photo
-        audio_url: S3 URL to the audio file (optional)
+        photo_url: Storage URL of the photo
+        audio_url: Storage URL of the audio file, or bundled://<name> for an asset shipped with the worker (optional)
         action: Animation action to use
         ratio: Aspect ratio for the video
         duration: Duration of the video in seconds
         extended_duration: Duration of extended video
         use_local_storage: Whether to use local storage instead of ImgBB
         birthday_message: Optional text to add to video
+        renditions: Optional list of extra renditions (e.g. ["square", "480p", "preview"])
+        hls: Also package the video as HLS and upload the package
         
     Returns:
         Dictionary with paths and URLs to the generated content
@@ -105,201 +201,33 @@ def process_clip(self, photo_url, audio_url=None, action="running", ratio="9:16"
     print(f"DEBUG: Task received with ID: {self.request.id}")
     print(f"DEBUG: Task parameters - photo_url={photo_url}, audio_url={audio_url}")
     print(f"DEBUG: Redis URL: {os.environ.get('REDIS_URL')}")
-    print(f"DEBUG: S3 storage enabled: {use_s3}")
     
     try:
-        # Create a temporary directory for processing
-        with tempfile.TemporaryDirectory() as temp_dir:
+        resources = get_worker_resources()
+        storage = resources["storage"]
+        use_s3 = storage is not None and storage.name == "s3"
+        print(f"DEBUG: Storage backend: {storage.name if storage else None}")
+
+        # Downloaded inputs and the job's intermediates share one scratch workspace
+        # (tmpfs when the node has room), reserved once for the whole job
+        with get_scratch_manager().workspace() as scratch:
+            temp_dir = scratch.path
             photo_path = None # Will be path to local downloaded file
             final_audio_path_for_generator = None # Will be path to local audio for generator
 
-            # --- PHOTO DOWNLOAD ---
-            if photo_url:
-                parsed_url = urlparse(photo_url)
-                filename = os.path.basename(parsed_url.path)
-                if not filename:  # Handle cases like "bucket/" or if path is just "/"
-                    timestamp = int(time.time())
-                    filename = f"downloaded_photo_{timestamp}" # Add timestamp for uniqueness
-                
-                _, ext = os.path.splitext(filename)
-                if not ext: # Ensure there's an extension
-                    # Try to get extension from the photo_url path itself if filename part had none
-                    _, url_ext = os.path.splitext(parsed_url.path)
-                    if url_ext and len(url_ext) <= 5 : # Basic check for a valid-looking extension
-                         filename += url_ext
-                    else:
-                         filename += ".jpg" # Default if no extension found or looks invalid
-                        
-                local_photo_file_path = os.path.join(temp_dir, filename)
-
-                if use_s3: # Global flag indicating if S3 URLs should be treated as S3
-                    print(f"Attempting S3 download for photo: {photo_url}")
-                    aws_region_worker = os.getenv("AWS_REGION")
-                    aws_access_key_id_worker = os.getenv("AWS_ACCESS_KEY_ID")
-                    aws_secret_access_key_worker = os.getenv("AWS_SECRET_ACCESS_KEY")
-                    
-                    if not all([aws_region_worker, aws_access_key_id_worker, aws_secret_access_key_worker]):
-                        raise ValueError("Worker S3 photo download: AWS credentials/region not configured in worker environment.")
-
-                    s3_bucket_name = None
-                    s3_object_key = None
-
-                    if parsed_url.hostname and '.s3.' in parsed_url.hostname: # Standard virtual-hosted style or path-style URL
-                        s3_bucket_name = parsed_url.hostname.split('.')[0]
-                        s3_object_key = parsed_url.path.lstrip('/')
-                    elif parsed_url.scheme == 's3': # s3://bucket/key format
-                        s3_bucket_name = parsed_url.netloc
-                        s3_object_key = parsed_url.path.lstrip('/')
-                    
-                    # If bucket name couldn't be reliably parsed from URL (e.g. path-style S3 access, though less common for new buckets)
-                    # or if key is empty, this might indicate an issue or a need for S3_BUCKET_NAME env var as a fallback.
-                    # For this implementation, we'll rely on bucket being in hostname or s3:// scheme.
-                    if not s3_bucket_name and os.getenv("S3_BUCKET_NAME"): # Fallback if needed and available
-                        s3_bucket_name = os.getenv("S3_BUCKET_NAME")
-                        # In this case, the full photo_url path might be the key
-                        if not s3_object_key: s3_object_key = parsed_url.path.lstrip('/')
-
-
-                    if not s3_bucket_name or not s3_object_key:
-                        raise ValueError(f"Could not determine S3 bucket/key for photo URL: {photo_url}")
-
-                    try:
-                        s3_client = boto3.client(
-                            's3',
-                            aws_access_key_id=aws_access_key_id_worker,
-                            aws_secret_access_key=aws_secret_access_key_worker,
-                            region_name=aws_region_worker
-                        )
-                        print(f"Downloading s3://{s3_bucket_name}/{s3_object_key} to {local_photo_file_path}")
-                        s3_client.download_file(s3_bucket_name, s3_object_key, local_photo_file_path)
-                        photo_path = local_photo_file_path
-                        print(f"S3 Photo Download successful: {photo_path}")
-                    except ClientError as e:
-                        print(f"S3 Photo Download Error for {photo_url} (Key: s3://{s3_bucket_name}/{s3_object_key}): {e}")
-                        raise
-                    except Exception as e:
-                        print(f"Unexpected error during S3 photo download setup for {photo_url}: {e}")
-                        raise
-                else: # Not using S3, assume photo_url is a direct downloadable URL
-                    print(f"Attempting direct HTTP download for photo: {photo_url}")
-                    try:
-                        response = requests.get(photo_url, stream=True, timeout=60)
-                        response.raise_for_status()
-                        
-                        content_type = response.headers.get('Content-Type', '')
-                        final_url_accessed = response.url
-                        print(f"Direct Photo Download: Status {response.status_code}, Content-Type='{content_type}', Final URL='{final_url_accessed}'")
-
-                        if not content_type.startswith('image/'):
-                            # Try to get a preview of the content if it's text-based
-                            preview_text = ""
-                            try:
-                                if "text" in content_type or "xml" in content_type or "json" in content_type :
-                                     preview_text = response.text[:200] # Get first 200 chars
-                                else:
-                                     preview_text = "(binary content)"
-                            except Exception:
-                                preview_text = "(could not read preview)"
-                            raise ValueError(f"Invalid Content-Type '{content_type}' from photo URL {final_url_accessed}. Expected 'image/...'. Preview: {preview_text}")
-                        
-                        with open(local_photo_file_path, 'wb') as f:
-                            for chunk in response.iter_content(chunk_size=8192):
-                                f.write(chunk)
-                        photo_path = local_photo_file_path
-                        print(f"Direct HTTP Photo Download successful: {photo_path}")
-                    except requests.exceptions.RequestException as e:
-                        print(f"Direct HTTP Photo Download Error for {photo_url}: {e}")
-                        raise
-            
-            if photo_path and os.path.exists(photo_path):
-                print(f"Processing downloaded photo: {photo_path}")
-                try:
-                    # Use an alias for PIL.Image to avoid potential conflicts if Image is used elsewhere
-                    from PIL import Image as PILImage, ImageFile as PILImageFile
-                    PILImageFile.LOAD_TRUNCATED_IMAGES = True # Allow loading truncated images
-                    
-                    img = PILImage.open(photo_path)
-                    # Convert to RGBA for consistency, save as PNG (OpenAI prefers PNG)
-                    png_filename = os.path.splitext(os.path.basename(photo_path))[0] + "_standardized.png"
-                    png_path = os.path.join(temp_dir, png_filename)
-                    
-                    if img.mode != 'RGBA':
-                        img = img.convert('RGBA')
-                    img.save(png_path, "PNG")
-                    photo_path = png_path # Update photo_path to the standardized PNG
-                    print(f"Photo standardized to PNG: {photo_path}")
-                except Exception as e_img_proc:
-                    print(f"Warning: Error processing/converting downloaded photo {photo_path} to PNG: {e_img_proc}. Using original download.")
-                    # photo_path remains the initially downloaded file. This might fail later if not a good image.
-            
-            # --- AUDIO DOWNLOAD ---
+            # --- INPUT DOWNLOAD ---
+            # Photo and audio download concurrently; the photo is normalised to PNG
+            # as soon as it arrives, while the audio may still be downloading
             downloaded_audio_file_path = None # Path to the audio file downloaded in this task run
-            if audio_url:
-                parsed_audio_url = urlparse(audio_url)
-                audio_filename = os.path.basename(parsed_audio_url.path)
-                if not audio_filename:
-                    timestamp = int(time.time())
-                    audio_filename = f"downloaded_audio_{timestamp}"
-
-                _, audio_ext = os.path.splitext(audio_filename)
-                if not audio_ext: # Ensure it has an extension
-                    _, url_audio_ext = os.path.splitext(parsed_audio_url.path)
-                    if url_audio_ext and len(url_audio_ext) <=5:
-                        audio_filename += url_audio_ext
-                    else:
-                        audio_filename += ".mp3" # Default audio extension
-                        
-                local_audio_file_path = os.path.join(temp_dir, audio_filename)
-
-                if use_s3: # Global flag for S3
-                    print(f"Attempting S3 download for audio: {audio_url}")
-                    aws_region_worker = os.getenv("AWS_REGION")
-                    aws_access_key_id_worker = os.getenv("AWS_ACCESS_KEY_ID")
-                    aws_secret_access_key_worker = os.getenv("AWS_SECRET_ACCESS_KEY")
-
-                    if not all([aws_region_worker, aws_access_key_id_worker, aws_secret_access_key_worker]):
-                        print("Worker S3 audio download: AWS credentials/region not configured. Skipping S3 audio.")
-                    else:
-                        s3_audio_bucket_name = None
-                        s3_audio_object_key = None
-
-                        if parsed_audio_url.hostname and '.s3.' in parsed_audio_url.hostname:
-                            s3_audio_bucket_name = parsed_audio_url.hostname.split('.')[0]
-                            s3_audio_object_key = parsed_audio_url.path.lstrip('/')
-                        elif parsed_audio_url.scheme == 's3':
-                            s3_audio_bucket_name = parsed_audio_url.netloc
-                            s3_audio_object_key = parsed_audio_url.path.lstrip('/')
-                        
-                        if not s3_audio_bucket_name and os.getenv("S3_BUCKET_NAME"):
-                             s3_audio_bucket_name = os.getenv("S3_BUCKET_NAME")
-                             if not s3_audio_object_key: s3_audio_object_key = parsed_audio_url.path.lstrip('/')
-
-                        if not s3_audio_bucket_name or not s3_audio_object_key:
-                            print(f"Could not determine S3 bucket/key for audio URL: {audio_url}. Skipping S3 audio.")
-                        else:
-                            try:
-                                s3_client_audio = boto3.client('s3', aws_access_key_id=aws_access_key_id_worker, aws_secret_access_key=aws_secret_access_key_worker, region_name=aws_region_worker)
-                                print(f"Downloading s3://{s3_audio_bucket_name}/{s3_audio_object_key} to {local_audio_file_path}")
-                                s3_client_audio.download_file(s3_audio_bucket_name, s3_audio_object_key, local_audio_file_path)
-                                downloaded_audio_file_path = local_audio_file_path
-                                print(f"S3 Audio Download successful: {downloaded_audio_file_path}")
-                            except ClientError as e:
-                                print(f"S3 Audio Download Error for {audio_url} (Key: s3://{s3_audio_bucket_name}/{s3_audio_object_key}): {e}. Proceeding without this audio.")
-                            except Exception as e:
-                                print(f"Unexpected error during S3 audio download for {audio_url}: {e}. Proceeding without this audio.")
-                else: # Not S3, direct URL for audio
-                    print(f"Attempting direct HTTP download for audio: {audio_url}")
-                    try:
-                        response_audio = requests.get(audio_url, stream=True, timeout=30)
-                        response_audio.raise_for_status()
-                        # Optionally, add audio content-type check here if strict validation is needed
-                        with open(local_audio_file_path, 'wb') as f:
-                            for chunk in response_audio.iter_content(chunk_size=8192):
-                                f.write(chunk)
-                        downloaded_audio_file_path = local_audio_file_path
-                        print(f"Direct HTTP Audio Download successful: {downloaded_audio_file_path}")
-                    except requests.exceptions.RequestException as e:
-                        print(f"Direct HTTP Audio Download Error for {audio_url}: {e}. Proceeding without this audio.")
+            if photo_url:
+                photo_path, downloaded_audio_file_path = fetch_inputs(
+                    photo_url,
+                    audio_url,
+                    temp_dir,
+                    use_s3=use_s3,
+                    s3_transfer=resources["s3_transfer"],
+                    storage=storage
+                )
             
             # Determine final audio_path for the ChibiClipGenerator
             if downloaded_audio_file_path and os.path.exists(downloaded_audio_file_path):
@@ -318,23 +246,12 @@ def process_clip(self, photo_url, audio_url=None, action="running", ratio="9:16"
             if not photo_path:
                 raise ValueError("No photo path available for processing")
                 
-            # Initialize the generator
-            generator = ChibiClipGenerator(
-                openai_api_key=openai_key,
-                imgbb_api_key=imgbb_key,
-                runway_api_key=runway_key,
-                verbose=True,
-                output_dir=output_dir
-            )
+            # The generator is shared by every task in this worker process
+            generator = resources["generator"]
             
-            # Initialize S3 storage
-            s3_storage = None
-            if use_s3:
-                try:
-                    s3_storage = S3Storage()
-                    print("S3 storage initialized successfully")
-                except Exception as e:
-                    print(f"Error initializing S3 storage: {e}")
+            # Upload the final video to S3 while it is being encoded (falls back to a
+            # regular upload below if streaming is not possible for this job)
+            video_sink = S3StreamSink(storage, key_prefix="videos") if use_s3 and stream_upload else None
             
             # Process the clip with downloaded files
             result = generator.process_clip(
@@ -345,42 +262,78 @@ def process_clip(self, photo_url, audio_url=None, action="running", ratio="9:16"
                 audio_path=final_audio_path_for_generator,
                 extended_duration=extended_duration,
                 use_local_storage=True,  # Always use local storage in processing
-                birthday_message=birthday_message
+                birthday_message=birthday_message,
+                renditions=renditions,
+                hls=hls,
+                video_sink=video_sink,
+                job_id=self.request.id,  # Retries reuse the job's output namespace
+                scratch=scratch
             )
             
-            # If S3 is enabled, upload the generated files
-            if s3_storage:
-                print("Uploading output files to S3...")
+            # Store the generated files (hard links on a shared volume, uploads to S3)
+            if storage:
+                print(f"Storing output files in {storage.name} storage...")
                 
-                # Upload the generated image if available
+                # Image, video, poster, sprite and renditions upload in parallel
+                uploads = []  # (result field, key prefix, local path)
                 if "local_image_path" in result:
+                    uploads.append(("image", "images", result["local_image_path"]))
+                if "local_video_path" in result:
+                    uploads.append(("video", "videos", result["local_video_path"]))
+                for thumb_name in ("poster", "sprite"):
+                    if result.get(f"{thumb_name}_path"):
+                        uploads.append((thumb_name, "thumbnails", result[f"{thumb_name}_path"]))
+                for name, path in result.get("renditions", {}).items():
+                    if name == "original" and ("local_video_path" in result or "s3_video_key" in result):
+                        continue  # Same file as the video
+                    uploads.append((f"rendition:{name}", "renditions", path))
+
+                futures = storage.upload_many(
+                    [{"file_path": path, "key_prefix": prefix} for _, prefix, path in uploads],
+                    progress=_upload_progress_logger()
+                )
+                uploaded = {}
+                for (field, _, path), future in zip(uploads, futures):
                     try:
-                        # Upload image to S3
-                        s3_image_url, s3_image_key = s3_storage.upload_file(
-                            result["local_image_path"], 
-                            key_prefix="images"
-                        )
-                        # Update result with S3 URL
-                        result["image_url"] = s3_image_url
-                        result["s3_image_key"] = s3_image_key
-                        print(f"Uploaded image to S3: {s3_image_url}")
+                        uploaded[field] = future.result()
+                        print(f"Stored {field}: {uploaded[field][0]}")
                     except Exception as e:
-                        print(f"Error uploading image to S3: {e}")
-                
-                # Upload the generated video if available
-                if "local_video_path" in result:
+                        print(f"Error storing {field} ({path}): {e}")
+
+                for field in ("image", "video"):
+                    if field in uploaded:
+                        result[f"{field}_url"], result[f"s3_{field}_key"] = uploaded[field]
+                for thumb_name in ("poster", "sprite"):
+                    if thumb_name in uploaded:
+                        result[f"{thumb_name}_url"] = uploaded[thumb_name][0]
+                if result.get("renditions"):
+                    result["rendition_urls"] = {}
+                    for name in result["renditions"]:
+                        if name == "original" and "s3_video_key" in result:
+                            result["rendition_urls"][name] = result["video_url"]
+                        elif f"rendition:{name}" in uploaded:
+                            result["rendition_urls"][name] = uploaded[f"rendition:{name}"][0]
+
+                # Upload the HLS package, keeping its relative layout
+                if result.get("hls_dir"):
                     try:
-                        # Upload video to S3
-                        s3_video_url, s3_video_key = s3_storage.upload_file(
-                            result["local_video_path"], 
-                            key_prefix="videos"
-                        )
-                        # Update result with S3 URL
-                        result["video_url"] = s3_video_url
-                        result["s3_video_key"] = s3_video_key
-                        print(f"Uploaded video to S3: {s3_video_url}")
+                        s3_hls_url, s3_hls_key = storage.upload_directory(result["hls_dir"], key_prefix="hls")
+                        playlist_name = os.path.basename(result["hls_playlist_path"])
+                        result["hls_url"] = f"{s3_hls_url}/{playlist_name}"
+                        result["s3_hls_key"] = s3_hls_key
+                        print(f"Stored HLS package: {result['hls_url']}")
                     except Exception as e:
-                        print(f"Error uploading video to S3: {e}")
+                        print(f"Error storing HLS package: {e}")
+
+                # Outputs expire after the configured retention (kept forever by default)
+                output_keys = [result.get("s3_image_key"), result.get("s3_video_key")]
+                output_keys += [key for field, (_, key) in uploaded.items() if field not in ("image", "video")]
+                if result.get("s3_hls_key"):
+                    output_keys.append(f"{result['s3_hls_key']}/")
+                try:
+                    get_object_tracker().track(output_keys, OUTPUT_RETENTION_SECONDS)
+                except Exception as e:
+                    print(f"Warning: Could not record output keys for cleanup: {e}")
             
             return result
             
@@ -401,4 +354,21 @@ def process_clip(self, photo_url, audio_url=None, action="running", ratio="9:16"
         print(traceback.format_exc())
         
         # Retry the task up to 3 times, with exponential backoff for other exceptions
-        self.retry(exc=exc, countdown=2 ** self.request.retries) 
\ No newline at end of file
+        self.retry(exc=exc, countdown=2 ** self.request.retries)
+
+
+@app.task(name='chibi_clip.tasks.cleanup_storage')
+def cleanup_storage():
+    """
+    Periodic task deleting expired inputs/outputs and sweeping orphaned objects.
+    
+    Returns:
+        Dictionary with the number of objects deleted per step
+    """
+    storage = get_worker_resources()["storage"]
+    if storage is None:
+        print("Storage cleanup skipped: storage is not available")
+        return {}
+    summary = run_cleanup(storage, verbose=True)
+    print(f"Storage cleanup finished: {summary}")
+    return summary 
\ No newline at end of file
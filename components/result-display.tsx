@@ -7,9 +7,10 @@ import { useEffect } from "react"
 
 interface ResultDisplayProps {
   resultUrl: string
+  posterUrl?: string | null
 }
 
-export default function ResultDisplay({ resultUrl }: ResultDisplayProps) {
+export default function ResultDisplay({ resultUrl, posterUrl }: ResultDisplayProps) {
   useEffect(() => {
     // Trigger confetti animation when component mounts
     const duration = 3 * 1000
@@ -48,11 +49,22 @@ export default function ResultDisplay({ resultUrl }: ResultDisplayProps) {
   return (
     <div className="flex flex-col items-center justify-center py-8 text-center">
       <div className="mb-6">
-        <div className="inline-flex h-24 w-24 items-center justify-center rounded-full bg-green-100">
-          <svg className="h-12 w-12 text-green-600" fill="none" viewBox="0 0 24 24" stroke="currentColor">
-            <path strokeLinecap="round" strokeLinejoin="round" strokeWidth={2} d="M5 13l4 4L19 7" />
-          </svg>
-        </div>
+        {posterUrl ? (
+          // Poster renders instantly; the video itself is only fetched when played
+          <video
+            controls
+            preload="none"
+            poster={posterUrl}
+            src={resultUrl}
+            className="max-h-96 rounded-lg shadow-md"
+          />
+        ) : (
+          <div className="inline-flex h-24 w-24 items-center justify-center rounded-full bg-green-100">
+            <svg className="h-12 w-12 text-green-600" fill="none" viewBox="0 0 24 24" stroke="currentColor">
+              <path strokeLinecap="round" strokeLinejoin="round" strokeWidth={2} d="M5 13l4 4L19 7" />
+            </svg>
+          </div>
+        )}
       </div>
 
       <h3 className="text-2xl font-bold text-purple-700 mb-2">Your Birthday Card is Ready!</h3>